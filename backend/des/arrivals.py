@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Arrivals - streaming arrival sources for the DES engines
+A source hands out one arrival time per next_time() call, so an engine only
+keeps the next arrival on its event heap instead of the whole arrival process.
+"""
+import math
+
+# length of one arrival_profile slot, in simulated minutes
+PROFILE_SLOT_MINUTES = 60.0
+
+
+class PoissonArrivals:
+    """Poisson arrival times on [start, end) with rate ``rate_per_min``.
+
+    With ``whole_minutes`` each interarrival gap is rounded to a whole number
+    of minutes (at least 1), as the services engines do. ``limit`` caps the
+    number of arrivals handed out. With ``antithetic`` each gap is drawn from
+    ``1 - u`` instead of the uniform ``u`` that expovariate uses.
+    """
+
+    def __init__(self, rng, rate_per_min, end, start=0.0, whole_minutes=False, limit=None, antithetic=False):
+        self.rng = rng
+        self.antithetic = antithetic
+        self.rate_per_min = rate_per_min
+        self.end = end
+        self.t = start
+        self.whole_minutes = whole_minutes
+        self.remaining = limit
+
+    def next_time(self):
+        """Next arrival time, or None once the stream is exhausted."""
+        if self.rate_per_min <= 0 or self.remaining == 0:
+            return None
+        if self.antithetic:
+            # expovariate is -log(1 - u) / rate
+            ia = -math.log(self.rng.random() or 2.0 ** -53) / self.rate_per_min
+        else:
+            ia = self.rng.expovariate(self.rate_per_min)
+        if self.whole_minutes:
+            ia = max(1, int(round(ia)))
+        self.t += ia
+        if self.t >= self.end:
+            self.rate_per_min = 0
+            return None
+        if self.remaining is not None:
+            self.remaining -= 1
+        return self.t
+
+
+class RateProfile:
+    """Piecewise-constant, cyclic arrival rate: ``rate_per_min`` times ``multipliers[slot]``.
+
+    Slot ``k`` covers ``[k * slot, (k + 1) * slot)`` minutes and the list
+    repeats, so 24 hourly multipliers give a daily cycle and 168 a weekly
+    one. ``cum`` holds the cumulative intensity at slot starts.
+    """
+
+    def __init__(self, rate_per_min, multipliers, slot=PROFILE_SLOT_MINUTES):
+        multipliers = [float(m) for m in multipliers]
+        if not multipliers or any(m < 0 or not math.isfinite(m) for m in multipliers):
+            raise ValueError('arrival_profile must be a non-empty list of finite multipliers >= 0')
+        self.slot = slot
+        self.rates = [rate_per_min * m for m in multipliers]
+        self.cum = [0.0]
+        for rate in self.rates:
+            self.cum.append(self.cum[-1] + rate * slot)
+        self.cycle = self.cum[-1]
+        # last slot with a positive rate: rounding can never map an arrival past it
+        self.last = max((k for k, rate in enumerate(self.rates) if rate > 0), default=-1)
+
+    def intensity(self, t):
+        """Expected number of arrivals in [0, t)."""
+        n = len(self.rates)
+        k, rest = divmod(t, self.slot * n)
+        j = min(int(rest // self.slot), n - 1)
+        return k * self.cycle + self.cum[j] + self.rates[j] * (rest - j * self.slot)
+
+
+class ProfileArrivals:
+    """Non-homogeneous Poisson arrival times on [start, end) for a RateProfile.
+
+    Generated by inversion: the points of a unit-rate Poisson process are
+    mapped through the inverse cumulative intensity, so every arrival costs
+    one exponential draw however peaked the profile is (thinning would
+    reject draws in proportion to peak / mean rate). Arrival times only
+    grow, so the current slot is tracked and the inverse needs no search.
+    """
+
+    def __init__(self, rng, profile, end, start=0.0, limit=None, antithetic=False):
+        self.rng = rng
+        self.profile = profile
+        self.end = end
+        self.remaining = limit
+        self.antithetic = antithetic
+        self.done = profile.cycle <= 0
+        self.x = profile.intensity(start)
+        n = len(profile.rates)
+        self.slot_index = int(start // profile.slot)
+        # start time and cumulative intensity of the current slot, and the intensity at its end
+        self.slot_t = self.slot_index * profile.slot
+        self.slot_x = profile.intensity(self.slot_t)
+        self.rate = profile.rates[self.slot_index % n]
+        self.slot_end = self.slot_x + self.rate * profile.slot
+
+    def next_time(self):
+        """Next arrival time, or None once the stream is exhausted."""
+        if self.done or self.remaining == 0:
+            return None
+        if self.antithetic:
+            self.x -= math.log(self.rng.random() or 2.0 ** -53)
+        else:
+            self.x += self.rng.expovariate(1.0)
+        x = self.x
+        if x >= self.slot_end:
+            prof = self.profile
+            rates, slot, n = prof.rates, prof.slot, len(prof.rates)
+            while x >= self.slot_end:
+                self.slot_index += 1
+                self.slot_t += slot
+                self.slot_x = self.slot_end
+                self.rate = rates[self.slot_index % n]
+                self.slot_end += self.rate * slot
+                if self.slot_t >= self.end:
+                    self.done = True
+                    return None
+        t = self.slot_t + (x - self.slot_x) / self.rate
+        if t >= self.end:
+            self.done = True
+            return None
+        if self.remaining is not None:
+            self.remaining -= 1
+        return t
+
+
+class DailyGridArrivals:
+    """``per_day`` evenly spaced whole-minute slots in each of ``days`` days.
+
+    Used for booked appointments and elective case lists: slot i of day d is
+    at ``d*day_minutes + int((i+0.5)*day_minutes/per_day)``.
+    """
+
+    def __init__(self, day_minutes, per_day, days):
+        self.day_minutes = day_minutes
+        self.per_day = per_day
+        self.days = days
+        self.day = 0
+        self.slot = 0
+
+    def next_time(self):
+        """Next slot time, or None after the last slot of the last day."""
+        if self.per_day <= 0 or self.day >= self.days:
+            return None
+        t = self.day * self.day_minutes + int((self.slot + 0.5) * (self.day_minutes / self.per_day))
+        self.slot += 1
+        if self.slot >= self.per_day:
+            self.slot = 0
+            self.day += 1
+        return t
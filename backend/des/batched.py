@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Batched - many replications of a FCFS multi-server queue in lockstep on NumPy
+A single FCFS queue with identical servers needs no event list: the start
+of every service follows from the arrival times and the servers' free times
+(the Kiefer-Wolfowitz form of Lindley's recursion). The recursion steps over
+customers with one vectorized update across all replications, so there is
+no per-event Python dispatch. The bed unit and the clinic's consult stage
+have this structure; their ``method='batched'`` mode runs on these helpers.
+
+    python batched.py bed examples/bed_input.json --replications 200
+
+checks that the batched and event-driven engines agree statistically.
+"""
+import sys
+import json
+import math
+import random
+from argparse import ArgumentParser
+
+from arrivals import RateProfile
+from sampling import substream_seed, invert_intensity, STREAMS
+from streamstats import QuantileSketch, PERCENTILES
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+METHOD = 'batched'
+# replications simulated together; bounds the (replications x customers) arrays
+LOCKSTEP = 128
+# validation: a metric fails when the two means differ by more than this many standard errors
+VALIDATE_Z = 4.0
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError(f'method "{METHOD}" requires numpy')
+
+
+def check_params(p):
+    """Raise ValueError for inputs the batched mode does not model."""
+    if p['rng_streams'] not in STREAMS:
+        raise ValueError(f'unknown rng_streams {p["rng_streams"]!r}, expected one of {STREAMS}')
+    if p['variates'] != 'native':
+        raise ValueError(f'method "{METHOD}" draws native variates only (no antithetic pairs)')
+    if p['series'] != 'none':
+        raise ValueError(f'method "{METHOD}" records no level series')
+
+
+def lockstep_chunks(seeds, size=None):
+    size = size or LOCKSTEP
+    for i in range(0, len(seeds), size):
+        yield seeds[i:i + size]
+
+
+def generators(seed, streams, names):
+    """One NumPy generator per input name: shared, or a substream each as in sampling.Sampler."""
+    if streams == 'shared':
+        gen = np.random.default_rng(seed)
+        return {name: gen for name in names}
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    return {name: np.random.default_rng(substream_seed(seed, name)) for name in names}
+
+
+def poisson_times(gen, rate_per_min, end, profile=None):
+    """Sorted Poisson arrival times in [0, ``end``), drawn all at once.
+
+    Given their number, the points of a Poisson process are independent
+    uniforms on the cumulative intensity, so one Poisson count and one
+    sorted uniform block give the whole stream; a ``profile`` (hourly
+    multipliers) maps them back through the inverse cumulative intensity.
+    """
+    if profile is None:
+        n = gen.poisson(rate_per_min * end) if rate_per_min > 0 and end > 0 else 0
+        return np.sort(gen.random(n)) * end
+    prof = RateProfile(rate_per_min, profile)
+    total = prof.intensity(end) if prof.cycle > 0 else 0.0
+    n = gen.poisson(total) if total > 0 else 0
+    times = invert_intensity(prof, np.sort(gen.random(n)) * total)
+    return times[times < end]
+
+
+def pad(rows, fill):
+    """(len(rows), longest) array of the 1-d ``rows``, padded with ``fill``, and the row lengths."""
+    counts = np.array([len(r) for r in rows], dtype=np.int64)
+    out = np.full((len(rows), int(counts.max(initial=0))), fill, dtype=float)
+    for i, r in enumerate(rows):
+        out[i, :len(r)] = r
+    return out, counts
+
+
+def fifo_starts(arrivals, service, servers):
+    """Service start times of FCFS customers on ``servers`` identical servers.
+
+    ``arrivals`` and ``service`` are (replications, customers) arrays with
+    each row sorted by arrival; padding arrivals are +inf. Customer k starts
+    at the later of its arrival and the earliest time a server is free,
+    and that server is then free ``service`` later. Start times of a row
+    never decrease. With no servers nobody starts (+inf).
+    """
+    reps, customers = arrivals.shape
+    if servers < 1:
+        return np.full(arrivals.shape, np.inf)
+    free = np.zeros((reps, servers))
+    starts = np.empty(arrivals.shape)
+    rows = np.arange(reps)
+    for k in range(customers):
+        j = free.argmin(axis=1)
+        start = np.maximum(arrivals[:, k], free[rows, j])
+        starts[:, k] = start
+        free[rows, j] = start + service[:, k]
+    return starts
+
+
+def queue_seen(ready, starts):
+    """Queue length after each customer joins, itself included.
+
+    ``ready`` is when each customer joins the queue and ``starts`` (not
+    decreasing) when it leaves it, so customer k finds every earlier
+    customer that has not started by ``ready[k]``.
+    """
+    started = np.searchsorted(starts, ready, side='right')
+    return np.arange(1, len(ready) + 1) - started + (starts <= ready)
+
+
+def wait_report(waits, name, digits=1, alpha=0.01):
+    """StreamingStats.report of ``waits`` (a NumPy array), percentiles from the same sketch buckets."""
+    n = len(waits)
+    if n == 0:
+        return {**{f'avg_{name}': 0.0, f'std_{name}': 0.0},
+                **{f'p{p}_{name}': 0.0 for p in PERCENTILES}, f'max_{name}': 0.0}
+    sketch = QuantileSketch(alpha)
+    ordered = np.sort(waits)
+    lo, hi = float(ordered[0]), float(ordered[-1])
+    out = {
+        f'avg_{name}': round(float(waits.mean()), digits),
+        f'std_{name}': round(float(waits.std(ddof=1)) if n > 1 else 0.0, digits),
+    }
+    for p in PERCENTILES:
+        # the sketch answers with the bucket of the order statistic at floor(q * (n - 1))
+        x = float(ordered[int(p / 100.0 * (n - 1))])
+        value = 0.0 if x <= sketch.min_value else \
+            2.0 * sketch.gamma ** math.ceil(math.log(x) * sketch.inv_log_gamma) / (sketch.gamma + 1)
+        out[f'p{p}_{name}'] = round(min(hi, max(lo, value)), digits)
+    out[f'max_{name}'] = round(hi, digits)
+    return out
+
+
+def _standard_error(values):
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean = sum(values) / n
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1) / n)
+
+
+def validate(engine, params, replications=200, seed=None, z=VALIDATE_Z):
+    """Compare ``engine``'s batched mode with its event-driven mode over ``replications`` each.
+
+    For every scalar output the difference of the two means is divided by
+    its standard error; the modes agree when no metric exceeds ``z``.
+    Metrics that are constant in both modes must be equal.
+    """
+    from replication import replication_seed, run_batch
+
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    seeds = [replication_seed(seed, i) for i in range(replications)]
+    des = run_batch(engine, {**params, 'method': 'des'}, seeds)
+    batched = engine.batched({**params, 'method': METHOD}, [replication_seed(f'{seed}/batched', i)
+                                                           for i in range(replications)])
+    metrics, ok = {}, True
+    for key, first in des[0].items():
+        if isinstance(first, bool) or not isinstance(first, (int, float)):
+            continue
+        a = [float(r[key]) for r in des]
+        b = [float(r[key]) for r in batched]
+        diff = sum(b) / len(b) - sum(a) / len(a)
+        se = math.hypot(_standard_error(a), _standard_error(b))
+        score = abs(diff) / se if se > 0 else (0.0 if diff == 0 else math.inf)
+        metrics[key] = {'des': sum(a) / len(a), 'batched': sum(b) / len(b), 'z': round(score, 2)}
+        ok = ok and score <= z
+    return {'replications': replications, 'seed': seed, 'z_limit': z, 'agree': ok, 'metrics': metrics}
+
+
+def main():
+    import engines
+
+    p = ArgumentParser(description='check the batched mode against the event-driven engine')
+    p.add_argument('engine', choices=('bed', 'clinic'))
+    p.add_argument('input', help='path to input JSON')
+    p.add_argument('--replications', type=int, default=200)
+    p.add_argument('--seed', type=int, default=None)
+    args = p.parse_args()
+    with open(args.input, 'r') as f:
+        params = json.load(f)
+    out = validate(engines.get_engine(args.engine), params, args.replications, seed=args.seed)
+    print(json.dumps(out, indent=2))
+    sys.exit(0 if out['agree'] else 1)
+
+
+if __name__ == '__main__':
+    main()
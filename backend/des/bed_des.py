@@ -5,13 +5,30 @@ Reads input JSON and prints JSON summary
 """
 import sys
 import json
-import heapq
 import random
 from argparse import ArgumentParser
 from typing import Dict
 
-ADMIT = 'ADMIT'
-DISCHARGE = 'DISCHARGE'
+from kernel import Simulation
+from sampling import Sampler
+from resources import ServerPool, ClassQueue
+from streamstats import StreamingStats
+from replication import run_replications, compare_scenarios, run_sequential
+from profiler import profile_run
+from eventtrace import trace_run
+from timeseries import series_runner
+from warmup import run_truncated
+from analytic import mmc, check_horizon, with_fast_path, METHODS
+import batched
+
+# Event types
+ADMIT = 0
+DISCHARGE = 1
+RENEGE = 2
+
+# patient classes, in priority order
+CLASSES = ('emergent', 'elective')
+DISCIPLINES = ('fifo', 'priority')
 
 
 def load_params(path: str) -> Dict:
@@ -19,98 +36,390 @@ def load_params(path: str) -> Dict:
         return json.load(f)
 
 
-class Event:
-    def __init__(self, time, etype, data=None):
-        self.time = time
-        self.etype = etype
-        self.data = data or {}
-    def __lt__(self, other):
-        return self.time < other.time
-
-
-def bed_sim(params, seed=None):
-    if seed is not None:
-        random.seed(seed)
-
-    num_beds = int(params.get('num_beds', 50))
-    arrival_rate_per_hour = float(params.get('arrival_rate_per_hour', 5))
-    avg_los_days = float(params.get('avg_los_days', 4))
-    pct_emergent = float(params.get('pct_emergent', 0.2))
-    sim_duration_days = int(params.get('sim_duration_days', 30))
-
-    total_minutes = sim_duration_days * 24 * 60
-    lambda_per_min = arrival_rate_per_hour / 60.0
-
-    events = []
-    t = 0.0
-    # generate arrivals
-    while t < total_minutes:
-        if lambda_per_min<=0:
-            break
-        ia = random.expovariate(lambda_per_min)
-        t += ia
-        if t>=total_minutes:
-            break
-        is_emergent = random.random() < pct_emergent
-        heapq.heappush(events, Event(t, ADMIT, {'emergent': is_emergent, 'arrival': t}))
-
-    beds_free = num_beds
-    queue = []  # waiting for bed
-    max_queue = 0
-    blocked = 0
-    admitted = 0
-    total_occupancy_time = 0.0
-
-    while events:
-        ev = heapq.heappop(events)
-        now = ev.time
-        if ev.etype == ADMIT:
-            # if bed available, admit and schedule discharge
-            if beds_free > 0:
-                beds_free -= 1
-                admitted += 1
-                los_days = random.expovariate(1.0/avg_los_days) if avg_los_days>0 else avg_los_days
-                los_minutes = max(1.0, los_days * 24 * 60)
-                total_occupancy_time += los_minutes
-                discharge_time = now + los_minutes
-                heapq.heappush(events, Event(discharge_time, DISCHARGE, {}))
-            else:
-                # no bed: patient queued
-                queue.append({'arrival': now})
-                max_queue = max(max_queue, len(queue))
-                blocked += 1
-        elif ev.etype == DISCHARGE:
-            beds_free += 1
-            # admit next in queue if any
-            if queue:
-                patient = queue.pop(0)
-                # immediate admit
-                beds_free -= 1
-                admitted += 1
-                los_days = random.expovariate(1.0/avg_los_days) if avg_los_days>0 else avg_los_days
-                los_minutes = max(1.0, los_days * 24 * 60)
-                total_occupancy_time += los_minutes
-                discharge_time = now + los_minutes
-                heapq.heappush(events, Event(discharge_time, DISCHARGE, {}))
-
-    avg_occupancy = round((total_occupancy_time / (num_beds * total_minutes)) * 100, 1) if total_minutes>0 else 0.0
+class BedDES(Simulation):
+    EVENT_NAMES = ('ADMIT', 'DISCHARGE', 'RENEGE')
+    EVENT_HANDLERS = ('on_admit', 'on_discharge', 'on_renege')
+    DEFAULTS = {
+        'num_beds': 50,
+        'arrival_rate_per_hour': 5.0,
+        'avg_los_days': 4.0,
+        'pct_emergent': 0.2,
+        'sim_duration_days': 30,
+        # 'fifo': one line in arrival order; 'priority': emergent patients first, FIFO within a class
+        'queue_discipline': 'fifo',
+        # waiting patients leave (transfer elsewhere) after this many hours; 0: they wait indefinitely
+        'max_wait_hours': 0.0,
+        # hourly rate multipliers, repeated cyclically (None: constant rate)
+        'arrival_profile': None,
+        'sampler': 'auto',
+        'server_policy': 'lowest',
+        'rng_streams': 'shared',
+        'variates': 'native',
+        'series': 'none',
+        # 'des', 'analytic' or 'auto' (analytic when its assumptions hold)
+        'method': 'des',
+    }
+    TUNABLE = ('num_beds', 'arrival_rate_per_hour', 'avg_los_days', 'pct_emergent', 'sim_duration_days',
+               'max_wait_hours', 'arrival_profile')
+
+    def __init__(self, params, seed=None):
+        super().__init__()
+        # per-instance stream so replications can run side by side
+        self.rng = random.Random(seed)
+        p = self.params = self.normalize_params(params)
+
+        self.num_beds = p['num_beds']
+        self.arrival_rate_per_hour = p['arrival_rate_per_hour']
+        self.avg_los_days = p['avg_los_days']
+        self.pct_emergent = p['pct_emergent']
+        self.sim_duration_days = p['sim_duration_days']
+        if p['queue_discipline'] not in DISCIPLINES:
+            raise ValueError(f'unknown queue_discipline {p["queue_discipline"]!r}, expected one of {DISCIPLINES}')
+        self.priority = p['queue_discipline'] == 'priority'
+        self.max_wait_minutes = p['max_wait_hours'] * 60
+
+        self.total_minutes = self.sim_duration_days * 24 * 60
+        self.lambda_per_min = self.arrival_rate_per_hour / 60.0
+
+        # random draws: NumPy blocks when available, else self.rng
+        self.sampler = Sampler(self.rng, seed, backend=p['sampler'],
+                               streams=p['rng_streams'], variates=p['variates'])
+        self.arrivals = self.sampler.poisson_arrivals(self.lambda_per_min, self.total_minutes,
+                                                      profile=p['arrival_profile'])
+        self.draw_emergent = self.sampler.bernoulli(self.pct_emergent, stream='emergent')
+        self.draw_los_days = self.sampler.exponential(1.0/self.avg_los_days, stream='los') if self.avg_los_days>0 else None
+
+        self.beds = ServerPool(self.num_beds, p['server_policy'], self.sampler.stream('servers')[0])
+        # waiting for a bed: one line under fifo, one per class under priority
+        self.queue = ClassQueue(len(CLASSES) if self.priority else 1)
+        self.max_queue = 0
+        self.blocked = 0
+        self.admitted = 0
+        self.arrived = 0
+        self.total_occupancy_time = 0.0
+        # (removed at, stay end) of beds removed by a shrink while occupied, by bed
+        self.removed_stays = {}
+        # the same spans cut short when their bed came back
+        self.returned_stays = []
+        self.reset_class_stats()
+
+    def reset_class_stats(self):
+        # waits of admitted patients and counts, per class
+        self.class_waits = [StreamingStats() for _ in CLASSES]
+        self.class_admitted = [0] * len(CLASSES)
+        self.class_blocked = [0] * len(CLASSES)
+        self.class_reneged = [0] * len(CLASSES)
+
+    def schedule_next_arrival(self):
+        # only the next admission is ever on the heap
+        t = self.arrivals.next_time()
+        if t is not None:
+            is_emergent = self.draw_emergent()
+            self.arrived += 1
+            self.schedule(t, ADMIT, (self.arrived, is_emergent))
+
+    def start_stay(self, now, bed, patient, wait=0.0):
+        self.admitted += 1
+        cls = 0 if patient[1] else 1
+        self.class_admitted[cls] += 1
+        self.class_waits[cls].add(wait)
+        los_days = self.draw_los_days() if self.draw_los_days is not None else self.avg_los_days
+        los_minutes = max(1.0, los_days * 24 * 60)
+        # occupancy counts only the part of the stay inside the horizon
+        self.total_occupancy_time += max(0.0, min(los_minutes, self.total_minutes - now))
+        self.beds.busy_time[bed] += los_minutes
+        self.schedule(now + los_minutes, DISCHARGE, (bed, patient))
+
+    def on_admit(self, now, patient):
+        self.schedule_next_arrival()
+        self.admit(now, patient)
+
+    def add_patient(self, now, emergent):
+        """Admission from outside the unit's own arrival stream (e.g. after surgery)."""
+        self.arrived += 1
+        self.admit(now, (self.arrived, emergent))
+
+    def admit(self, now, patient):
+        # if bed available, admit and schedule discharge
+        bed = self.beds.acquire()
+        if bed is not None:
+            self.start_stay(now, bed, patient)
+        else:
+            # no bed: patient queued
+            cls = 0 if patient[1] else 1
+            self.queue.push(patient, cls if self.priority else 0, now)
+            self.max_queue = max(self.max_queue, len(self.queue))
+            self.blocked += 1
+            self.class_blocked[cls] += 1
+            if self.max_wait_minutes > 0:
+                self.schedule(now + self.max_wait_minutes, RENEGE, patient)
+
+    def on_discharge(self, now, data):
+        bed = data[0]
+        # admit next in queue if any, straight into the freed bed unless it was removed
+        if self.queue:
+            bed = self.beds.handoff(bed)
+            if bed is not None:
+                patient, since = self.queue.pop()
+                self.start_stay(now, bed, patient, now - since)
+        else:
+            self.beds.release(bed)
+
+    def on_renege(self, now, patient):
+        # a no-op when the patient got a bed in time
+        if self.queue.discard(patient) is not None:
+            self.class_reneged[0 if patient[1] else 1] += 1
+
+    def levels(self):
+        return {'occupied_beds': self.beds.num_busy, 'bed_queue': len(self.queue)}
 
+    def trace_fields(self, etype, data):
+        if etype != DISCHARGE:
+            patient_id, emergent = data
+            return -1, patient_id, int(emergent)
+        bed, (patient_id, emergent) = data
+        return bed, patient_id, int(emergent)
+
+    def retune(self, old, new):
+        changed = {k for k in new if new[k] != old[k]}
+        if 'num_beds' in changed:
+            self.num_beds = new['num_beds']
+            self.beds.resize(self.num_beds)
+            now, discharge = self.now, DISCHARGE + self.event_base
+            # an occupied removed bed stays in service until its patient leaves
+            for t, _, etype, data in self.events:
+                if etype == discharge and data[0] >= self.num_beds and data[0] not in self.removed_stays:
+                    self.removed_stays[data[0]] = (now, t)
+            for bed in [b for b in self.removed_stays if b < self.num_beds]:
+                removed, end = self.removed_stays.pop(bed)
+                self.returned_stays.append((removed, min(end, now)))
+        if 'avg_los_days' in changed:
+            self.avg_los_days = new['avg_los_days']
+            self.draw_los_days = self.sampler.exponential(1.0/self.avg_los_days, stream='los') if self.avg_los_days>0 else None
+        if 'pct_emergent' in changed:
+            self.pct_emergent = new['pct_emergent']
+            self.draw_emergent = self.sampler.bernoulli(self.pct_emergent, stream='emergent')
+        # patients already waiting keep the limit they joined under
+        self.max_wait_minutes = new['max_wait_hours'] * 60
+        if changed & {'arrival_rate_per_hour', 'sim_duration_days', 'arrival_profile'}:
+            self.arrival_rate_per_hour = new['arrival_rate_per_hour']
+            self.sim_duration_days = new['sim_duration_days']
+            self.total_minutes = self.sim_duration_days * 24 * 60
+            self.lambda_per_min = self.arrival_rate_per_hour / 60.0
+            # Poisson arrivals are memoryless: restart the stream from now
+            self.cancel_events(ADMIT)
+            self.arrivals = self.sampler.poisson_arrivals(self.lambda_per_min, self.total_minutes, start=self.now,
+                                                          profile=new['arrival_profile'])
+            self.schedule_next_arrival()
+
+    def reset_stats(self):
+        super().reset_stats()
+        self.admitted = 0
+        self.blocked = 0
+        self.max_queue = len(self.queue)
+        self.reset_class_stats()
+        # stays are counted at admission; keep what is left of the current ones
+        self.total_occupancy_time = self.remaining_time(DISCHARGE, until=self.total_minutes)
+
+    def summary(self):
+        total_minutes = self.total_minutes - self.stats_start
+        waits = StreamingStats()
+        for class_waits in self.class_waits:
+            waits.merge(class_waits)
+        # bed minutes available: the current beds plus removed ones until their last stay ends
+        available = self.num_beds * total_minutes + sum(
+            max(0.0, min(end, self.total_minutes) - max(removed, self.stats_start))
+            for removed, end in [*self.removed_stays.values(), *self.returned_stays])
+        avg_occupancy = round((self.total_occupancy_time / available) * 100, 1) if available>0 else 0.0
+
+        out = {
+            'num_beds': self.num_beds,
+            'admitted': self.admitted,
+            'blocked': self.blocked,
+            'avg_occupancy_percent': avg_occupancy,
+            'max_queue_length': self.max_queue,
+            'reneged': sum(self.class_reneged),
+            **waits.report('wait_minutes'),
+        }
+        for i, name in enumerate(CLASSES):
+            out[f'admitted_{name}'] = self.class_admitted[i]
+            out[f'blocked_{name}'] = self.class_blocked[i]
+            out[f'reneged_{name}'] = self.class_reneged[i]
+            out.update(self.class_waits[i].report(f'wait_minutes_{name}'))
+        return out
+
+    def start(self):
+        self.schedule_next_arrival()
+
+
+def bed_analytic(params):
+    """Steady-state M/M/c (Erlang C) answer: ``(result, None)``, or ``(None, reason)``.
+
+    The engine is M/M/c with an unbounded queue: Poisson admissions,
+    exponential LOS, FCFS. ``blocked`` counts admissions that found every
+    bed taken, i.e. arrivals times the Erlang C waiting probability.
+    ``max_queue_length`` has no closed form and is left out.
+    """
+    p = BedDES.normalize_params(params)
+    beds = p['num_beds']
+    los = p['avg_los_days'] * 24 * 60
+    lam = p['arrival_rate_per_hour'] / 60.0
+    profile = p['arrival_profile']
+    if profile is not None:
+        if len(set(profile)) > 1:
+            return None, 'arrival_profile is not constant'
+        lam *= float(profile[0])
+    if p['max_wait_hours'] > 0:
+        return None, 'reneging (max_wait_hours) is not modelled'
+    if beds < 1 or los <= 0 or lam <= 0:
+        return None, 'needs num_beds >= 1, avg_los_days > 0 and arrival_rate_per_hour > 0'
+    horizon = p['sim_duration_days'] * 24 * 60
+    reason = check_horizon(horizon, los, beds, lam * los / beds)
+    if reason:
+        return None, reason
+    m = mmc(lam, 1.0 / los, beds)
+    arrivals = lam * horizon
     return {
-        'num_beds': num_beds,
-        'admitted': admitted,
-        'blocked': blocked,
-        'avg_occupancy_percent': avg_occupancy,
-        'max_queue_length': max_queue
-    }
+        'num_beds': beds,
+        'admitted': round(arrivals - m['mean_queue_length'], 1),
+        'blocked': round(arrivals * m['p_wait'], 1),
+        'avg_occupancy_percent': round(m['utilization'] * 100, 1),
+        'avg_wait_minutes': round(m['mean_wait'], 1),
+        'avg_queue_length': round(m['mean_queue_length'], 2),
+        'model': 'M/M/c',
+    }, None
+
+
+def bed_batched(params, seeds):
+    """``bed_sim(params, seed=s)`` for every seed in ``seeds``, simulated in lockstep on NumPy.
+
+    The unit is a FCFS queue on identical beds, so admission times follow
+    from batched.fifo_starts without events; every metric is then computed
+    as BedDES computes it. Results are statistically equivalent to the
+    event-driven engine, not equal draw for draw. The FIFO line without
+    reneging is the only discipline modelled.
+    """
+    batched.require_numpy()
+    np = batched.np
+    p = BedDES.normalize_params(params)
+    batched.check_params(p)
+    if p['queue_discipline'] != 'fifo' or p['max_wait_hours'] > 0:
+        raise ValueError(f'method "{batched.METHOD}" models the fifo queue_discipline without max_wait_hours')
+    beds = p['num_beds']
+    horizon = p['sim_duration_days'] * 24 * 60
+    lam = p['arrival_rate_per_hour'] / 60.0
+    los_days = p['avg_los_days']
+    results = []
+    for chunk in batched.lockstep_chunks(list(seeds)):
+        arrivals, stays, emergent = [], [], []
+        for seed in chunk:
+            gens = batched.generators(seed, p['rng_streams'], ('arrivals', 'los', 'emergent'))
+            a = batched.poisson_times(gens['arrivals'], lam, horizon, p['arrival_profile'])
+            days = gens['los'].exponential(los_days, len(a)) if los_days > 0 else np.full(len(a), los_days)
+            arrivals.append(a)
+            stays.append(np.maximum(1.0, days * 24 * 60))
+            emergent.append(gens['emergent'].random(len(a)) < p['pct_emergent'])
+        a_all, counts = batched.pad(arrivals, np.inf)
+        s_all, _ = batched.pad(stays, 0.0)
+        starts = batched.fifo_starts(a_all, s_all, beds)
+        for r, n in enumerate(counts):
+            a, start, los = a_all[r, :n], starts[r, :n], s_all[r, :n]
+            waited = start > a
+            admitted = np.isfinite(start)
+            # occupancy counts only the part of the stay inside the horizon
+            occupancy = float(np.minimum(los, np.maximum(0.0, horizon - start)).sum())
+            queue = batched.queue_seen(a, start)[waited]
+            out = {
+                'num_beds': beds,
+                'admitted': int(admitted.sum()),
+                'blocked': int(waited.sum()),
+                'avg_occupancy_percent': round(occupancy / (beds * horizon) * 100, 1) if beds * horizon > 0 else 0.0,
+                'max_queue_length': int(queue.max(initial=0)),
+                'reneged': 0,
+                **batched.wait_report((start - a)[admitted], 'wait_minutes'),
+            }
+            for name, in_class in zip(CLASSES, (emergent[r], ~emergent[r])):
+                out[f'admitted_{name}'] = int((admitted & in_class).sum())
+                out[f'blocked_{name}'] = int((waited & in_class).sum())
+                out[f'reneged_{name}'] = 0
+                out.update(batched.wait_report((start - a)[admitted & in_class], f'wait_minutes_{name}'))
+            results.append(out)
+    return results
+
+
+def bed_sim(params, seed=None, profile=False, trace=None):
+    method = BedDES.normalize_params(params)['method']
+    if method == batched.METHOD:
+        if profile or trace:
+            raise ValueError(f'method "{batched.METHOD}" has no event loop to profile or trace')
+        return bed_batched(params, [seed])[0]
+
+    def des():
+        sim = BedDES(params, seed=seed)
+        run = series_runner(sim, profile_run if profile else BedDES.run)
+        return trace_run(sim, trace, run, {'seed': seed}) if trace else run(sim)
+    return with_fast_path(method, lambda: bed_analytic(params), des)
+
+
+# replication.run_batch hands whole seed lists to this under method 'batched'
+bed_sim.batched = bed_batched
 
 
 def main():
     p = ArgumentParser()
     p.add_argument('input', help='path to input JSON')
     p.add_argument('--seed', type=int, help='seed', default=None)
+    p.add_argument('--replications', type=int, help='number of independent replications', default=1)
+    p.add_argument('--workers', type=int, help='worker processes for replications (default: all cores)', default=None)
+    p.add_argument('--profile', action='store_true', help='add an event-loop profile to the output')
+    p.add_argument('--trace', help='record every event to this binary trace file', default=None)
+    p.add_argument('--truncate-warmup', action='store_true', help='detect the warm-up (MSER-5) and drop it from every metric')
+    p.add_argument('--precision', type=float, help='target relative half-width for the suggested horizon', default=0.05)
+    p.add_argument('--antithetic', action='store_true', help='run replications as antithetic pairs')
+    p.add_argument('--compare', help='second input JSON; report its differences from the first', default=None)
+    p.add_argument('--no-crn', action='store_true', help='with --compare, use independent instead of common random numbers')
+    p.add_argument('--target-precision', type=float, help='replicate until each metric\'s relative CI half-width is below this',
+                   default=None)
+    p.add_argument('--metric', action='append', help='metric the target applies to (repeatable, default: all)', default=None)
+    p.add_argument('--max-replications', type=int, help='replication budget for --target-precision', default=1000)
+    p.add_argument('--max-seconds', type=float, help='time budget for --target-precision', default=None)
+    p.add_argument('--method', choices=METHODS + (batched.METHOD,),
+                   help='des, analytic (closed form), auto (analytic when it applies) '
+                        'or batched (replications in lockstep on NumPy)', default=None)
     args = p.parse_args()
+    replicated = args.replications > 1 or args.antithetic or args.compare or args.target_precision
+    if (args.profile or args.trace or args.truncate_warmup) and replicated:
+        p.error('--profile, --trace and --truncate-warmup run a single replication')
+    if args.target_precision and (args.antithetic or args.compare):
+        p.error('--target-precision cannot be combined with --antithetic or --compare')
     params = load_params(args.input)
-    out = bed_sim(params, seed=args.seed)
+    if args.method:
+        params['method'] = args.method
+    if params.get('method') == batched.METHOD and (args.antithetic or args.truncate_warmup or args.profile or args.trace):
+        p.error(f'--antithetic, --truncate-warmup, --profile and --trace need an event-driven method, not {batched.METHOD}')
+    if args.target_precision:
+        try:
+            out = run_sequential(bed_sim, params, args.target_precision, metrics=args.metric, seed=args.seed,
+                                 max_replications=args.max_replications, max_seconds=args.max_seconds,
+                                 workers=args.workers)
+        except ValueError as e:
+            p.error(str(e))
+    elif args.compare:
+        other = load_params(args.compare)
+        if args.method:
+            other['method'] = args.method
+        out = compare_scenarios(bed_sim, params, other, max(2, args.replications), seed=args.seed,
+                                crn=not args.no_crn, workers=args.workers)
+    elif replicated:
+        out = run_replications(bed_sim, params, args.replications, seed=args.seed, workers=args.workers,
+                               antithetic=args.antithetic)
+    elif args.truncate_warmup:
+        out = run_truncated(BedDES, params, seed=args.seed, precision=args.precision)
+    else:
+        try:
+            out = bed_sim(params, seed=args.seed, profile=args.profile, trace=args.trace)
+        except ValueError as e:
+            p.error(str(e))
     print(json.dumps(out, indent=2))
 
 
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmark - fixed-seed performance scenarios for the DES engines
+Reports wall time, events/s, peak event-heap size and peak RSS per scenario,
+writes them to a JSON baseline and compares later runs against it.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import platform
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+
+from engines import ENGINE_CLASSES
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples')
+SEED = 12345
+# hourly multipliers with mean 1: quiet nights, a morning and an evening peak
+PEAKED_DAY = [0.3] * 7 + [2.5, 2.5, 1.8, 1.4, 1.2, 1.2, 1.2, 1.2, 1.2, 1.4, 1.8, 1.8, 1.0, 0.6, 0.5, 0.3, 0.3]
+# lower is better for every compared metric except events_per_second
+COMPARED = ('wall_seconds', 'events_per_second', 'peak_heap_events', 'peak_rss_kb')
+
+
+def _example(name):
+    with open(os.path.join(EXAMPLES, name)) as f:
+        return json.load(f)
+
+
+def scenarios():
+    """Scenario name -> (engine, params), from the shipped examples up to 1-year / 1,000-bed runs.
+
+    The sampler is pinned to ``random`` so event counts do not depend on
+    whether NumPy is installed.
+    """
+    bed, clinic, orp = _example('bed_input.json'), _example('clinic_input.json'), _example('or_input.json')
+    out = {
+        'bed/example': ('bed', bed),
+        'bed/1y': ('bed', {**bed, 'sim_duration_days': 365}),
+        # ~85% occupancy: 1000 beds * 0.85 / (4 days * 24 h)
+        'bed/1000beds-1y': ('bed', {**bed, 'num_beds': 1000, 'arrival_rate_per_hour': 8.85,
+                                    'sim_duration_days': 365}),
+        # same mean rate with a peaked daily profile
+        'bed/1000beds-peaked-1y': ('bed', {**bed, 'num_beds': 1000, 'arrival_rate_per_hour': 8.85,
+                                           'sim_duration_days': 365, 'arrival_profile': PEAKED_DAY}),
+        'clinic/example': ('clinic', clinic),
+        'clinic/1y': ('clinic', {**clinic, 'sim_duration_days': 365}),
+        # ~85% doctor utilization: 100 doctors * 60 / 20 min * 0.85
+        'clinic/100doctors-30d': ('clinic', {**clinic, 'num_doctors': 100, 'avg_arrivals_per_hour': 255,
+                                             'sim_duration_days': 30}),
+        'or/example': ('or', orp),
+        'or/1y': ('or', {**orp, 'sim_duration_days': 365}),
+        'or/40ors-1y': ('or', {**orp, 'num_ors': 40, 'avg_arrivals_per_hour': 12, 'sim_duration_days': 365}),
+        'hospital/example': ('hospital', _example('hospital_input.json')),
+    }
+    return {name: (engine, {**params, 'sampler': 'random'}) for name, (engine, params) in out.items()}
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure(engine, params, seed=SEED, repeat=3):
+    """Benchmark one scenario in the current process.
+
+    Wall time is the best of ``repeat`` plain runs. The peak event-heap size
+    comes from one extra run with ``schedule`` instrumented, so the timed
+    runs carry no bookkeeping.
+    """
+    cls = ENGINE_CLASSES[engine]
+    best = None
+    for _ in range(repeat):
+        sim = cls(params, seed=seed)
+        t0 = time.perf_counter()
+        result = sim.run()
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    events = sim.events_processed
+
+    sim = cls(params, seed=seed)
+    peak = 0
+    schedule = sim.schedule
+
+    def counting_schedule(*args):
+        nonlocal peak
+        schedule(*args)
+        if len(sim.events) > peak:
+            peak = len(sim.events)
+
+    sim.schedule = counting_schedule
+    sim.run()
+
+    digest = hashlib.sha256(json.dumps(result, sort_keys=True).encode()).hexdigest()[:16]
+    return {
+        'engine': engine,
+        'wall_seconds': best,
+        'events': events,
+        'events_per_second': events / best if best > 0 else None,
+        'peak_heap_events': peak,
+        'peak_rss_kb': peak_rss_kb(),
+        'result_digest': digest,
+    }
+
+
+def run_isolated(name, repeat):
+    """Run scenario ``name`` in a fresh interpreter so peak RSS is its own."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--scenario', name, '--repeat', str(repeat), '--child']
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def run_suite(names=None, repeat=3, log=sys.stderr):
+    results = {}
+    for name in names or scenarios():
+        results[name] = run_isolated(name, repeat)
+        r = results[name]
+        log.write(f'{name:24s} {r["wall_seconds"]:8.3f}s {r["events_per_second"]:12,.0f} ev/s '
+                  f'heap {r["peak_heap_events"]:6d}  rss {r["peak_rss_kb"]} KiB\n')
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': SEED,
+        'scenarios': results,
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    """Regressions of ``current`` against ``baseline`` beyond ``threshold`` (relative).
+
+    Returns a list of ``{scenario, metric, baseline, current, change}``.
+    A changed ``result_digest`` is reported too: the scenario no longer
+    does the same work, so its timings are not comparable.
+    """
+    regressions = []
+    for name, cur in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        if cur['result_digest'] != base['result_digest']:
+            regressions.append({'scenario': name, 'metric': 'result_digest', 'baseline': base['result_digest'],
+                                'current': cur['result_digest'], 'change': None})
+        for metric in COMPARED:
+            old, new = base.get(metric), cur.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < -threshold if metric == 'events_per_second' else change > threshold
+            if worse:
+                regressions.append({'scenario': name, 'metric': metric, 'baseline': old,
+                                    'current': new, 'change': change})
+    return regressions
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('--scenario', action='append', help='run only this scenario (repeatable)', default=None)
+    p.add_argument('--list', action='store_true', help='list scenario names and exit')
+    p.add_argument('--repeat', type=int, help='timed runs per scenario, best is kept', default=3)
+    p.add_argument('--output', help='write results to this JSON file (e.g. a new baseline)', default=None)
+    p.add_argument('--compare', help='baseline JSON to compare against', default=None)
+    p.add_argument('--threshold', type=float, help='relative change counted as a regression', default=0.1)
+    p.add_argument('--child', action='store_true', help=SUPPRESS)
+    args = p.parse_args()
+    table = scenarios()
+    if args.list:
+        print('\n'.join(table))
+        return
+    for name in args.scenario or ():
+        if name not in table:
+            p.error(f'unknown scenario {name!r}')
+    if args.child:
+        engine, params = table[args.scenario[0]]
+        print(json.dumps(measure(engine, params, repeat=args.repeat)))
+        return
+
+    current = run_suite(args.scenario, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        for r in regressions:
+            if r['change'] is None:
+                print(f'{r["scenario"]}: results changed ({r["baseline"]} -> {r["current"]})')
+            else:
+                print(f'{r["scenario"]}: {r["metric"]} {r["baseline"]:.4g} -> {r["current"]:.4g} ({r["change"]:+.1%})')
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions beyond {args.threshold:.0%}')
+    elif not args.output:
+        print(json.dumps(current, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Capacity - smallest resource count that meets a service target
+The metric is assumed monotone in the resource (more beds never block more),
+so the count is found by galloping from the input's value and bisecting.
+Every probe replicates in parallel only until its confidence interval is
+clear of the target, and replications of earlier probes are kept.
+"""
+import os
+import re
+import json
+import time
+import random
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from engines import get_engine
+from replication import replication_seed, run_batch, mean_std_ci
+
+# the upward search stops at this multiple of the input's count unless given a maximum
+HIGH_FACTOR = 4
+# engine -> resource counted by default
+RESOURCES = {'bed': 'num_beds', 'clinic': 'num_doctors', 'or': 'num_ors'}
+# "metric op value" or "metric/denominator op value", e.g. "blocked/admitted < 0.02"
+TARGET = re.compile(r'^\s*(\w+)\s*(?:/\s*(\w+))?\s*(<=|>=|<|>)\s*([-+0-9.eE]+)\s*$')
+OPERATORS = {
+    '<': lambda x, y: x < y,
+    '<=': lambda x, y: x <= y,
+    '>': lambda x, y: x > y,
+    '>=': lambda x, y: x >= y,
+}
+
+
+def parse_target(text):
+    """(metric, denominator or None, operator, value) of a target such as ``p90_wait_minutes <= 30``."""
+    m = TARGET.match(text)
+    if not m:
+        raise ValueError(f'cannot parse target {text!r}; expected e.g. "p90_wait_minutes <= 30" '
+                         f'or "blocked/admitted < 0.02"')
+    metric, per, op, value = m.groups()
+    return metric, per, op, float(value)
+
+
+def target_value(result, metric, per):
+    """The target's metric in one replication's result; a ratio of 0/0 counts as 0."""
+    if metric not in result or (per is not None and per not in result):
+        missing = metric if metric not in result else per
+        raise ValueError(f'unknown metric {missing!r}; expected one of '
+                         f'{sorted(k for k, v in result.items() if isinstance(v, (int, float)))}')
+    if per is None:
+        return float(result[metric])
+    return float(result[metric]) / result[per] if result[per] else 0.0
+
+
+class CapacitySearch:
+    """Probes of one capacity search; ``decide(count)`` says whether ``count`` meets the target.
+
+    Replication i of every probe uses the same seed and per-input random
+    streams (common random numbers), so neighbouring counts see the same
+    patients and their comparison is not blurred by noise. A probe starts
+    with ``min_replications`` and doubles until the confidence interval of
+    the metric lies wholly on one side of the target or ``max_replications``
+    is reached; then the mean decides and the probe is marked ambiguous.
+    Probing a count again adds to its replications instead of rerunning them.
+    """
+
+    def __init__(self, engine, params, resource, target, seed, confidence=0.95, min_replications=10,
+                 max_replications=160, workers=None, pool=None):
+        self.engine = engine
+        self.params = {**params, 'rng_streams': 'per_input'}
+        self.resource = resource
+        self.metric, self.per, self.op, self.value = parse_target(target)
+        self.seed = seed
+        self.confidence = confidence
+        self.min_replications = max(2, min_replications)
+        self.max_replications = max(self.min_replications, max_replications)
+        self.workers = workers
+        self.pool = pool
+        # count -> metric value of each replication so far
+        self.values = {}
+        self.probes = []
+
+    def replicate(self, count, n):
+        values = self.values.setdefault(count, [])
+        if n > len(values):
+            seeds = [replication_seed(self.seed, i) for i in range(len(values), n)]
+            results = run_batch(self.engine, {**self.params, self.resource: count}, seeds,
+                                workers=self.workers, pool=self.pool)
+            values += [target_value(r, self.metric, self.per) for r in results]
+        return values
+
+    def decide(self, count):
+        meets = OPERATORS[self.op]
+        n = max(self.min_replications, len(self.values.get(count, ())))
+        while True:
+            ci = mean_std_ci(self.replicate(count, n), self.confidence)
+            # clear once the whole interval is on one side of the target
+            if meets(ci['ci_low'], self.value) and meets(ci['ci_high'], self.value):
+                decision, clear = True, True
+            elif not meets(ci['ci_low'], self.value) and not meets(ci['ci_high'], self.value):
+                decision, clear = False, True
+            elif n >= self.max_replications:
+                decision, clear = meets(ci['mean'], self.value), False
+            else:
+                n = min(2 * n, self.max_replications)
+                continue
+            break
+        self.probes.append({
+            self.resource: count,
+            'replications': ci['n'],
+            'mean': ci['mean'],
+            'ci_low': ci['ci_low'],
+            'ci_high': ci['ci_high'],
+            'meets_target': decision,
+            'clear': clear,
+        })
+        return decision
+
+
+def find_capacity(engine, params, resource, target, seed=None, low=1, high=None, confidence=0.95,
+                  min_replications=10, max_replications=160, workers=None, pool=None):
+    """Smallest ``resource`` count in [low, high] whose ``engine`` results meet ``target``.
+
+    The search starts at the count in ``params`` and gallops (steps 1, 2,
+    4, ...) down while the target is met or up until it is, then bisects
+    the last gap. ``high`` (default: four times the starting count) caps
+    the upward search. The upward search also gives up when a probe's mean
+    moves no closer to the target than the previous one's, as when the
+    target points the wrong way or the metric levels off short of it. Then
+    ``capacity`` is None, ``stopped`` says why and ``estimate`` is the last
+    probe.
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    if high is not None and high < low:
+        raise ValueError('high must be >= low')
+    workers = workers or os.cpu_count() or 1
+    own_pool = None
+    if pool is None and workers > 1:
+        pool = own_pool = ProcessPoolExecutor(max_workers=workers)
+    started = time.perf_counter()
+    search = CapacitySearch(engine, params, resource, target, seed, confidence=confidence,
+                            min_replications=min_replications, max_replications=max_replications,
+                            workers=workers, pool=pool)
+    start = int(params.get(resource, low))
+    if high is None:
+        high = max(low, HIGH_FACTOR * start)
+    start = max(low, min(high, start))
+    # the mean moves this way as the count grows, if the target is reachable
+    towards = -1.0 if search.op in ('<', '<=') else 1.0
+    stopped = 'found'
+    # invariant once both are set: lo misses the target, hi meets it
+    lo = hi = None
+    try:
+        step = 1
+        if search.decide(start):
+            hi = start
+            while hi > low:
+                n = max(low, hi - step)
+                if search.decide(n):
+                    hi = n
+                    step *= 2
+                else:
+                    lo = n
+                    break
+        else:
+            lo = start
+            stopped = 'max'
+            while lo < high:
+                n = min(high, lo + step)
+                previous = search.probes[-1]['mean']
+                if search.decide(n):
+                    hi = n
+                    stopped = 'found'
+                    break
+                lo = n
+                step *= 2
+                if towards * (search.probes[-1]['mean'] - previous) <= 0:
+                    stopped = 'no_improvement'
+                    break
+        if hi is not None and lo is not None:
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if search.decide(mid):
+                    hi = mid
+                else:
+                    lo = mid
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+    return {
+        'resource': resource,
+        'target': target,
+        'capacity': hi,
+        'stopped': stopped,
+        'estimate': search.probes[-1] if hi is None else None,
+        'seed': seed,
+        'confidence': confidence,
+        'probes': search.probes,
+        'replications': sum(len(v) for v in search.values.values()),
+        'ambiguous': [p[resource] for p in search.probes if not p['clear']],
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('engine', choices=sorted(RESOURCES))
+    p.add_argument('input', help='path to input JSON')
+    p.add_argument('--target', required=True,
+                   help='e.g. "blocked/admitted < 0.02" or "p90_wait_minutes <= 30"')
+    p.add_argument('--resource', help='input key to search over (default: num_beds, num_doctors or num_ors)',
+                   default=None)
+    p.add_argument('--min', type=int, help='smallest count considered', default=1)
+    p.add_argument('--max', type=int, help="largest count considered (default: 4x the input's count)", default=None)
+    p.add_argument('--seed', type=int, help='seed', default=None)
+    p.add_argument('--confidence', type=float, default=0.95)
+    p.add_argument('--min-replications', type=int, help='first replications of each probe', default=10)
+    p.add_argument('--max-replications', type=int, help='replications of a probe at most', default=160)
+    p.add_argument('--workers', type=int, help='worker processes (default: all cores)', default=None)
+    args = p.parse_args()
+    with open(args.input, 'r') as f:
+        params = json.load(f)
+    try:
+        out = find_capacity(get_engine(args.engine), params, args.resource or RESOURCES[args.engine], args.target,
+                            seed=args.seed, low=args.min, high=args.max, confidence=args.confidence,
+                            min_replications=args.min_replications, max_replications=args.max_replications,
+                            workers=args.workers)
+    except ValueError as e:
+        p.error(str(e))
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
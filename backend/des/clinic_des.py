@@ -6,17 +6,28 @@ Outputs: prints JSON summary
 """
 import sys
 import json
-import heapq
 import random
 import math
+from collections import deque
 from argparse import ArgumentParser
 from typing import Dict
 
+from kernel import Simulation
+from sampling import Sampler
+from resources import ServerPool
+from streamstats import StreamingStats
+from replication import run_replications, compare_scenarios, run_sequential
+from profiler import profile_run
+from eventtrace import trace_run
+from timeseries import series_runner
+from warmup import run_truncated
+from analytic import mdc_mean_wait, check_horizon, with_fast_path, METHODS
+import batched
+
 # Event types
-ARRIVAL = 'ARRIVAL'
-REGISTER_COMPLETE = 'REGISTER_COMPLETE'
-SERVICE_START = 'SERVICE_START'
-SERVICE_END = 'SERVICE_END'
+ARRIVAL = 0
+REGISTER_COMPLETE = 1
+SERVICE_END = 2
 
 
 def load_params(path: str) -> Dict:
@@ -24,140 +35,345 @@ def load_params(path: str) -> Dict:
         return json.load(f)
 
 
-class Event:
-    def __init__(self, time, etype, data=None):
-        self.time = time
-        self.etype = etype
-        self.data = data or {}
-    def __lt__(self, other):
-        return self.time < other.time
-
-
-def clinic_sim(params, seed=None):
-    if seed is not None:
-        random.seed(seed)
-
-    # parameters with defaults
-    num_doctors = int(params.get('num_doctors', 2))
-    clinic_minutes_per_day = int(params.get('clinic_minutes_per_day', 480))
-    avg_arrivals_per_hour = float(params.get('avg_arrivals_per_hour', 20))
-    avg_consult_minutes = float(params.get('avg_consult_minutes', 15))
-    registration_minutes = float(params.get('registration_minutes', 5))
-    pct_scheduled = float(params.get('pct_scheduled', 0.3))
-    no_show_pct = float(params.get('no_show_pct', 0.1))
-    doctor_break_minutes = float(params.get('doctor_break_minutes', 30))
-    sim_duration_days = int(params.get('sim_duration_days', 7))
-
-    total_minutes = clinic_minutes_per_day * sim_duration_days
-
-    # arrival rate per minute
-    lambda_per_min = avg_arrivals_per_hour / 60.0
-
-    # initialize doctors (next free time)
-    doctors_next_free = [0.0] * num_doctors
-    doctor_busy_time = [0.0] * num_doctors
-
-    # queues: list of patients waiting for doctor after registration
-    queue = []  # list of dicts with arrival_time and ready_time
-    max_queue_len = 0
-
-    # stats
-    wait_times = []
-    patients_seen = 0
-    patients_seen_per_day = [0] * sim_duration_days
-
-    # event queue
-    events = []
-
-    # generate arrivals via exponential interarrival
-    t = 0.0
-    while t < total_minutes:
-        # interarrival
-        if lambda_per_min <= 0:
-            break
-        ia = random.expovariate(lambda_per_min)
-        t += ia
-        if t >= total_minutes:
-            break
-        # scheduled flag
-        is_scheduled = random.random() < pct_scheduled
-        if is_scheduled and random.random() < no_show_pct:
-            # no-show: skip scheduling arrival
-            continue
-        # arrival event
-        heapq.heappush(events, Event(t, ARRIVAL, {'scheduled': is_scheduled, 'orig_arrival': t}))
-
-    # helper to find free doctor index at time
-    def get_free_doctor(now):
-        for i in range(num_doctors):
-            if doctors_next_free[i] <= now:
-                return i
-        return None
-
-    # process events
-    while events:
-        ev = heapq.heappop(events)
-        now = ev.time
-        if ev.etype == ARRIVAL:
-            # patient goes through registration, then ready for doctor
-            ready_time = now + registration_minutes
-            heapq.heappush(events, Event(ready_time, REGISTER_COMPLETE, {'arrival': now, 'ready': ready_time}))
-        elif ev.etype == REGISTER_COMPLETE:
-            # join doctor queue
-            queue.append({'arrival': ev.data['arrival'], 'ready': ev.data['ready']})
-            max_queue_len = max(max_queue_len, len(queue))
-            # try to start service immediately if doctor free
-            doc_idx = get_free_doctor(now)
-            if doc_idx is not None and queue:
-                patient = queue.pop(0)
-                start_time = max(now, patient['ready'])
-                # schedule service end
-                end_time = start_time + avg_consult_minutes
-                doctors_next_free[doc_idx] = end_time
-                doctor_busy_time[doc_idx] += (end_time - start_time)
-                heapq.heappush(events, Event(end_time, SERVICE_END, {'start': start_time, 'end': end_time, 'doc': doc_idx, 'arrival': patient['arrival']}))
-        elif ev.etype == SERVICE_END:
-            # record stats
-            start = ev.data['start']
-            arrival = ev.data['arrival']
-            wait = start - (arrival + registration_minutes)
-            wait_times.append(max(0.0, wait))
-            patients_seen += 1
-            day = int(ev.time // clinic_minutes_per_day) if clinic_minutes_per_day>0 else 0
-            if 0 <= day < sim_duration_days:
-                patients_seen_per_day[day] += 1
-            # after service end, check queue for next patient
-            doc_idx = ev.data['doc']
-            if queue:
-                patient = queue.pop(0)
-                start_time = max(ev.time, patient['ready'])
-                end_time = start_time + avg_consult_minutes
-                doctors_next_free[doc_idx] = end_time
-                doctor_busy_time[doc_idx] += (end_time - start_time)
-                heapq.heappush(events, Event(end_time, SERVICE_END, {'start': start_time, 'end': end_time, 'doc': doc_idx, 'arrival': patient['arrival']}))
-
-    # compute outputs
-    avg_wait_minutes = round(sum(wait_times) / len(wait_times), 1) if wait_times else 0.0
-    total_doctor_minutes = sum(doctor_busy_time)
-    total_available = num_doctors * clinic_minutes_per_day * sim_duration_days
-    doctor_util_percent = round((total_doctor_minutes / total_available) * 100, 1) if total_available>0 else 0.0
-    patients_seen_per_day_avg = round(patients_seen / sim_duration_days, 1)
+class ClinicDES(Simulation):
+    EVENT_NAMES = ('ARRIVAL', 'REGISTER_COMPLETE', 'SERVICE_END')
+    EVENT_HANDLERS = ('on_arrival', 'on_register_complete', 'on_service_end')
+    DEFAULTS = {
+        'num_doctors': 2,
+        'clinic_minutes_per_day': 480,
+        'avg_arrivals_per_hour': 20.0,
+        'avg_consult_minutes': 15.0,
+        'registration_minutes': 5.0,
+        'pct_scheduled': 0.3,
+        'no_show_pct': 0.1,
+        'sim_duration_days': 7,
+        # hourly rate multipliers, repeated cyclically (None: constant rate)
+        'arrival_profile': None,
+        'sampler': 'auto',
+        'server_policy': 'lowest',
+        'rng_streams': 'shared',
+        'variates': 'native',
+        'series': 'none',
+        # 'des', 'analytic' or 'auto' (analytic when its assumptions hold)
+        'method': 'des',
+    }
+    TUNABLE = ('num_doctors', 'avg_arrivals_per_hour', 'avg_consult_minutes', 'registration_minutes',
+               'pct_scheduled', 'no_show_pct', 'sim_duration_days', 'arrival_profile')
+
+    def __init__(self, params, seed=None):
+        super().__init__()
+        # per-instance stream so replications can run side by side
+        self.rng = random.Random(seed)
+        p = self.params = self.normalize_params(params)
+
+        # parameters with defaults
+        self.num_doctors = p['num_doctors']
+        self.clinic_minutes_per_day = p['clinic_minutes_per_day']
+        self.avg_arrivals_per_hour = p['avg_arrivals_per_hour']
+        self.avg_consult_minutes = p['avg_consult_minutes']
+        self.registration_minutes = p['registration_minutes']
+        self.pct_scheduled = p['pct_scheduled']
+        self.no_show_pct = p['no_show_pct']
+        self.sim_duration_days = p['sim_duration_days']
+
+        self.total_minutes = self.clinic_minutes_per_day * self.sim_duration_days
+
+        # arrival rate per minute
+        self.lambda_per_min = self.avg_arrivals_per_hour / 60.0
+
+        # random draws: NumPy blocks when available, else self.rng
+        self.sampler = Sampler(self.rng, seed, backend=p['sampler'],
+                               streams=p['rng_streams'], variates=p['variates'])
+        self.arrivals = self.sampler.poisson_arrivals(self.lambda_per_min, self.total_minutes,
+                                                      profile=p['arrival_profile'])
+        self.draw_scheduled = self.sampler.bernoulli(self.pct_scheduled, stream='scheduled')
+        self.draw_no_show = self.sampler.bernoulli(self.no_show_pct, stream='no_show')
+
+        # doctors: free-server pool, busy_time accumulates consult minutes
+        self.doctors = ServerPool(self.num_doctors, p['server_policy'], self.sampler.stream('servers')[0])
+
+        # queue of (arrival, ready, patient_id) patients waiting for doctor after registration
+        self.queue = deque()
+        self.max_queue_len = 0
+
+        # stats
+        self.waits = StreamingStats()
+        self.patients_seen = 0
+        self.arrived = 0
+        self.patients_seen_per_day = [0] * self.sim_duration_days
+        # busy minutes counted before the statistics window
+        self.busy_offset = 0.0
+
+    def schedule_next_arrival(self):
+        # only the next arrival is ever on the heap; no-shows are skipped here
+        while True:
+            t = self.arrivals.next_time()
+            if t is None:
+                return
+            # scheduled flag
+            is_scheduled = self.draw_scheduled()
+            if is_scheduled and self.draw_no_show():
+                # no-show: skip scheduling arrival
+                continue
+            self.arrived += 1
+            self.schedule(t, ARRIVAL, self.arrived)
+            return
+
+    def start_service(self, now, doc_idx, patient):
+        arrival, ready, patient_id = patient
+        start_time = max(now, ready)
+        # schedule service end
+        end_time = start_time + self.avg_consult_minutes
+        self.doctors.busy_time[doc_idx] += (end_time - start_time)
+        self.schedule(end_time, SERVICE_END, (start_time, doc_idx, arrival, patient_id))
+
+    def on_arrival(self, now, patient_id):
+        self.schedule_next_arrival()
+        # patient goes through registration, then ready for doctor
+        self.schedule(now + self.registration_minutes, REGISTER_COMPLETE, (now, patient_id))
+
+    def on_register_complete(self, now, data):
+        arrival, patient_id = data
+        # join doctor queue
+        self.queue.append((arrival, now, patient_id))
+        self.max_queue_len = max(self.max_queue_len, len(self.queue))
+        # try to start service immediately if doctor free
+        doc_idx = self.doctors.acquire()
+        if doc_idx is not None:
+            self.start_service(now, doc_idx, self.queue.popleft())
+
+    def on_service_end(self, now, data):
+        # record stats
+        start, doc_idx, arrival, _ = data
+        wait = start - (arrival + self.registration_minutes)
+        self.waits.add(max(0.0, wait))
+        self.patients_seen += 1
+        day = int(now // self.clinic_minutes_per_day) if self.clinic_minutes_per_day>0 else 0
+        if 0 <= day < self.sim_duration_days:
+            self.patients_seen_per_day[day] += 1
+        # after service end, check queue for next patient
+        if self.queue:
+            doc_idx = self.doctors.handoff(doc_idx)
+            if doc_idx is not None:
+                self.start_service(now, doc_idx, self.queue.popleft())
+        else:
+            self.doctors.release(doc_idx)
+        if self.exit_hook is not None:
+            self.exit_hook(self, now, data[3])
+
+    def levels(self):
+        return {'busy_doctors': self.doctors.num_busy, 'doctor_queue': len(self.queue)}
+
+    def trace_fields(self, etype, data):
+        if etype == ARRIVAL:
+            return -1, data, 0
+        if etype == REGISTER_COMPLETE:
+            return -1, data[1], 0
+        return data[1], data[3], 0
 
+    def retune(self, old, new):
+        changed = {k for k in new if new[k] != old[k]}
+        if 'num_doctors' in changed:
+            self.num_doctors = new['num_doctors']
+            self.doctors.resize(self.num_doctors)
+            # added doctors take waiting patients straight away
+            while self.queue and self.doctors.num_free:
+                self.start_service(self.now, self.doctors.acquire(), self.queue.popleft())
+        self.avg_consult_minutes = new['avg_consult_minutes']
+        self.registration_minutes = new['registration_minutes']
+        if 'pct_scheduled' in changed:
+            self.pct_scheduled = new['pct_scheduled']
+            self.draw_scheduled = self.sampler.bernoulli(self.pct_scheduled, stream='scheduled')
+        if 'no_show_pct' in changed:
+            self.no_show_pct = new['no_show_pct']
+            self.draw_no_show = self.sampler.bernoulli(self.no_show_pct, stream='no_show')
+        if 'sim_duration_days' in changed:
+            self.sim_duration_days = new['sim_duration_days']
+            self.total_minutes = self.clinic_minutes_per_day * self.sim_duration_days
+            self.patients_seen_per_day = (self.patients_seen_per_day + [0] * self.sim_duration_days)[:self.sim_duration_days]
+        if changed & {'avg_arrivals_per_hour', 'sim_duration_days', 'arrival_profile'}:
+            self.avg_arrivals_per_hour = new['avg_arrivals_per_hour']
+            self.lambda_per_min = self.avg_arrivals_per_hour / 60.0
+            # Poisson arrivals are memoryless: restart the stream from now
+            self.cancel_events(ARRIVAL)
+            self.arrivals = self.sampler.poisson_arrivals(self.lambda_per_min, self.total_minutes, start=self.now,
+                                                          profile=new['arrival_profile'])
+            self.schedule_next_arrival()
+
+    def reset_stats(self):
+        super().reset_stats()
+        self.waits = StreamingStats()
+        self.patients_seen = 0
+        self.patients_seen_per_day = [0] * self.sim_duration_days
+        self.max_queue_len = len(self.queue)
+        # consults are counted in full when they start; keep what is left of the current ones
+        self.busy_offset = sum(self.doctors.busy_time) - self.remaining_time(SERVICE_END)
+
+    def summary(self):
+        # compute outputs
+        total_doctor_minutes = sum(self.doctors.busy_time) - self.busy_offset
+        window = self.total_minutes - self.stats_start
+        total_available = self.num_doctors * window
+        doctor_util_percent = round((total_doctor_minutes / total_available) * 100, 1) if total_available>0 else 0.0
+        patients_seen_per_day_avg = round(self.patients_seen / (window / self.clinic_minutes_per_day), 1) if window>0 else 0.0
+
+        return {
+            **self.waits.report('wait_minutes'),
+            'doctor_util_percent': doctor_util_percent,
+            'patients_seen_per_day': patients_seen_per_day_avg,
+            'max_queue_length': self.max_queue_len
+        }
+
+    def start(self):
+        self.schedule_next_arrival()
+
+
+def clinic_analytic(params):
+    """Steady-state M/D/c answer for the consult stage: ``(result, None)``, or ``(None, reason)``.
+
+    Walk-ins are Poisson (thinned by no-shows), registration is a fixed
+    delay that keeps them Poisson, and consults take exactly
+    ``avg_consult_minutes``, so the doctors form an M/D/c queue; its mean
+    wait is Erlang C's with Cosmetatos' deterministic-service correction.
+    Percentiles and ``max_queue_length`` have no closed form and are left out.
+    """
+    p = ClinicDES.normalize_params(params)
+    doctors = p['num_doctors']
+    consult = p['avg_consult_minutes']
+    lam = p['avg_arrivals_per_hour'] / 60.0 * (1.0 - p['pct_scheduled'] * p['no_show_pct'])
+    profile = p['arrival_profile']
+    if profile is not None:
+        if len(set(profile)) > 1:
+            return None, 'arrival_profile is not constant'
+        lam *= float(profile[0])
+    if doctors < 1 or consult <= 0 or lam <= 0:
+        return None, 'needs num_doctors >= 1, avg_consult_minutes > 0 and arrivals'
+    horizon = p['clinic_minutes_per_day'] * p['sim_duration_days']
+    rho = lam * consult / doctors
+    reason = check_horizon(horizon, consult, doctors, rho)
+    if reason:
+        return None, reason
     return {
-        'avg_wait_minutes': avg_wait_minutes,
-        'doctor_util_percent': doctor_util_percent,
-        'patients_seen_per_day': patients_seen_per_day_avg,
-        'max_queue_length': max_queue_len
-    }
+        'avg_wait_minutes': round(mdc_mean_wait(lam, consult, doctors), 1),
+        'doctor_util_percent': round(rho * 100, 1),
+        'patients_seen_per_day': round(lam * p['clinic_minutes_per_day'], 1),
+        'model': 'M/D/c',
+    }, None
+
+
+def clinic_batched(params, seeds):
+    """``clinic_sim(params, seed=s)`` for every seed in ``seeds``, simulated in lockstep on NumPy.
+
+    Walk-ins thinned by no-shows are Poisson, registration is a fixed
+    delay, and consults take exactly ``avg_consult_minutes`` in FCFS order,
+    so consult starts follow from batched.fifo_starts without events; every
+    metric is then computed as ClinicDES computes it. Results are
+    statistically equivalent to the event-driven engine, not equal draw for
+    draw.
+    """
+    batched.require_numpy()
+    np = batched.np
+    p = ClinicDES.normalize_params(params)
+    batched.check_params(p)
+    doctors = p['num_doctors']
+    consult = p['avg_consult_minutes']
+    registration = p['registration_minutes']
+    horizon = p['clinic_minutes_per_day'] * p['sim_duration_days']
+    lam = p['avg_arrivals_per_hour'] / 60.0 * (1.0 - p['pct_scheduled'] * p['no_show_pct'])
+    results = []
+    for chunk in batched.lockstep_chunks(list(seeds)):
+        arrivals = [batched.poisson_times(batched.generators(seed, p['rng_streams'], ('arrivals',))['arrivals'],
+                                          lam, horizon, p['arrival_profile']) + registration for seed in chunk]
+        ready_all, counts = batched.pad(arrivals, np.inf)
+        starts = batched.fifo_starts(ready_all, np.full(ready_all.shape, consult), doctors)
+        for r, n in enumerate(counts):
+            ready, start = ready_all[r, :n], starts[r, :n]
+            seen = np.isfinite(start)
+            patients = int(seen.sum())
+            # busy minutes count each consult in full when it starts
+            available = doctors * horizon
+            results.append({
+                **batched.wait_report(np.maximum(0.0, start[seen] - ready[seen]), 'wait_minutes'),
+                'doctor_util_percent': round(patients * consult / available * 100, 1) if available > 0 else 0.0,
+                'patients_seen_per_day': round(patients / p['sim_duration_days'], 1) if horizon > 0 else 0.0,
+                'max_queue_length': int(batched.queue_seen(ready, start).max(initial=0)),
+            })
+    return results
+
+
+def clinic_sim(params, seed=None, profile=False, trace=None):
+    method = ClinicDES.normalize_params(params)['method']
+    if method == batched.METHOD:
+        if profile or trace:
+            raise ValueError(f'method "{batched.METHOD}" has no event loop to profile or trace')
+        return clinic_batched(params, [seed])[0]
+
+    def des():
+        sim = ClinicDES(params, seed=seed)
+        run = series_runner(sim, profile_run if profile else ClinicDES.run)
+        return trace_run(sim, trace, run, {'seed': seed}) if trace else run(sim)
+    return with_fast_path(method, lambda: clinic_analytic(params), des)
+
+
+# replication.run_batch hands whole seed lists to this under method 'batched'
+clinic_sim.batched = clinic_batched
 
 
 def main():
     p = ArgumentParser()
     p.add_argument('input', help='path to input JSON')
     p.add_argument('--seed', type=int, help='random seed', default=None)
+    p.add_argument('--replications', type=int, help='number of independent replications', default=1)
+    p.add_argument('--workers', type=int, help='worker processes for replications (default: all cores)', default=None)
+    p.add_argument('--profile', action='store_true', help='add an event-loop profile to the output')
+    p.add_argument('--trace', help='record every event to this binary trace file', default=None)
+    p.add_argument('--truncate-warmup', action='store_true', help='detect the warm-up (MSER-5) and drop it from every metric')
+    p.add_argument('--precision', type=float, help='target relative half-width for the suggested horizon', default=0.05)
+    p.add_argument('--antithetic', action='store_true', help='run replications as antithetic pairs')
+    p.add_argument('--compare', help='second input JSON; report its differences from the first', default=None)
+    p.add_argument('--no-crn', action='store_true', help='with --compare, use independent instead of common random numbers')
+    p.add_argument('--target-precision', type=float, help='replicate until each metric\'s relative CI half-width is below this',
+                   default=None)
+    p.add_argument('--metric', action='append', help='metric the target applies to (repeatable, default: all)', default=None)
+    p.add_argument('--max-replications', type=int, help='replication budget for --target-precision', default=1000)
+    p.add_argument('--max-seconds', type=float, help='time budget for --target-precision', default=None)
+    p.add_argument('--method', choices=METHODS + (batched.METHOD,),
+                   help='des, analytic (closed form), auto (analytic when it applies) '
+                        'or batched (replications in lockstep on NumPy)', default=None)
     args = p.parse_args()
+    replicated = args.replications > 1 or args.antithetic or args.compare or args.target_precision
+    if (args.profile or args.trace or args.truncate_warmup) and replicated:
+        p.error('--profile, --trace and --truncate-warmup run a single replication')
+    if args.target_precision and (args.antithetic or args.compare):
+        p.error('--target-precision cannot be combined with --antithetic or --compare')
     params = load_params(args.input)
-    out = clinic_sim(params, seed=args.seed)
+    if args.method:
+        params['method'] = args.method
+    if params.get('method') == batched.METHOD and (args.antithetic or args.truncate_warmup or args.profile or args.trace):
+        p.error(f'--antithetic, --truncate-warmup, --profile and --trace need an event-driven method, not {batched.METHOD}')
+    if args.target_precision:
+        try:
+            out = run_sequential(clinic_sim, params, args.target_precision, metrics=args.metric, seed=args.seed,
+                                 max_replications=args.max_replications, max_seconds=args.max_seconds,
+                                 workers=args.workers)
+        except ValueError as e:
+            p.error(str(e))
+    elif args.compare:
+        other = load_params(args.compare)
+        if args.method:
+            other['method'] = args.method
+        out = compare_scenarios(clinic_sim, params, other, max(2, args.replications), seed=args.seed,
+                                crn=not args.no_crn, workers=args.workers)
+    elif replicated:
+        out = run_replications(clinic_sim, params, args.replications, seed=args.seed, workers=args.workers,
+                               antithetic=args.antithetic)
+    elif args.truncate_warmup:
+        out = run_truncated(ClinicDES, params, seed=args.seed, precision=args.precision)
+    else:
+        try:
+            out = clinic_sim(params, seed=args.seed, profile=args.profile, trace=args.trace)
+        except ValueError as e:
+            p.error(str(e))
     print(json.dumps(out, indent=2))
 
 
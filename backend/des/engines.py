@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Engines - registry of the DES engine entry points by name
+Every entry has the (params, seed=None) -> dict signature.
+"""
+import os
+import ast
+import hashlib
+
+from bed_des import BedDES, bed_sim
+from clinic_des import ClinicDES, clinic_sim
+from or_des import ORDES, or_sim
+from hospital_des import HospitalDES, hospital_sim
+
+ENGINES = {
+    'bed': bed_sim,
+    'clinic': clinic_sim,
+    'or': or_sim,
+    'hospital': hospital_sim,
+}
+
+ENGINE_CLASSES = {
+    'bed': BedDES,
+    'clinic': ClinicDES,
+    'or': ORDES,
+    'hospital': HospitalDES,
+}
+
+DES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_engine(name):
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f'unknown engine {name!r}, expected one of {sorted(ENGINES)}') from None
+
+
+def normalize_params(name, params):
+    """``params`` as engine ``name`` reads them: defaults applied, values coerced."""
+    get_engine(name)
+    return ENGINE_CLASSES[name].normalize_params(params)
+
+
+# path -> ((mtime_ns, size), sha256 digest, imported des module paths)
+_SOURCES = {}
+
+
+def _scan(path):
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _SOURCES.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached
+    with open(path, 'rb') as f:
+        source = f.read()
+    imports = []
+    for node in ast.walk(ast.parse(source, path)):
+        if isinstance(node, ast.Import):
+            names = [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            candidate = os.path.join(DES_DIR, name.split('.')[0] + '.py')
+            if os.path.exists(candidate):
+                imports.append(candidate)
+    entry = (stamp, hashlib.sha256(source).digest(), imports)
+    _SOURCES[path] = entry
+    return entry
+
+
+def source_files(module_file):
+    """``module_file`` plus every backend/des module it imports, transitively."""
+    seen = set()
+    todo = [os.path.abspath(module_file)]
+    while todo:
+        path = todo.pop()
+        if path not in seen:
+            seen.add(path)
+            todo.extend(_scan(path)[2])
+    return sorted(seen)
+
+
+def engine_version(name):
+    """Hash of the source of engine ``name`` and the des modules it uses.
+
+    Changes whenever any of those files is edited, so cached results of an
+    older version are never served.
+    """
+    fn = get_engine(name)
+    module_file = __import__(fn.__module__).__file__
+    h = hashlib.sha256()
+    for path in source_files(module_file):
+        h.update(os.path.basename(path).encode())
+        h.update(_scan(path)[1])
+    return h.hexdigest()[:16]
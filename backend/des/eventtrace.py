@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+EventTrace - compact binary event traces
+TraceWriter appends one fixed-width record per dispatched event in large
+buffered chunks; read_trace maps a trace file as a NumPy structured array.
+"""
+import json
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed to read traces
+    np = None
+
+MAGIC = b'DESTRACE'
+VERSION = 1
+# time, event type, resource index, patient id, priority: 24 bytes, little endian
+RECORD = struct.Struct('<dhiqh')
+FIELDS = (('time', '<f8'), ('etype', '<i2'), ('resource', '<i4'), ('patient', '<i8'), ('priority', '<i2'))
+# header: magic, version, metadata length, then JSON metadata padded to 8 bytes
+HEADER = struct.Struct('<8sII')
+CHUNK_RECORDS = 65536
+
+
+class TraceWriter:
+    """Records every event of one engine run into ``path``.
+
+    Attach it with ``TraceWriter(path).attach(sim)`` before ``sim.run()``;
+    each handler is wrapped on the instance so that, before it runs, the
+    event is packed as ``(time, etype, *sim.trace_fields(etype, data))``.
+    Records accumulate in a ``chunk_records``-record buffer that is written
+    out with one ``write`` call when full and on ``close()``.
+    """
+
+    def __init__(self, path, chunk_records=CHUNK_RECORDS):
+        self.path = path
+        self.file = None
+        self.buf = bytearray(RECORD.size * chunk_records)
+        self.pos = 0
+        self.records = 0
+
+    def attach(self, sim, meta=None):
+        meta = {'engine': type(sim).__name__, 'event_names': list(sim.EVENT_NAMES), **(meta or {})}
+        data = json.dumps(meta, separators=(',', ':')).encode()
+        data += b' ' * (-(HEADER.size + len(data)) % 8)
+        self.file = open(self.path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(data)) + data)
+        for etype, name in enumerate(sim.EVENT_HANDLERS):
+            setattr(sim, name, self._recording(sim, etype, getattr(sim, name)))
+        return self
+
+    def _recording(self, sim, etype, handler):
+        fields = sim.trace_fields
+        pack_into = RECORD.pack_into
+        size = RECORD.size
+
+        def recorded(now, data):
+            if self.pos == len(self.buf):
+                self.flush()
+            pack_into(self.buf, self.pos, now, etype, *fields(etype, data))
+            self.pos += size
+            self.records += 1
+            handler(now, data)
+        return recorded
+
+    def flush(self):
+        self.file.write(memoryview(self.buf)[:self.pos])
+        self.pos = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Trace:
+    """A trace file mapped read-only as a structured array.
+
+    ``records`` has the fields time, etype, resource, patient and priority
+    and is backed by the file, so nothing is loaded until it is touched.
+    Records are in dispatch order, so ``time`` is non-decreasing and time
+    windows are found by binary search and returned as views.
+    """
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('reading traces requires numpy')
+        with open(path, 'rb') as f:
+            magic, version, meta_len = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a DES trace')
+            if version != VERSION:
+                raise ValueError(f'unsupported trace version {version}')
+            self.meta = json.loads(f.read(meta_len))
+        self.event_names = self.meta['event_names']
+        offset = HEADER.size + meta_len
+        dtype = np.dtype(list(FIELDS))
+        count = (_file_size(path) - offset) // dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def etype(self, name):
+        """Integer code of event type ``name``."""
+        try:
+            return self.event_names.index(name)
+        except ValueError:
+            raise ValueError(f'unknown event type {name!r}, expected one of {self.event_names}') from None
+
+    def window(self, start=None, end=None):
+        """Records with ``start <= time < end``, as a view of the mapped file."""
+        t = self.records['time']
+        lo = 0 if start is None else int(np.searchsorted(t, start, side='left'))
+        hi = len(t) if end is None else int(np.searchsorted(t, end, side='left'))
+        return self.records[lo:hi]
+
+    def select(self, start=None, end=None, resource=None, etype=None, patient=None):
+        """Records in the time window matching every given field (``etype`` by name or code)."""
+        rec = self.window(start, end)
+        mask = None
+        for field, value in (('resource', resource), ('patient', patient),
+                             ('etype', self.etype(etype) if isinstance(etype, str) else etype)):
+            if value is None:
+                continue
+            m = rec[field] == value
+            mask = m if mask is None else mask & m
+        return rec if mask is None else rec[mask]
+
+    def counts(self):
+        """Number of records per event type name."""
+        n = np.bincount(self.records['etype'], minlength=len(self.event_names))
+        return {name: int(n[i]) for i, name in enumerate(self.event_names)}
+
+
+def _file_size(path):
+    with open(path, 'rb') as f:
+        return f.seek(0, 2)
+
+
+def read_trace(path):
+    return Trace(path)
+
+
+def trace_run(sim, path, run, meta=None):
+    """``run(sim)`` with every event recorded to ``path``; returns its result."""
+    with TraceWriter(path).attach(sim, meta) as writer:
+        out = run(sim)
+    out['trace'] = {'path': path, 'records': writer.records}
+    return out
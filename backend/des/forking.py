@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Forking - simulate a warm-up once, then branch what-if scenarios from it
+The engine state at the end of the warm-up is snapshotted and every branch
+continues from a restored copy with its own parameter changes.
+"""
+import os
+import json
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from kernel import Simulation
+from engines import ENGINE_CLASSES, get_engine
+
+
+def run_branch(job):
+    """Continue a snapshot with parameter ``changes`` and return its summary."""
+    blob, changes, reset_stats = job
+    sim = Simulation.restore(blob)
+    if changes:
+        sim.apply_params(changes)
+    if reset_stats:
+        sim.reset_stats()
+    return sim.run()
+
+
+def warm_up(engine, params, until, seed=None):
+    """Run ``engine`` from t=0 to ``until`` and return the snapshot bytes."""
+    get_engine(engine)
+    sim = ENGINE_CLASSES[engine](params, seed=seed)
+    sim.run_until(until)
+    return sim.snapshot()
+
+
+def fork(snapshot, branches, reset_stats=True, workers=None, pool=None):
+    """Continue ``snapshot`` once per entry of ``branches`` (dicts of parameter changes).
+
+    With ``reset_stats`` every summary covers only the time after the
+    snapshot; otherwise it covers the whole run. All branches start from the
+    same RNG state, so they see common random numbers up to where their
+    changes make them diverge.
+    """
+    jobs = [(snapshot, changes, reset_stats) for changes in branches]
+    workers = workers or os.cpu_count() or 1
+    if len(jobs) <= 1 or (pool is None and workers <= 1):
+        return [run_branch(job) for job in jobs]
+    if pool is not None:
+        return list(pool.map(run_branch, jobs))
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(run_branch, jobs))
+
+
+def fork_scenarios(engine, params, warmup, branches, seed=None, reset_stats=True, workers=None, pool=None):
+    """Warm ``engine`` up to time ``warmup`` (minutes) once, then run every branch from there."""
+    snapshot = warm_up(engine, params, warmup, seed=seed)
+    results = fork(snapshot, branches, reset_stats=reset_stats, workers=workers, pool=pool)
+    return {
+        'engine': engine,
+        'seed': seed,
+        'warmup_minutes': warmup,
+        'snapshot_bytes': len(snapshot),
+        'branches': [{'changes': changes, 'result': result} for changes, result in zip(branches, results)],
+    }
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('engine', choices=sorted(ENGINE_CLASSES))
+    p.add_argument('input', help='path to input JSON')
+    p.add_argument('--warmup-days', type=float, help='simulated days before the snapshot', required=True)
+    p.add_argument('--branch', action='append', help='JSON object of parameter changes (repeatable; {} continues unchanged)',
+                   default=None)
+    p.add_argument('--seed', type=int, help='random seed', default=None)
+    p.add_argument('--workers', type=int, help='worker processes for branches (default: all cores)', default=None)
+    p.add_argument('--keep-warmup-stats', action='store_true', help='report statistics over the whole run')
+    args = p.parse_args()
+    with open(args.input) as f:
+        params = json.load(f)
+    try:
+        branches = [json.loads(b) for b in args.branch or ['{}']]
+    except ValueError as e:
+        p.error(f'--branch must be a JSON object: {e}')
+    sim = ENGINE_CLASSES[args.engine](params)
+    day_minutes = sim.total_minutes / sim.sim_duration_days if sim.sim_duration_days else 0
+    out = fork_scenarios(args.engine, params, args.warmup_days * day_minutes, branches, seed=args.seed,
+                         reset_stats=not args.keep_warmup_stats, workers=args.workers)
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+HospitalDES - clinic, OR and ward engines coupled in one event loop
+Clinic patients are referred for surgery, operated cases move on to ward
+beds, and elective cases are cancelled when no ward bed is free.
+Reads input JSON and prints JSON summary
+"""
+import json
+import random
+from argparse import ArgumentParser
+from typing import Dict
+
+from kernel import Simulation
+from sampling import Sampler, substream_seed
+from clinic_des import ClinicDES
+from or_des import ORDES
+from bed_des import BedDES
+from replication import run_replications, compare_scenarios, run_sequential
+from profiler import profile_run
+from eventtrace import trace_run
+from timeseries import series_runner
+from warmup import run_truncated
+
+# Event types of the hospital itself; unit events follow
+REFERRAL = 0
+
+DAY_MINUTES = 24 * 60
+# unit kind -> (engine class, input key, key of the unit's minutes per day or None)
+UNIT_KINDS = (
+    ('clinic', ClinicDES, 'clinics', 'clinic_minutes_per_day'),
+    ('theatre', ORDES, 'theatres', 'or_minutes_per_day'),
+    ('ward', BedDES, 'wards', None),
+)
+# settings every unit inherits from the hospital unless it sets them itself
+INHERITED = ('sampler', 'server_policy', 'rng_streams', 'variates')
+
+
+def load_params(path: str) -> Dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class _UnitSchedule:
+    """``schedule`` of a unit: pushes onto the hospital heap with the unit's event base."""
+
+    def __init__(self, hospital, base):
+        self.hospital = hospital
+        self.base = base
+
+    def __call__(self, time, etype, data=None):
+        self.hospital.schedule(time, etype + self.base, data)
+
+
+class HospitalDES(Simulation):
+    """Clinics, theatre suites and wards sharing one heap and one clock.
+
+    Every unit is an unchanged ClinicDES, ORDES or BedDES instance built
+    from its own entry of ``clinics``, ``theatres`` or ``wards``; its
+    handlers are registered in the hospital's event table behind the
+    hospital's own events, and its ``schedule`` pushes onto the shared heap.
+    All units run on a 24-hour clock over ``sim_duration_days``, so their
+    minutes-per-day settings are replaced; an ``arrival_profile`` confines
+    a unit's own arrivals to opening hours.
+
+    Routing:
+
+    - a patient leaving a clinic is referred for surgery with probability
+      ``p_surgery``, joining the least loaded theatre suite after
+      ``referral_days``;
+    - a case needs a ward bed after surgery with probability
+      ``p_postop_bed``; it is decided when the case is about to start, and
+      an elective case that needs a bed while no ward has one free is
+      cancelled and referred again after ``rebook_days``;
+    - after surgery the case is admitted to the ward with the most free
+      beds, queueing there if all are taken.
+
+    The units' own arrival streams (walk-ins, emergency cases, ED
+    admissions) keep running next to the routed patients.
+    """
+    DEFAULTS = {
+        'sim_duration_days': 30,
+        'clinics': [{}],
+        'theatres': [{}],
+        'wards': [{}],
+        'p_surgery': 0.1,
+        'referral_days': 0.0,
+        'p_postop_bed': 0.8,
+        'cancel_if_no_bed': True,
+        'rebook_days': 1.0,
+        'sampler': 'auto',
+        'server_policy': 'lowest',
+        'rng_streams': 'shared',
+        'variates': 'native',
+        'series': 'none',
+    }
+
+    def __init__(self, params, seed=None):
+        super().__init__()
+        self.rng = random.Random(seed)
+        p = self.params = self.normalize_params(params)
+
+        self.sim_duration_days = p['sim_duration_days']
+        self.total_minutes = self.sim_duration_days * DAY_MINUTES
+        self.referral_minutes = p['referral_days'] * DAY_MINUTES
+        self.rebook_minutes = p['rebook_days'] * DAY_MINUTES
+        self.cancel_if_no_bed = p['cancel_if_no_bed']
+
+        self.sampler = Sampler(self.rng, seed, backend=p['sampler'],
+                               streams=p['rng_streams'], variates=p['variates'])
+        self.draw_surgery = self.sampler.bernoulli(p['p_surgery'], stream='surgery')
+        self.draw_postop_bed = self.sampler.bernoulli(p['p_postop_bed'], stream='postop_bed')
+
+        names, handlers = ['REFERRAL'], ['on_referral']
+        # event code -> unit handling it, for trace_fields; None for hospital events
+        self.event_units = [None]
+        self.units = {}
+        for kind, cls, key, day_key in UNIT_KINDS:
+            units = self.units[kind] = []
+            for i, unit_params in enumerate(p[key]):
+                unit_params = {**{k: p[k] for k in INHERITED}, **unit_params,
+                               'sim_duration_days': self.sim_duration_days}
+                if day_key:
+                    unit_params[day_key] = DAY_MINUTES
+                unit_seed = substream_seed(seed, f'{kind}{i}') if seed is not None else None
+                unit = cls(unit_params, seed=unit_seed)
+                unit.name = f'{kind}{i}'
+                base = len(names)
+                unit.event_base = base
+                unit.events = self.events
+                unit.schedule = _UnitSchedule(self, base)
+                for name, handler in zip(cls.EVENT_NAMES, cls.EVENT_HANDLERS):
+                    names.append(f'{unit.name}.{name}')
+                    handlers.append(f'{unit.name}_{handler}')
+                    setattr(self, handlers[-1], getattr(unit, handler))
+                    self.event_units.append(unit)
+                units.append(unit)
+        self.clinics, self.theatres, self.wards = self.units['clinic'], self.units['theatre'], self.units['ward']
+        for unit in self.clinics:
+            unit.exit_hook = self.on_clinic_exit
+        for unit in self.theatres:
+            unit.start_hook = self.on_case_start
+            unit.exit_hook = self.on_case_end
+        self.EVENT_NAMES = tuple(names)
+        self.EVENT_HANDLERS = tuple(handlers)
+
+        # (theatre name, case id) of cases in surgery that go to a ward afterwards
+        self.postop = set()
+        self.referrals = 0
+        self.cancelled = 0
+        self.postop_admissions = 0
+
+    def all_units(self):
+        return self.clinics + self.theatres + self.wards
+
+    def least_loaded_theatre(self):
+        return min(self.theatres, key=lambda t: (t.ors.num_busy + len(t.queue)) / max(1, t.num_ors))
+
+    def freest_ward(self):
+        return max(self.wards, key=lambda w: w.beds.num_free - len(w.queue))
+
+    def refer(self, now):
+        if self.theatres:
+            self.least_loaded_theatre().add_case(now, False)
+
+    def on_referral(self, now, data):
+        self.refer(now)
+
+    def on_clinic_exit(self, clinic, now, patient_id):
+        if not self.draw_surgery():
+            return
+        self.referrals += 1
+        if self.referral_minutes > 0:
+            self.schedule(now + self.referral_minutes, REFERRAL)
+        else:
+            self.refer(now)
+
+    def on_case_start(self, theatre, now, case):
+        if not self.wards or not self.draw_postop_bed():
+            return True
+        if self.cancel_if_no_bed and not case[1] and not any(w.beds.num_free for w in self.wards):
+            # bed blocking: the elective case is cancelled on the day and rebooked
+            self.cancelled += 1
+            self.schedule(now + self.rebook_minutes, REFERRAL)
+            return False
+        self.postop.add((theatre.name, case[0]))
+        return True
+
+    def on_case_end(self, theatre, now, case):
+        key = (theatre.name, case[0])
+        if key in self.postop:
+            self.postop.discard(key)
+            self.postop_admissions += 1
+            self.freest_ward().add_patient(now, case[1])
+
+    def levels(self):
+        out = {}
+        for unit in self.all_units():
+            for name, level in unit.levels().items():
+                out[f'{unit.name}.{name}'] = level
+        return out
+
+    def trace_fields(self, etype, data):
+        unit = self.event_units[etype]
+        if unit is None:
+            return -1, -1, 0
+        return unit.trace_fields(etype - unit.event_base, data)
+
+    def reset_stats(self):
+        super().reset_stats()
+        for unit in self.all_units():
+            unit.now = self.now
+            unit.reset_stats()
+        self.referrals = 0
+        self.cancelled = 0
+        self.postop_admissions = 0
+
+    def summary(self):
+        for unit in self.all_units():
+            unit.now = self.now
+        clinics = [u.summary() for u in self.clinics]
+        theatres = [u.summary() for u in self.theatres]
+        wards = [u.summary() for u in self.wards]
+
+        def weighted(results, units, key, weight):
+            total = sum(getattr(u, weight) for u in units)
+            return round(sum(r[key] * getattr(u, weight) for r, u in zip(results, units)) / total, 1) if total else 0.0
+
+        return {
+            'clinic_patients_seen': sum(u.patients_seen for u in self.clinics),
+            'referrals': self.referrals,
+            'cases_operated': sum(r['cases_scheduled'] for r in theatres),
+            'cases_cancelled_no_bed': self.cancelled,
+            'postop_admissions': self.postop_admissions,
+            'ward_admissions': sum(r['admitted'] for r in wards),
+            'ward_blocked': sum(r['blocked'] for r in wards),
+            'doctor_util_percent': weighted(clinics, self.clinics, 'doctor_util_percent', 'num_doctors'),
+            'or_utilization_percent': weighted(theatres, self.theatres, 'or_utilization_percent', 'num_ors'),
+            'avg_occupancy_percent': weighted(wards, self.wards, 'avg_occupancy_percent', 'num_beds'),
+            'clinics': clinics,
+            'theatres': theatres,
+            'wards': wards,
+        }
+
+    def start(self):
+        for unit in self.all_units():
+            unit.started = True
+            unit.start()
+
+
+def hospital_sim(params, seed=None, profile=False, trace=None):
+    sim = HospitalDES(params, seed=seed)
+    run = series_runner(sim, profile_run if profile else HospitalDES.run)
+    return trace_run(sim, trace, run, {'seed': seed}) if trace else run(sim)
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('input', help='path to input JSON')
+    p.add_argument('--seed', type=int, help='seed', default=None)
+    p.add_argument('--replications', type=int, help='number of independent replications', default=1)
+    p.add_argument('--workers', type=int, help='worker processes for replications (default: all cores)', default=None)
+    p.add_argument('--profile', action='store_true', help='add an event-loop profile to the output')
+    p.add_argument('--trace', help='record every event to this binary trace file', default=None)
+    p.add_argument('--truncate-warmup', action='store_true', help='detect the warm-up (MSER-5) and drop it from every metric')
+    p.add_argument('--precision', type=float, help='target relative half-width for the suggested horizon', default=0.05)
+    p.add_argument('--antithetic', action='store_true', help='run replications as antithetic pairs')
+    p.add_argument('--compare', help='second input JSON; report its differences from the first', default=None)
+    p.add_argument('--no-crn', action='store_true', help='with --compare, use independent instead of common random numbers')
+    p.add_argument('--target-precision', type=float, help='replicate until each metric\'s relative CI half-width is below this',
+                   default=None)
+    p.add_argument('--metric', action='append', help='metric the target applies to (repeatable, default: all)', default=None)
+    p.add_argument('--max-replications', type=int, help='replication budget for --target-precision', default=1000)
+    p.add_argument('--max-seconds', type=float, help='time budget for --target-precision', default=None)
+    args = p.parse_args()
+    replicated = args.replications > 1 or args.antithetic or args.compare or args.target_precision
+    if (args.profile or args.trace or args.truncate_warmup) and replicated:
+        p.error('--profile, --trace and --truncate-warmup run a single replication')
+    if args.target_precision and (args.antithetic or args.compare):
+        p.error('--target-precision cannot be combined with --antithetic or --compare')
+    params = load_params(args.input)
+    if args.target_precision:
+        try:
+            out = run_sequential(hospital_sim, params, args.target_precision, metrics=args.metric, seed=args.seed,
+                                 max_replications=args.max_replications, max_seconds=args.max_seconds,
+                                 workers=args.workers)
+        except ValueError as e:
+            p.error(str(e))
+    elif args.compare:
+        out = compare_scenarios(hospital_sim, params, load_params(args.compare), max(2, args.replications),
+                                seed=args.seed, crn=not args.no_crn, workers=args.workers)
+    elif replicated:
+        out = run_replications(hospital_sim, params, args.replications, seed=args.seed, workers=args.workers,
+                               antithetic=args.antithetic)
+    elif args.truncate_warmup:
+        out = run_truncated(HospitalDES, params, seed=args.seed, precision=args.precision)
+    else:
+        out = hospital_sim(params, seed=args.seed, profile=args.profile, trace=args.trace)
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
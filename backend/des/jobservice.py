@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+JobService - local asyncio HTTP/JSON service running DES jobs on a process pool
+Jobs wait in a bounded queue, fan their replications out over a shared pool,
+can be cancelled, and stream progress events while replications complete.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from engines import get_engine
+from replication import replication_seed, summarize
+from result_cache import ResultCache, cache_key
+
+TERMINAL = ('done', 'failed', 'cancelled')
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 503: 'Service Unavailable'}
+
+
+def _run_replication(engine, params, seed):
+    return engine(params, seed=seed)
+
+
+class Job:
+    def __init__(self, engine, params, seed, replications, confidence):
+        self.id = uuid.uuid4().hex
+        self.engine = engine
+        self.params = params
+        self.seed = seed
+        self.replications = replications
+        self.confidence = confidence
+        self.status = 'queued'
+        self.completed = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.listeners = []
+        self.cache_key = None
+
+    def snapshot(self, with_result=True):
+        out = {
+            'id': self.id,
+            'engine': self.engine,
+            'status': self.status,
+            'completed': self.completed,
+            'replications': self.replications,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if with_result:
+            out['result'] = self.result
+            out['error'] = self.error
+        return out
+
+    def publish(self, event):
+        event['id'] = self.id
+        for q in self.listeners:
+            q.put_nowait(event)
+
+    def finish(self, status, **event):
+        self.status = status
+        self.finished = time.time()
+        self.publish({'event': status, **event})
+
+
+class JobService:
+    """Bounded job queue in front of a process pool.
+
+    ``max_jobs`` jobs run at once and together keep at most ``workers``
+    replications in flight, so ``busy_workers`` is the number of pool
+    processes actually computing. Cancelling a running job stops it from
+    starting further replications; the ones already in flight finish and
+    are discarded. Seeded jobs found in ``cache`` finish at submission
+    without touching the queue.
+    """
+
+    def __init__(self, workers=None, queue_size=100, max_jobs=None, keep_finished=1000, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_jobs = max_jobs or self.workers
+        self.keep_finished = keep_finished
+        self.jobs = {}
+        self.finished = deque()
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.started = time.time()
+        self.pool = None
+        self.queue = None
+        self.slots = None
+        self.runners = []
+        self.cache = cache
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.queue = asyncio.Queue(self.queue_size)
+        self.slots = asyncio.Semaphore(self.workers)
+        self.runners = [asyncio.create_task(self._runner()) for _ in range(self.max_jobs)]
+
+    async def stop(self):
+        for task in self.runners:
+            task.cancel()
+        await asyncio.gather(*self.runners, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
+
+    def submit(self, request):
+        """Queue a job; raises ValueError for bad requests and asyncio.QueueFull when full."""
+        name = request.get('engine')
+        get_engine(name)
+        params = request.get('params') or {}
+        if not isinstance(params, dict):
+            raise ValueError('params must be a JSON object')
+        replications = int(request.get('replications', 1))
+        if replications < 1:
+            raise ValueError('replications must be >= 1')
+        job = Job(name, params, request.get('seed'), replications, float(request.get('confidence', 0.95)))
+        if self.cache is not None and job.seed is not None:
+            job.cache_key = cache_key(name, params, job.seed, replications, job.confidence)
+            result = self.cache.get(job.cache_key)
+            if result is not None:
+                job.started = job.created
+                job.completed = replications
+                job.result = result
+                job.finish('done', result=result, cached=True)
+                self.jobs[job.id] = job
+                self._retire(job)
+                return job
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        return job
+
+    def cancel(self, job):
+        """Cancel a queued or running job; returns False if it already finished."""
+        if job.status in TERMINAL:
+            return False
+        job.finish('cancelled')
+        self._retire(job)
+        return True
+
+    def stats(self):
+        uptime = time.time() - self.started
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue_size,
+            'running_jobs': sum(1 for j in self.jobs.values() if j.status == 'running'),
+            'workers': self.workers,
+            'busy_workers': self.busy,
+            'utilization': self.busy / self.workers,
+            'avg_utilization': self.busy_seconds / (self.workers * uptime) if uptime > 0 else 0.0,
+            'uptime_seconds': uptime,
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
+
+    def _retire(self, job):
+        self.finished.append(job.id)
+        while len(self.finished) > self.keep_finished:
+            self.jobs.pop(self.finished.popleft(), None)
+
+    async def _runner(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.status == 'queued':
+                    await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        engine = get_engine(job.engine)
+        job.status = 'running'
+        job.started = time.time()
+        job.publish({'event': 'running'})
+        if job.replications > 1:
+            if job.seed is None:
+                job.seed = random.SystemRandom().getrandbits(32)
+            seeds = [replication_seed(job.seed, i) for i in range(job.replications)]
+        else:
+            seeds = [job.seed]
+        results = [None] * len(seeds)
+
+        async def one(i):
+            async with self.slots:
+                if job.status != 'running':
+                    return
+                self.busy += 1
+                t0 = time.perf_counter()
+                try:
+                    results[i] = await loop.run_in_executor(self.pool, _run_replication, engine, job.params, seeds[i])
+                finally:
+                    self.busy -= 1
+                    self.busy_seconds += time.perf_counter() - t0
+            if job.status == 'running':
+                job.completed += 1
+                job.publish({'event': 'progress', 'completed': job.completed, 'total': job.replications})
+
+        try:
+            await asyncio.gather(*(one(i) for i in range(len(seeds))))
+        except Exception as e:
+            if job.status == 'running':
+                job.error = f'{type(e).__name__}: {e}'
+                job.finish('failed', error=job.error)
+                self._retire(job)
+            return
+        if job.status != 'running':
+            return
+        if job.replications > 1:
+            job.result = {
+                'replications': job.replications,
+                'seed': job.seed,
+                'confidence': job.confidence,
+                'metrics': summarize(results, job.confidence),
+            }
+        else:
+            job.result = results[0]
+        if job.cache_key is not None:
+            self.cache.put(job.cache_key, job.result)
+        job.finish('done', result=job.result)
+        self._retire(job)
+
+    # HTTP
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, path, body = await self._read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                await self._respond(writer, 400, {'error': f'bad request: {e}'})
+                return
+            await self._route(method, path, body, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        method, path, _ = request_line.split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, value = line.decode('latin-1').split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        body = json.loads(await reader.readexactly(length)) if length else None
+        return method, path.split('?', 1)[0].rstrip('/'), body
+
+    async def _respond(self, writer, status, payload):
+        data = json.dumps(payload, separators=(',', ':')).encode()
+        head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n'
+                f'Connection: close\r\n\r\n')
+        writer.write(head.encode() + data)
+        await writer.drain()
+
+    async def _route(self, method, path, body, writer):
+        parts = [p for p in path.split('/') if p]
+        if parts == ['stats'] and method == 'GET':
+            return await self._respond(writer, 200, self.stats())
+        if parts == ['jobs']:
+            if method == 'GET':
+                return await self._respond(writer, 200, {'jobs': [j.snapshot(False) for j in self.jobs.values()]})
+            if method == 'POST':
+                if not isinstance(body, dict):
+                    return await self._respond(writer, 400, {'error': 'request body must be a JSON object'})
+                try:
+                    job = self.submit(body)
+                except (ValueError, TypeError) as e:
+                    return await self._respond(writer, 400, {'error': str(e)})
+                except asyncio.QueueFull:
+                    return await self._respond(writer, 503, {'error': 'job queue is full'})
+                return await self._respond(writer, 202, job.snapshot(False))
+            return await self._respond(writer, 405, {'error': 'method not allowed'})
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return await self._respond(writer, 404, {'error': 'no such job'})
+            if len(parts) == 3 and parts[2] == 'events' and method == 'GET':
+                return await self._stream(writer, job)
+            if len(parts) == 2 and method == 'GET':
+                return await self._respond(writer, 200, job.snapshot())
+            if len(parts) == 2 and method == 'DELETE':
+                if not self.cancel(job):
+                    return await self._respond(writer, 409, {'error': f'job already {job.status}'})
+                return await self._respond(writer, 200, job.snapshot())
+            return await self._respond(writer, 405, {'error': 'method not allowed'})
+        return await self._respond(writer, 404, {'error': 'not found'})
+
+    async def _stream(self, writer, job):
+        """Stream job events as chunked NDJSON until the job finishes."""
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                     b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+
+        async def send(event):
+            data = json.dumps(event, separators=(',', ':')).encode() + b'\n'
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+            await writer.drain()
+
+        events = asyncio.Queue()
+        job.listeners.append(events)
+        try:
+            await send({'event': 'status', **job.snapshot()})
+            while job.status not in TERMINAL:
+                event = await events.get()
+                await send(event)
+                if event['event'] in TERMINAL:
+                    break
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            job.listeners.remove(events)
+
+
+async def serve(host, port, **kwargs):
+    service = JobService(**kwargs)
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--workers', type=int, help='pool processes (default: all cores)', default=None)
+    p.add_argument('--queue-size', type=int, help='maximum queued jobs', default=100)
+    p.add_argument('--max-jobs', type=int, help='jobs running at once (default: workers)', default=None)
+    p.add_argument('--cache', help='SQLite file for cached results (default: memory only)', default=None)
+    p.add_argument('--no-cache', action='store_true', help='always run the engine')
+    args = p.parse_args()
+    cache = None if args.no_cache else ResultCache(args.cache)
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, queue_size=args.queue_size,
+                          max_jobs=args.max_jobs, cache=cache))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
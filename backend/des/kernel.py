@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Kernel - shared event loop for the DES engines
+Events are plain tuples (time, seq, etype, data) kept in a binary heap.
+"""
+import heapq
+import pickle
+
+
+class Simulation:
+    """Clock, event heap and dispatch loop shared by every engine.
+
+    Events are stored as ``(time, seq, etype, data)`` tuples so heap
+    comparisons stay in C. ``seq`` increases with every scheduled event,
+    which makes equal-time events fire in the order they were scheduled.
+
+    Subclasses list their integer event codes through ``EVENT_NAMES`` and
+    ``EVENT_HANDLERS`` (method names, indexed by code). Handlers are called
+    as ``handler(now, data)``. ``start()`` schedules the initial events and
+    ``summary()`` builds the output of ``run()``.
+
+    The whole engine state (heap, queues, pools, RNG streams, accumulators)
+    lives on the instance, so ``snapshot()`` can checkpoint a run part way
+    through and ``restore()`` continue it, possibly after ``apply_params()``.
+
+    An engine can also run as a unit of a composite model (hospital_des)
+    that owns the heap: its events are then pushed with ``event_base``
+    added to their codes, and the composite is told about patients through
+    ``exit_hook(unit, now, patient)`` and may veto a service start through
+    ``start_hook(unit, now, patient)``.
+    """
+    EVENT_NAMES = ()
+    EVENT_HANDLERS = ()
+    # input parameter name -> default; the default's type coerces input values
+    DEFAULTS = {}
+    # input parameters apply_params() may change part way through a run
+    TUNABLE = ()
+    # set to a profiler.EventProfiler to run dispatch instrumented
+    profiler = None
+    # coupling to a composite model; see the class docstring
+    event_base = 0
+    exit_hook = None
+    start_hook = None
+
+    def __init__(self):
+        self.now = 0.0
+        self.events = []
+        self.seq = 0
+        self.events_processed = 0
+        self.started = False
+        # start of the window the summary statistics cover
+        self.stats_start = 0.0
+
+    @classmethod
+    def normalize_params(cls, params):
+        """Known input parameters with defaults applied and values coerced."""
+        out = {}
+        for key, default in cls.DEFAULTS.items():
+            value = params.get(key, default)
+            out[key] = type(default)(value) if isinstance(default, (int, float, str)) else value
+        return out
+
+    def start(self):
+        """Schedule the initial events."""
+
+    def summary(self):
+        return {}
+
+    def run(self):
+        """Run to the end (or on from a restored snapshot) and return the summary."""
+        if not self.started:
+            self.started = True
+            self.start()
+        self.dispatch()
+        return self.summary()
+
+    def run_until(self, until):
+        """Handle every event up to time ``until`` and stop there."""
+        if not self.started:
+            self.started = True
+            self.start()
+        return self.dispatch(until)
+
+    def snapshot(self):
+        """The complete engine state as bytes, for ``restore()``."""
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def restore(blob):
+        """A new engine continuing from ``snapshot()`` bytes; its RNG streams continue too."""
+        return pickle.loads(blob)
+
+    def apply_params(self, changes):
+        """Change ``TUNABLE`` input parameters part way through a run.
+
+        Raises ValueError for parameters the engine cannot change mid-run.
+        """
+        fixed = sorted(set(changes) - set(self.TUNABLE))
+        if fixed:
+            raise ValueError(f'{type(self).__name__} cannot change {fixed} mid-run; '
+                             f'tunable parameters are {list(self.TUNABLE)}')
+        old = self.params
+        self.params = self.normalize_params({**old, **changes})
+        self.retune(old, self.params)
+
+    def retune(self, old, new):
+        """Bring derived state in line after ``apply_params`` changed ``old`` into ``new``."""
+
+    def reset_stats(self):
+        """Restart the summary statistics at the current time (e.g. after a warm-up)."""
+        self.stats_start = self.now
+
+    def cancel_events(self, etype):
+        """Remove every pending event of type ``etype`` from the heap."""
+        etype += self.event_base
+        self.events[:] = [e for e in self.events if e[2] != etype]
+        heapq.heapify(self.events)
+
+    def remaining_time(self, etype, until=None):
+        """Total time left until the pending events of type ``etype``, e.g. of services in progress.
+
+        With ``until``, only the time up to ``until`` is counted.
+        """
+        now = self.now
+        end = float('inf') if until is None else until
+        etype += self.event_base
+        return sum(min(e[0], end) - now for e in self.events if e[2] == etype and e[0] > now)
+
+    def levels(self):
+        """Current piecewise-constant state levels (busy servers, queue lengths) by name."""
+        return {}
+
+    def trace_fields(self, etype, data):
+        """``(resource, patient, priority)`` of an event for eventtrace; -1 when unknown."""
+        return -1, -1, 0
+
+    def schedule(self, time, etype, data=None):
+        self.seq += 1
+        heapq.heappush(self.events, (time, self.seq, etype, data))
+
+    def dispatch(self, until=None):
+        """Pop and handle events in (time, seq) order.
+
+        Stops when the heap is empty or, if ``until`` is given, before the
+        first event later than ``until``. Returns the number of events handled.
+        """
+        if self.profiler is not None:
+            return self.profiler.dispatch(until)
+        events = self.events
+        handlers = [getattr(self, name) for name in self.EVENT_HANDLERS]
+        pop = heapq.heappop
+        n = 0
+        if until is None:
+            while events:
+                time, _, etype, data = pop(events)
+                self.now = time
+                handlers[etype](time, data)
+                n += 1
+        else:
+            while events and events[0][0] <= until:
+                time, _, etype, data = pop(events)
+                self.now = time
+                handlers[etype](time, data)
+                n += 1
+            if self.now < until:
+                self.now = until
+        self.events_processed += n
+        return n
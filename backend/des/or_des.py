@@ -5,14 +5,24 @@ Reads input JSON and prints JSON summary
 """
 import sys
 import json
-import heapq
 import random
+from collections import deque
 from argparse import ArgumentParser
 from typing import Dict
 
-ARRIVAL = 'ARRIVAL'
-SURGERY_END = 'SURGERY_END'
-SURGERY_START = 'SURGERY_START'
+from kernel import Simulation
+from sampling import Sampler
+from resources import ServerPool
+from streamstats import StreamingStats
+from replication import run_replications, compare_scenarios, run_sequential
+from profiler import profile_run
+from eventtrace import trace_run
+from timeseries import series_runner
+from warmup import run_truncated
+
+# Event types
+ARRIVAL = 0
+SURGERY_END = 1
 
 
 def load_params(path: str) -> Dict:
@@ -20,110 +30,238 @@ def load_params(path: str) -> Dict:
         return json.load(f)
 
 
-class Event:
-    def __init__(self, time, etype, data=None):
-        self.time = time
-        self.etype = etype
-        self.data = data or {}
-    def __lt__(self, other):
-        return self.time < other.time
-
-
-def or_sim(params, seed=None):
-    if seed is not None:
-        random.seed(seed)
-
-    num_ors = int(params.get('num_ors', 3))
-    or_minutes_per_day = int(params.get('or_minutes_per_day', 8*60))
-    avg_arrivals_per_hour = float(params.get('avg_arrivals_per_hour', 2))
-    avg_case_minutes = float(params.get('avg_case_minutes', 90))
-    pct_emergent = float(params.get('pct_emergent', 0.1))
-    sim_duration_days = int(params.get('sim_duration_days', 7))
-
-    total_minutes = or_minutes_per_day * sim_duration_days
-    lambda_per_min = avg_arrivals_per_hour / 60.0
-
-    events = []
-    t = 0.0
-    # generate arrivals
-    while t < total_minutes:
-        if lambda_per_min<=0:
-            break
-        ia = random.expovariate(lambda_per_min)
-        t += ia
-        if t>=total_minutes:
-            break
-        is_emergent = random.random() < pct_emergent
-        heapq.heappush(events, Event(t, ARRIVAL, {'emergent': is_emergent, 'arrival': t}))
-
-    ors_next_free = [0.0]*num_ors
-    or_busy = [0.0]*num_ors
-    queue = []  # FIFO, but emergent goes to front
-    max_queue = 0
-
-    wait_times = []
-    cases_scheduled = 0
-
-    while events:
-        ev = heapq.heappop(events)
-        now = ev.time
-        if ev.etype == ARRIVAL:
-            # schedule start if OR free, else queue
-            free = None
-            for i in range(num_ors):
-                if ors_next_free[i] <= now:
-                    free = i
-                    break
-            if free is not None:
-                dur = avg_case_minutes
-                start = now
-                end = start + dur
-                ors_next_free[free] = end
-                or_busy[free] += dur
-                heapq.heappush(events, Event(end, SURGERY_END, {'start': start, 'end': end, 'or': free, 'arrival': ev.data['arrival']}))
-                wait_times.append(0.0)
-                cases_scheduled += 1
-            else:
-                # put in queue; emergent to front
-                if ev.data.get('emergent'):
-                    queue.insert(0, {'arrival': ev.data['arrival'], 'time': now})
-                else:
-                    queue.append({'arrival': ev.data['arrival'], 'time': now})
-                max_queue = max(max_queue, len(queue))
-        elif ev.etype == SURGERY_END:
-            # free OR and take next from queue
-            or_idx = ev.data['or']
-            if queue:
-                patient = queue.pop(0)
-                start = max(now, patient['time'])
-                dur = avg_case_minutes
-                end = start + dur
-                ors_next_free[or_idx] = end
-                or_busy[or_idx] += dur
-                heapq.heappush(events, Event(end, SURGERY_END, {'start': start, 'end': end, 'or': or_idx, 'arrival': patient['arrival']}))
-                wait_times.append(start - patient['time'])
-                cases_scheduled += 1
-
-    avg_wait = round(sum(wait_times)/len(wait_times),1) if wait_times else 0.0
-    total_busy = sum(or_busy)
-    total_avail = num_ors * or_minutes_per_day * sim_duration_days
-    util = round((total_busy/total_avail)*100,1) if total_avail>0 else 0.0
-
-    return {
-        'avg_wait_minutes': avg_wait,
-        'cases_scheduled': cases_scheduled,
-        'or_utilization_percent': util,
-        'max_queue_length': max_queue
+class ORDES(Simulation):
+    EVENT_NAMES = ('ARRIVAL', 'SURGERY_END')
+    EVENT_HANDLERS = ('on_arrival', 'on_surgery_end')
+    DEFAULTS = {
+        'num_ors': 3,
+        'or_minutes_per_day': 480,
+        'avg_arrivals_per_hour': 2.0,
+        'avg_case_minutes': 90.0,
+        # coefficient of variation of lognormal case durations (0: every case takes avg_case_minutes)
+        'case_minutes_cv': 0.0,
+        'pct_emergent': 0.1,
+        'sim_duration_days': 7,
+        # hourly rate multipliers, repeated cyclically (None: constant rate)
+        'arrival_profile': None,
+        'sampler': 'auto',
+        'server_policy': 'lowest',
+        'rng_streams': 'shared',
+        'variates': 'native',
+        'series': 'none',
     }
+    TUNABLE = ('num_ors', 'avg_arrivals_per_hour', 'avg_case_minutes', 'case_minutes_cv', 'pct_emergent',
+               'sim_duration_days', 'arrival_profile')
+
+    def __init__(self, params, seed=None):
+        super().__init__()
+        # per-instance stream so replications can run side by side
+        self.rng = random.Random(seed)
+        p = self.params = self.normalize_params(params)
+
+        self.num_ors = p['num_ors']
+        self.or_minutes_per_day = p['or_minutes_per_day']
+        self.avg_arrivals_per_hour = p['avg_arrivals_per_hour']
+        self.avg_case_minutes = p['avg_case_minutes']
+        self.case_minutes_cv = p['case_minutes_cv']
+        self.pct_emergent = p['pct_emergent']
+        self.sim_duration_days = p['sim_duration_days']
+
+        self.total_minutes = self.or_minutes_per_day * self.sim_duration_days
+        self.lambda_per_min = self.avg_arrivals_per_hour / 60.0
+
+        # random draws: NumPy blocks when available, else self.rng
+        self.sampler = Sampler(self.rng, seed, backend=p['sampler'],
+                               streams=p['rng_streams'], variates=p['variates'])
+        self.arrivals = self.sampler.poisson_arrivals(self.lambda_per_min, self.total_minutes,
+                                                      profile=p['arrival_profile'])
+        self.draw_emergent = self.sampler.bernoulli(self.pct_emergent, stream='emergent')
+        self.draw_case_minutes = self.case_minutes_sampler()
+
+        # ORs: free-server pool, busy_time accumulates case minutes
+        self.ors = ServerPool(self.num_ors, p['server_policy'], self.sampler.stream('servers')[0])
+        self.queue = deque()  # FIFO, but emergent goes to front
+        self.max_queue = 0
+
+        self.waits = StreamingStats()
+        self.cases_scheduled = 0
+        self.arrived = 0
+        # busy minutes counted before the statistics window
+        self.busy_offset = 0.0
+
+    def case_minutes_sampler(self):
+        if self.case_minutes_cv > 0 and self.avg_case_minutes > 0:
+            return self.sampler.lognormal(self.avg_case_minutes, self.case_minutes_cv, stream='duration')
+        return None
+
+    def schedule_next_arrival(self):
+        # only the next arrival is ever on the heap
+        t = self.arrivals.next_time()
+        if t is not None:
+            is_emergent = self.draw_emergent()
+            self.arrived += 1
+            self.schedule(t, ARRIVAL, (self.arrived, is_emergent))
+
+    def start_case(self, start, or_idx, arrival, case):
+        dur = self.draw_case_minutes() if self.draw_case_minutes is not None else self.avg_case_minutes
+        end = start + dur
+        self.ors.busy_time[or_idx] += dur
+        self.schedule(end, SURGERY_END, (or_idx, case))
+        self.waits.add(start - arrival)
+        self.cases_scheduled += 1
+
+    def on_arrival(self, now, case):
+        self.schedule_next_arrival()
+        self.admit_case(now, case)
+
+    def add_case(self, now, emergent):
+        """Case from outside the unit's own arrival stream (e.g. a clinic referral)."""
+        self.arrived += 1
+        self.admit_case(now, (self.arrived, emergent))
+
+    def admit_case(self, now, case):
+        # schedule start if OR free, else queue
+        free = self.ors.acquire()
+        if free is not None:
+            if self.start_hook is None or self.start_hook(self, now, case):
+                self.start_case(now, free, now, case)
+            else:
+                self.ors.release(free)
+        else:
+            # put in queue; emergent to front
+            if case[1]:
+                self.queue.appendleft((now, case))
+            else:
+                self.queue.append((now, case))
+            self.max_queue = max(self.max_queue, len(self.queue))
+
+    def on_surgery_end(self, now, data):
+        if self.exit_hook is not None:
+            self.exit_hook(self, now, data[1])
+        self.start_next(now, data[0])
+
+    def start_next(self, now, or_idx):
+        """Give OR ``or_idx`` to the next queued case, or free it; a start_hook may cancel queued cases."""
+        if self.queue:
+            # a removed OR is not handed on; another free one may be
+            or_idx = self.ors.handoff(or_idx)
+            if or_idx is None:
+                return
+        while self.queue:
+            arrival, case = self.queue.popleft()
+            if self.start_hook is None or self.start_hook(self, now, case):
+                self.start_case(max(now, arrival), or_idx, arrival, case)
+                return
+        self.ors.release(or_idx)
+
+    def levels(self):
+        return {'busy_ors': self.ors.num_busy, 'or_queue': len(self.queue)}
+
+    def trace_fields(self, etype, data):
+        if etype == ARRIVAL:
+            case_id, emergent = data
+            return -1, case_id, int(emergent)
+        or_idx, (case_id, emergent) = data
+        return or_idx, case_id, int(emergent)
+
+    def retune(self, old, new):
+        changed = {k for k in new if new[k] != old[k]}
+        if 'num_ors' in changed:
+            self.num_ors = new['num_ors']
+            self.ors.resize(self.num_ors)
+            # added ORs take waiting cases straight away
+            while self.queue and self.ors.num_free:
+                self.start_next(self.now, self.ors.acquire())
+        self.avg_case_minutes = new['avg_case_minutes']
+        if changed & {'avg_case_minutes', 'case_minutes_cv'}:
+            self.case_minutes_cv = new['case_minutes_cv']
+            self.draw_case_minutes = self.case_minutes_sampler()
+        if 'pct_emergent' in changed:
+            self.pct_emergent = new['pct_emergent']
+            self.draw_emergent = self.sampler.bernoulli(self.pct_emergent, stream='emergent')
+        if changed & {'avg_arrivals_per_hour', 'sim_duration_days', 'arrival_profile'}:
+            self.avg_arrivals_per_hour = new['avg_arrivals_per_hour']
+            self.sim_duration_days = new['sim_duration_days']
+            self.total_minutes = self.or_minutes_per_day * self.sim_duration_days
+            self.lambda_per_min = self.avg_arrivals_per_hour / 60.0
+            # Poisson arrivals are memoryless: restart the stream from now
+            self.cancel_events(ARRIVAL)
+            self.arrivals = self.sampler.poisson_arrivals(self.lambda_per_min, self.total_minutes, start=self.now,
+                                                          profile=new['arrival_profile'])
+            self.schedule_next_arrival()
+
+    def reset_stats(self):
+        super().reset_stats()
+        self.waits = StreamingStats()
+        self.cases_scheduled = 0
+        self.max_queue = len(self.queue)
+        # cases are counted in full when they start; keep what is left of the current ones
+        self.busy_offset = sum(self.ors.busy_time) - self.remaining_time(SURGERY_END)
+
+    def summary(self):
+        total_busy = sum(self.ors.busy_time) - self.busy_offset
+        total_avail = self.num_ors * (self.total_minutes - self.stats_start)
+        util = round((total_busy/total_avail)*100,1) if total_avail>0 else 0.0
+
+        return {
+            **self.waits.report('wait_minutes'),
+            'cases_scheduled': self.cases_scheduled,
+            'or_utilization_percent': util,
+            'max_queue_length': self.max_queue
+        }
+
+    def start(self):
+        self.schedule_next_arrival()
+
+
+def or_sim(params, seed=None, profile=False, trace=None):
+    sim = ORDES(params, seed=seed)
+    run = series_runner(sim, profile_run if profile else ORDES.run)
+    return trace_run(sim, trace, run, {'seed': seed}) if trace else run(sim)
 
 
 def main():
     p = ArgumentParser()
     p.add_argument('input', help='path to input JSON')
     p.add_argument('--seed', type=int, help='seed', default=None)
+    p.add_argument('--replications', type=int, help='number of independent replications', default=1)
+    p.add_argument('--workers', type=int, help='worker processes for replications (default: all cores)', default=None)
+    p.add_argument('--profile', action='store_true', help='add an event-loop profile to the output')
+    p.add_argument('--trace', help='record every event to this binary trace file', default=None)
+    p.add_argument('--truncate-warmup', action='store_true', help='detect the warm-up (MSER-5) and drop it from every metric')
+    p.add_argument('--precision', type=float, help='target relative half-width for the suggested horizon', default=0.05)
+    p.add_argument('--antithetic', action='store_true', help='run replications as antithetic pairs')
+    p.add_argument('--compare', help='second input JSON; report its differences from the first', default=None)
+    p.add_argument('--no-crn', action='store_true', help='with --compare, use independent instead of common random numbers')
+    p.add_argument('--target-precision', type=float, help='replicate until each metric\'s relative CI half-width is below this',
+                   default=None)
+    p.add_argument('--metric', action='append', help='metric the target applies to (repeatable, default: all)', default=None)
+    p.add_argument('--max-replications', type=int, help='replication budget for --target-precision', default=1000)
+    p.add_argument('--max-seconds', type=float, help='time budget for --target-precision', default=None)
     args = p.parse_args()
+    replicated = args.replications > 1 or args.antithetic or args.compare or args.target_precision
+    if (args.profile or args.trace or args.truncate_warmup) and replicated:
+        p.error('--profile, --trace and --truncate-warmup run a single replication')
+    if args.target_precision and (args.antithetic or args.compare):
+        p.error('--target-precision cannot be combined with --antithetic or --compare')
     params = load_params(args.input)
-    out = or_sim(params, seed=args.seed)
+    if args.target_precision:
+        try:
+            out = run_sequential(or_sim, params, args.target_precision, metrics=args.metric, seed=args.seed,
+                                 max_replications=args.max_replications, max_seconds=args.max_seconds,
+                                 workers=args.workers)
+        except ValueError as e:
+            p.error(str(e))
+    elif args.compare:
+        out = compare_scenarios(or_sim, params, load_params(args.compare), max(2, args.replications), seed=args.seed,
+                                crn=not args.no_crn, workers=args.workers)
+    elif replicated:
+        out = run_replications(or_sim, params, args.replications, seed=args.seed, workers=args.workers,
+                               antithetic=args.antithetic)
+    elif args.truncate_warmup:
+        out = run_truncated(ORDES, params, seed=args.seed, precision=args.precision)
+    else:
+        out = or_sim(params, seed=args.seed, profile=args.profile, trace=args.trace)
     print(json.dumps(out, indent=2))
 
 
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+ORSchedule - case sequencing and theatre assignment for one operating day
+Elective cases with lognormal durations are assigned to theatres and ordered
+to minimize expected overtime and postponements. Heuristics (input order,
+LPT, first-fit decreasing) give starting schedules; local search then moves
+and swaps cases. Every candidate is scored on the same sampled durations
+(common random numbers), and a move only re-simulates the theatre-days it
+changes.
+Reads input JSON and prints JSON summary
+"""
+import json
+import math
+import time
+import random
+from argparse import ArgumentParser
+from typing import Dict
+
+from sampling import lognormal_params, substream_seed
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+HEURISTICS = ('given', 'lpt', 'ffd')
+# a move must improve the objective by more than this to be taken
+IMPROVEMENT = 1e-9
+
+
+def load_params(path: str) -> Dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class DayProblem:
+    """One day's elective list on ``num_ors`` theatres, scored over sampled durations.
+
+    A theatre works through its cases in order from the start of the
+    session, with ``turnover_minutes`` between cases. A case that cannot
+    start before ``latest_start_minutes`` is postponed, and so is every
+    case after it. Overtime is the time the last case performed ends past
+    ``or_minutes_per_day``. The objective is the expected
+    ``overtime_cost_per_minute * overtime + postpone_cost * postponed``.
+
+    Case durations are lognormal with the case's ``mean_minutes`` and
+    ``sd_minutes`` (or ``case_minutes_cv`` times the mean). ``scenarios``
+    joint duration samples are drawn once from ``seed`` and shared by every
+    schedule scored, so two candidates differ only by the schedule.
+    Theatre-day results are cached by case sequence.
+    """
+    DEFAULTS = {
+        'num_ors': 3,
+        'or_minutes_per_day': 480,
+        'turnover_minutes': 30.0,
+        # cases not started by then are postponed (None: end of the session)
+        'latest_start_minutes': None,
+        'case_minutes_cv': 0.3,
+        'overtime_cost_per_minute': 1.0,
+        'postpone_cost': 240.0,
+        'scenarios': 200,
+        'cases': [],
+    }
+
+    def __init__(self, params, seed=None, scenarios=None):
+        p = self.params = {key: params.get(key, default) for key, default in self.DEFAULTS.items()}
+        self.num_ors = int(p['num_ors'])
+        self.session = float(p['or_minutes_per_day'])
+        self.turnover = float(p['turnover_minutes'])
+        latest = p['latest_start_minutes']
+        self.latest_start = float(latest) if latest is not None else self.session
+        self.overtime_cost = float(p['overtime_cost_per_minute'])
+        self.postpone_cost = float(p['postpone_cost'])
+        self.scenarios = int(scenarios or p['scenarios'])
+        if self.num_ors < 1 or self.scenarios < 1:
+            raise ValueError('num_ors and scenarios must be >= 1')
+
+        self.ids, self.means, sds = [], [], []
+        for i, case in enumerate(p['cases']):
+            mean = float(case['mean_minutes'])
+            if mean <= 0:
+                raise ValueError(f'case {case.get("id", i)!r}: mean_minutes must be > 0')
+            self.ids.append(str(case.get('id', i)))
+            self.means.append(mean)
+            sds.append(float(case.get('sd_minutes', float(p['case_minutes_cv']) * mean)))
+        if len(set(self.ids)) != len(self.ids):
+            raise ValueError('case ids must be unique')
+
+        # durations[case] holds that case's duration in every scenario
+        if np is not None:
+            gen = np.random.default_rng(seed)
+            self.durations = np.empty((len(self.means), self.scenarios))
+            for i, (mean, sd) in enumerate(zip(self.means, sds)):
+                mu, sigma = lognormal_params(mean, sd / mean)
+                self.durations[i] = np.exp(mu + sigma * gen.standard_normal(self.scenarios))
+        else:
+            rng = random.Random(seed)
+            self.durations = []
+            for mean, sd in zip(self.means, sds):
+                mu, sigma = lognormal_params(mean, sd / mean)
+                self.durations.append([math.exp(mu + sigma * rng.normalvariate(0.0, 1.0))
+                                       for _ in range(self.scenarios)])
+        self.cache = {}
+        self.evaluations = 0
+
+    def theatre_day(self, sequence):
+        """(cost, mean overtime, mean postponed, P(overtime)) of one theatre working ``sequence``."""
+        key = tuple(sequence)
+        hit = self.cache.get(key)
+        if hit is not None:
+            return hit
+        self.evaluations += 1
+        if not key:
+            result = (0.0, 0.0, 0.0, 0.0)
+        elif np is not None:
+            d = self.durations[list(key)]
+            # start of each case if everything before it is performed
+            starts = np.cumsum(d + self.turnover, axis=0) - d - self.turnover
+            performed = starts < self.latest_start
+            finish = np.where(performed, starts + d, 0.0).max(axis=0)
+            overtime = np.maximum(0.0, finish - self.session)
+            postponed = len(key) - performed.sum(axis=0)
+            result = self._result(float(overtime.mean()), float(postponed.mean()), float((overtime > 0).mean()))
+        else:
+            total_overtime = total_postponed = late = 0.0
+            for s in range(self.scenarios):
+                t = finish = 0.0
+                done = 0
+                for case in key:
+                    if t >= self.latest_start:
+                        break
+                    finish = t + self.durations[case][s]
+                    t = finish + self.turnover
+                    done += 1
+                overtime = max(0.0, finish - self.session)
+                total_overtime += overtime
+                total_postponed += len(key) - done
+                late += overtime > 0
+            n = self.scenarios
+            result = self._result(total_overtime / n, total_postponed / n, late / n)
+        self.cache[key] = result
+        return result
+
+    def _result(self, overtime, postponed, p_overtime):
+        return self.overtime_cost * overtime + self.postpone_cost * postponed, overtime, postponed, p_overtime
+
+    def cost(self, schedule):
+        return sum(self.theatre_day(seq)[0] for seq in schedule)
+
+    def report(self, schedule):
+        theatres, overtime, postponed = [], 0.0, 0.0
+        for t, seq in enumerate(schedule):
+            cost, ot, pp, late = self.theatre_day(seq)
+            planned, clock = [], 0.0
+            for case in seq:
+                planned.append(round(clock, 1))
+                clock += self.means[case] + self.turnover
+            theatres.append({
+                'theatre': t,
+                'cases': [self.ids[c] for c in seq],
+                'planned_start_minutes': planned,
+                'expected_overtime_minutes': round(ot, 2),
+                'expected_postponed_cases': round(pp, 3),
+                'p_overtime': round(late, 3),
+            })
+            overtime += ot
+            postponed += pp
+        return {
+            'objective': round(self.cost(schedule), 2),
+            'expected_overtime_minutes': round(overtime, 2),
+            'expected_postponed_cases': round(postponed, 3),
+            'theatres': theatres,
+        }
+
+    # starting schedules
+
+    def given(self):
+        """Cases in input order, dealt to theatres in turn."""
+        schedule = [[] for _ in range(self.num_ors)]
+        for case in range(len(self.means)):
+            schedule[case % self.num_ors].append(case)
+        return schedule
+
+    def lpt(self):
+        """Longest expected case first, each onto the theatre with the least booked time."""
+        schedule = [[] for _ in range(self.num_ors)]
+        load = [0.0] * self.num_ors
+        for case in sorted(range(len(self.means)), key=lambda c: -self.means[c]):
+            t = load.index(min(load))
+            schedule[t].append(case)
+            load[t] += self.means[case] + self.turnover
+        return schedule
+
+    def ffd(self):
+        """First-fit decreasing: a case goes to the first theatre whose session it still fits.
+
+        Cases that fit nowhere go to the least loaded theatre.
+        """
+        schedule = [[] for _ in range(self.num_ors)]
+        load = [0.0] * self.num_ors
+        capacity = self.session + self.turnover
+        for case in sorted(range(len(self.means)), key=lambda c: -self.means[c]):
+            need = self.means[case] + self.turnover
+            t = next((t for t in range(self.num_ors) if load[t] + need <= capacity), None)
+            if t is None:
+                t = load.index(min(load))
+            schedule[t].append(case)
+            load[t] += need
+        return schedule
+
+
+def local_search(problem, schedule, max_seconds=10.0, max_passes=50):
+    """Improve ``schedule`` in place by relocating and swapping cases.
+
+    Each pass tries, for every case, every other position in every theatre
+    and every swap with a case elsewhere, and takes the best move for that
+    case if it lowers the objective. Only the one or two theatres a move
+    touches are re-scored. Stops at a local optimum (a pass without a
+    move), after ``max_passes`` or once ``max_seconds`` have passed.
+    """
+    started = time.perf_counter()
+    costs = [problem.theatre_day(seq)[0] for seq in schedule]
+    moves, passes, stopped = 0, 0, 'local_optimum'
+    while True:
+        if passes >= max_passes:
+            stopped = 'max_passes'
+            break
+        passes += 1
+        improved = False
+        for case in sorted(range(len(problem.means)), key=lambda c: -problem.means[c]):
+            if time.perf_counter() - started > max_seconds:
+                stopped = 'max_seconds'
+                break
+            src = next(t for t, seq in enumerate(schedule) if case in seq)
+            pos = schedule[src].index(case)
+            without = schedule[src][:pos] + schedule[src][pos + 1:]
+            without_cost = problem.theatre_day(without)[0]
+            best_delta, best = -IMPROVEMENT, None
+            # relocate, within the theatre or to another one
+            for dst, seq in enumerate(schedule):
+                base = without if dst == src else seq
+                for i in range(len(base) + 1):
+                    if dst == src and i == pos:
+                        continue
+                    candidate = base[:i] + [case] + base[i:]
+                    if dst == src:
+                        delta = problem.theatre_day(candidate)[0] - costs[src]
+                    else:
+                        delta = (without_cost - costs[src]) + (problem.theatre_day(candidate)[0] - costs[dst])
+                    if delta < best_delta:
+                        best_delta, best = delta, ((src, without), (dst, candidate))
+            # swap with a case in another theatre, each taking the other's place
+            for dst, seq in enumerate(schedule):
+                if dst == src:
+                    continue
+                for j, other in enumerate(seq):
+                    new_src = schedule[src][:pos] + [other] + schedule[src][pos + 1:]
+                    new_dst = seq[:j] + [case] + seq[j + 1:]
+                    delta = (problem.theatre_day(new_src)[0] - costs[src]) + \
+                            (problem.theatre_day(new_dst)[0] - costs[dst])
+                    if delta < best_delta:
+                        best_delta, best = delta, ((src, new_src), (dst, new_dst))
+            if best is not None:
+                # a relocation within one theatre leaves only its new sequence
+                changes = dict(best)
+                for t, seq in changes.items():
+                    schedule[t] = seq
+                    costs[t] = problem.theatre_day(seq)[0]
+                moves += 1
+                improved = True
+        if stopped == 'max_seconds' or not improved:
+            break
+    return {'passes': passes, 'moves': moves, 'stopped': stopped}
+
+
+def optimize(params, seed=None, max_seconds=10.0, max_passes=50, validation_scenarios=None):
+    """Best schedule found for the day in ``params``.
+
+    Every heuristic in HEURISTICS is scored and local search starts from
+    the best of them. Because the schedule is chosen on the same sampled
+    durations it is scored on, its objective is optimistic; it is also
+    re-scored on ``validation_scenarios`` fresh samples (default: as many as
+    ``scenarios``) to give an unbiased estimate.
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    started = time.perf_counter()
+    problem = DayProblem(params, seed=substream_seed(seed, 'search'))
+    starts = {name: getattr(problem, name)() for name in HEURISTICS}
+    heuristics = {name: round(problem.cost(s), 2) for name, s in starts.items()}
+    start = min(HEURISTICS, key=lambda name: heuristics[name])
+    schedule = [list(seq) for seq in starts[start]]
+    search = local_search(problem, schedule, max_seconds=max_seconds, max_passes=max_passes)
+    out = problem.report(schedule)
+    out['seed'] = seed
+    out['heuristics'] = heuristics
+    out['search'] = {
+        'start': start,
+        **search,
+        'evaluations': problem.evaluations,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    check = DayProblem(params, seed=substream_seed(seed, 'validation'), scenarios=validation_scenarios)
+    fresh = check.report(schedule)
+    out['validation'] = {
+        'scenarios': check.scenarios,
+        'objective': fresh['objective'],
+        'expected_overtime_minutes': fresh['expected_overtime_minutes'],
+        'expected_postponed_cases': fresh['expected_postponed_cases'],
+        'heuristics': {name: round(check.cost(s), 2) for name, s in starts.items()},
+    }
+    return out
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('input', help='path to input JSON')
+    p.add_argument('--seed', type=int, help='seed', default=None)
+    p.add_argument('--max-seconds', type=float, help='time budget for the local search', default=10.0)
+    p.add_argument('--max-passes', type=int, help='local search passes at most', default=50)
+    p.add_argument('--validation-scenarios', type=int, help='fresh duration samples the result is re-scored on',
+                   default=None)
+    args = p.parse_args()
+    try:
+        out = optimize(load_params(args.input), seed=args.seed, max_seconds=args.max_seconds,
+                       max_passes=args.max_passes, validation_scenarios=args.validation_scenarios)
+    except (ValueError, KeyError) as e:
+        p.error(str(e))
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
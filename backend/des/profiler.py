@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Profiler - opt-in instrumentation of the kernel event loop
+Times every handler, heap push/pop, arrival generation, random draws and
+server-pool operations, and samples heap size and queue lengths.
+"""
+import heapq
+from collections.abc import Sized
+from time import perf_counter
+
+from arrivals import PoissonArrivals, ProfileArrivals, DailyGridArrivals
+from sampling import BlockPoissonArrivals, BlockProfileArrivals
+from resources import ServerPool
+from streamstats import StreamingStats
+
+ARRIVAL_SOURCES = (PoissonArrivals, ProfileArrivals, DailyGridArrivals, BlockPoissonArrivals, BlockProfileArrivals)
+QUEUE_SAMPLES = 200
+
+
+class EventProfiler:
+    """Instruments one Simulation instance.
+
+    Arrival sources, ``draw_*`` samplers, server pools and ``*queue``
+    containers (anything with a length: deques, lists, ClassQueues) are
+    found among the engine's attributes when the profiler is attached and
+    again when dispatch starts (the services engines build their arrival
+    streams in ``run()``). Wrappers are set on the instance,
+    so the engine classes and unprofiled runs are untouched.
+
+    Handler times are inclusive: they contain the pushes, arrival draws,
+    samples and pool operations done inside the handler. ``handlers_other``
+    is what remains, i.e. the engine's own logic including queue operations.
+    ``profiler_overhead`` is loop time outside pops and handlers, which is
+    almost entirely the profiler's own sampling; every timing is inflated
+    somewhat by the instrumentation, so compare shares rather than totals
+    with unprofiled runs.
+    """
+
+    def __init__(self, sim):
+        self.sim = sim
+        n = len(sim.EVENT_HANDLERS)
+        self.counts = [0] * n
+        self.handler_seconds = [0.0] * n
+        self.seconds = {'dispatch': 0.0, 'heap_pop': 0.0, 'heap_push': 0.0,
+                        'arrivals': 0.0, 'sampling': 0.0, 'resources': 0.0}
+        self.calls = {'heap_push': 0, 'arrivals': 0, 'sampling': 0, 'resources': 0}
+        self.heap_histogram = {}
+        self.queues = {}
+        self.samples = []
+        self.sample_every = 1
+        self.wrapped = set()
+        self.attach()
+
+    def _timed(self, fn, category):
+        seconds, calls = self.seconds, self.calls
+
+        def timed(*args):
+            t0 = perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                seconds[category] += perf_counter() - t0
+                calls[category] += 1
+        return timed
+
+    def attach(self):
+        sim = self.sim
+        if 'schedule' not in sim.__dict__:
+            sim.schedule = self._timed(sim.schedule, 'heap_push')
+        for name, value in list(vars(sim).items()):
+            if id(value) in self.wrapped or value is None:
+                continue
+            if isinstance(value, ARRIVAL_SOURCES):
+                value.next_time = self._timed(value.next_time, 'arrivals')
+            elif isinstance(value, ServerPool):
+                for method in ('acquire', 'release', 'set_available'):
+                    setattr(value, method, self._timed(getattr(value, method), 'resources'))
+            elif name.startswith('draw_') and callable(value):
+                setattr(sim, name, self._timed(value, 'sampling'))
+            elif name.endswith('queue') and isinstance(value, Sized):
+                self.queues[name] = StreamingStats()
+            else:
+                continue
+            self.wrapped.add(id(getattr(sim, name)))
+            self.wrapped.add(id(value))
+
+    def _sample_queues(self):
+        lengths = {}
+        sim = self.sim
+        for name, stats in self.queues.items():
+            n = len(getattr(sim, name))
+            stats.add(n)
+            lengths[name] = n
+        return lengths
+
+    def dispatch(self, until=None):
+        """Instrumented equivalent of ``Simulation.dispatch``."""
+        self.attach()
+        sim = self.sim
+        events = sim.events
+        handlers = [getattr(sim, name) for name in sim.EVENT_HANDLERS]
+        counts, handler_seconds, histogram = self.counts, self.handler_seconds, self.heap_histogram
+        pop = heapq.heappop
+        n = 0
+        start = perf_counter()
+        pop_seconds = 0.0
+        while events and (until is None or events[0][0] <= until):
+            bucket = len(events).bit_length()
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+            t0 = perf_counter()
+            time, _, etype, data = pop(events)
+            t1 = perf_counter()
+            sim.now = time
+            handlers[etype](time, data)
+            t2 = perf_counter()
+            pop_seconds += t1 - t0
+            handler_seconds[etype] += t2 - t1
+            counts[etype] += 1
+            n += 1
+            lengths = self._sample_queues()
+            if n % self.sample_every == 0:
+                self.samples.append({'time': time, **lengths})
+                if len(self.samples) >= 2 * QUEUE_SAMPLES:
+                    # keep the series bounded: drop every other sample, halve the rate
+                    del self.samples[1::2]
+                    self.sample_every *= 2
+        if until is not None and sim.now < until:
+            sim.now = until
+        self.seconds['dispatch'] += perf_counter() - start
+        self.seconds['heap_pop'] += pop_seconds
+        sim.events_processed += n
+        return n
+
+    def report(self):
+        names = self.sim.EVENT_NAMES
+        total_events = sum(self.counts)
+        s = self.seconds
+        handlers_total = sum(self.handler_seconds)
+        nested = s['heap_push'] + s['arrivals'] + s['sampling'] + s['resources']
+        event_types = {}
+        for i, name in enumerate(names):
+            count = self.counts[i]
+            event_types[name] = {
+                'count': count,
+                'seconds': self.handler_seconds[i],
+                'mean_us': self.handler_seconds[i] / count * 1e6 if count else 0.0,
+            }
+        histogram = {}
+        for bucket in sorted(self.heap_histogram):
+            lo, hi = (1 << bucket) >> 1, (1 << bucket) - 1
+            label = str(lo) if lo == hi else f'{lo}-{hi}'
+            histogram[label] = self.heap_histogram[bucket]
+        return {
+            'events': total_events,
+            'events_per_second': total_events / s['dispatch'] if s['dispatch'] > 0 else None,
+            'event_types': event_types,
+            'seconds': {
+                'dispatch': s['dispatch'],
+                'heap_pop': s['heap_pop'],
+                'heap_push': s['heap_push'],
+                'arrivals': s['arrivals'],
+                'sampling': s['sampling'],
+                'resources': s['resources'],
+                'handlers_other': max(0.0, handlers_total - nested),
+                'profiler_overhead': max(0.0, s['dispatch'] - s['heap_pop'] - handlers_total),
+            },
+            'calls': dict(self.calls),
+            'heap_size_histogram': histogram,
+            'queues': {name: stats.report('length') for name, stats in self.queues.items()},
+            'queue_samples': self.samples,
+        }
+
+
+def profile_run(sim):
+    """Run ``sim`` with an EventProfiler; returns its summary plus a ``profile`` section."""
+    profiler = EventProfiler(sim)
+    sim.profiler = profiler
+    out = sim.run()
+    out['profile'] = profiler.report()
+    return out
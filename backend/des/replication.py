@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Replication - run independent replications of an engine and summarize them
+Each replication gets its own seed derived from the base seed, so results do
+not depend on how replications are spread over worker processes. Antithetic
+pairs and common random numbers across scenarios reduce the variance of the
+estimates; both report the variance-reduction factor they achieved.
+Sequential runs add batches of replications until a target precision is met.
+"""
+import os
+import math
+import time
+import random
+import hashlib
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+
+# fewest replications worth a worker process in a lockstep (method 'batched') batch
+LOCKSTEP_SHARE = 32
+
+
+def replication_seed(base_seed, index):
+    """Seed for replication ``index``, derived by hashing (base_seed, index)."""
+    digest = hashlib.sha256(f'{base_seed}:{index}'.encode()).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def t_quantile(p, df):
+    """Quantile of Student's t distribution with ``df`` degrees of freedom."""
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        a = 2 * p - 1
+        return a * math.sqrt(2.0 / (4 * p * (1 - p)))
+    # Cornish-Fisher expansion around the normal quantile (A&S 26.7.5)
+    z = NormalDist().inv_cdf(p)
+    z2 = z * z
+    g1 = (z2 + 1) * z / 4
+    g2 = ((5 * z2 + 16) * z2 + 3) * z / 96
+    g3 = (((3 * z2 + 19) * z2 + 17) * z2 - 15) * z / 384
+    g4 = ((((79 * z2 + 776) * z2 + 1482) * z2 - 1920) * z2 - 945) * z / 92160
+    return z + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
+
+
+def mean_std_ci(values, confidence=0.95):
+    """Mean, sample standard deviation and t confidence interval of ``values``."""
+    n = len(values)
+    mean = sum(values) / n if n else 0.0
+    if n < 2:
+        return {'mean': mean, 'std': 0.0, 'ci_low': mean, 'ci_high': mean, 'half_width': 0.0, 'n': n}
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    std = math.sqrt(var)
+    half = t_quantile(0.5 + confidence / 2, n - 1) * std / math.sqrt(n)
+    return {'mean': mean, 'std': std, 'ci_low': mean - half, 'ci_high': mean + half, 'half_width': half, 'n': n}
+
+
+def summarize(results, confidence=0.95):
+    """Summarize every numeric output metric over a list of replication results.
+
+    Scalar metrics map to a ``mean_std_ci`` dict; list metrics (e.g. per-day
+    counts) are summarized element-wise into a list of such dicts.
+    """
+    metrics = {}
+    if not results:
+        return metrics
+    for key, first in results[0].items():
+        if isinstance(first, bool):
+            continue
+        if isinstance(first, (int, float)):
+            metrics[key] = mean_std_ci([float(r[key]) for r in results], confidence)
+        elif isinstance(first, list) and first and all(isinstance(v, (int, float)) for v in first):
+            metrics[key] = [mean_std_ci([float(r[key][i]) for r in results], confidence)
+                            for i in range(len(first))]
+    return metrics
+
+
+def _variance(values):
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean = sum(values) / n
+    return sum((v - mean) ** 2 for v in values) / (n - 1)
+
+
+def _scalar_metrics(result):
+    return [k for k, v in result.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+
+def _average(a, b):
+    """Element-wise mean of two results' numeric outputs."""
+    out = {}
+    for key, x in a.items():
+        y = b.get(key)
+        if isinstance(x, bool):
+            continue
+        if isinstance(x, (int, float)):
+            out[key] = (x + y) / 2
+        elif isinstance(x, list) and isinstance(y, list) and len(x) == len(y) \
+                and all(isinstance(v, (int, float)) for v in x + y):
+            out[key] = [(u + v) / 2 for u, v in zip(x, y)]
+    return out
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator > 0 else None
+
+
+def _run_one(job):
+    engine, params, seed = job
+    return engine(params, seed=seed)
+
+
+def _run_lockstep(job):
+    batched, params, seeds = job
+    return batched(params, seeds)
+
+
+def run_batch(engine, params, seeds, workers=None, pool=None):
+    """Run ``engine(params, seed=s)`` for every seed, in a process pool when workers > 1.
+
+    An existing executor can be passed as ``pool`` to avoid starting new
+    worker processes for every batch. An engine with a ``batched(params,
+    seeds)`` attribute runs whole seed lists in lockstep when ``params``
+    select ``method='batched'``; each worker then gets one share of the seeds.
+    """
+    workers = workers or os.cpu_count() or 1
+    batched = getattr(engine, 'batched', None)
+    if batched is not None and params.get('method') == 'batched':
+        shares = max(1, min(workers, len(seeds) // LOCKSTEP_SHARE))
+        size = max(1, -(-len(seeds) // shares))
+        jobs = [(batched, params, seeds[i:i + size]) for i in range(0, len(seeds), size)]
+        if len(jobs) <= 1:
+            return [r for job in jobs for r in _run_lockstep(job)]
+        if pool is not None:
+            parts = list(pool.map(_run_lockstep, jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+                parts = list(pool.map(_run_lockstep, jobs))
+        return [r for part in parts for r in part]
+    return run_jobs(engine, [(params, s) for s in seeds], workers=workers, pool=pool)
+
+
+def run_jobs(engine, jobs, workers=None, pool=None):
+    """Run ``engine(params, seed=s)`` for every ``(params, s)`` in ``jobs``, in order.
+
+    Unlike ``run_batch`` the jobs may differ in their params, so
+    replications of several configurations share one parallel map.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = [(engine, params, s) for params, s in jobs]
+    if len(jobs) <= 1 or (pool is None and workers <= 1):
+        return [_run_one(job) for job in jobs]
+    chunksize = max(1, len(jobs) // (workers * 4))
+    if pool is not None:
+        return list(pool.map(_run_one, jobs, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_one, jobs, chunksize=chunksize))
+
+
+def run_replications(engine, params, replications, seed=None, workers=None, confidence=0.95, pool=None,
+                     antithetic=False):
+    """Run ``replications`` independent replications and summarize the outputs.
+
+    ``engine`` must be a picklable module-level function with the
+    ``(params, seed=None)`` signature shared by bed_sim, clinic_sim and or_sim.
+    If ``seed`` is None a base seed is drawn and reported so the run can be
+    repeated.
+
+    With ``antithetic`` the replications are run as ``ceil(replications / 2)``
+    pairs sharing a seed, one member drawing from uniforms u and the other
+    from 1 - u. Metrics summarize the pair means, which are independent, and
+    ``variance_reduction`` gives per scalar metric the variance of a single
+    replication over twice the variance of a pair mean: how many independent
+    replications one antithetic replication is worth.
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    if not antithetic:
+        seeds = [replication_seed(seed, i) for i in range(replications)]
+        results = run_batch(engine, params, seeds, workers=workers, pool=pool)
+        return {
+            'replications': replications,
+            'seed': seed,
+            'confidence': confidence,
+            'metrics': summarize(results, confidence),
+        }
+
+    pairs = max(1, (replications + 1) // 2)
+    seeds = [replication_seed(seed, i) for i in range(pairs)]
+    first = run_batch(engine, {**params, 'variates': 'inverse'}, seeds, workers=workers, pool=pool)
+    second = run_batch(engine, {**params, 'variates': 'antithetic'}, seeds, workers=workers, pool=pool)
+    means = [_average(a, b) for a, b in zip(first, second)]
+    reduction = {}
+    for key in _scalar_metrics(means[0]):
+        single = _variance([float(r[key]) for r in first + second])
+        reduction[key] = _ratio(single, 2 * _variance([m[key] for m in means]))
+    return {
+        'replications': 2 * pairs,
+        'pairs': pairs,
+        'seed': seed,
+        'confidence': confidence,
+        'antithetic': True,
+        'metrics': summarize(means, confidence),
+        'variance_reduction': reduction,
+    }
+
+
+def compare_scenarios(engine, params_a, params_b, replications, seed=None, crn=True, workers=None,
+                      confidence=0.95, pool=None):
+    """Replicate two configurations and estimate the difference of every scalar metric (b - a).
+
+    With ``crn`` (common random numbers) both configurations run with
+    ``rng_streams='per_input'`` and the same replication seeds, so each input
+    (arrivals, LOS, priority flags, ...) sees the same sample path in both;
+    the outputs are then positively correlated and their noise largely
+    cancels in the per-replication differences.
+    ``variance_reduction`` is the variance the difference would have with
+    independent streams, ``var(a) + var(b)``, over the variance observed.
+    Without ``crn`` configuration b gets seeds of its own.
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    seeds_a = [replication_seed(seed, i) for i in range(replications)]
+    if crn:
+        params_a = {**params_a, 'rng_streams': 'per_input'}
+        params_b = {**params_b, 'rng_streams': 'per_input'}
+        seeds_b = seeds_a
+    else:
+        seeds_b = [replication_seed(f'{seed}/b', i) for i in range(replications)]
+    results_a = run_batch(engine, params_a, seeds_a, workers=workers, pool=pool)
+    results_b = run_batch(engine, params_b, seeds_b, workers=workers, pool=pool)
+    difference, reduction = {}, {}
+    for key in _scalar_metrics(results_a[0]):
+        a = [float(r[key]) for r in results_a]
+        b = [float(r[key]) for r in results_b]
+        diffs = [y - x for x, y in zip(a, b)]
+        difference[key] = mean_std_ci(diffs, confidence)
+        reduction[key] = _ratio(_variance(a) + _variance(b), _variance(diffs))
+    return {
+        'replications': replications,
+        'seed': seed,
+        'confidence': confidence,
+        'crn': crn,
+        'a': summarize(results_a, confidence),
+        'b': summarize(results_b, confidence),
+        'difference': difference,
+        'variance_reduction': reduction,
+    }
+
+
+def relative_half_width(ci):
+    """Half-width of a ``mean_std_ci`` interval relative to its mean (0 for a constant metric)."""
+    if ci['half_width'] == 0:
+        return 0.0
+    return ci['half_width'] / abs(ci['mean']) if ci['mean'] else math.inf
+
+
+def run_sequential(engine, params, target=0.05, metrics=None, seed=None, confidence=0.95, min_replications=10,
+                   max_replications=1000, max_seconds=None, workers=None, pool=None):
+    """Replicate in batches until every metric's relative CI half-width is at most ``target``.
+
+    ``metrics`` names the scalar outputs that must reach the target (default:
+    all of them). The first batch has ``min_replications`` replications;
+    each later one is sized from the current half-widths, which shrink as
+    1/sqrt(n), to the number still expected to be needed, but at least one
+    replication per worker and at most doubling the total, since early
+    variance estimates are noisy. Replication i uses the same seed as in
+    ``run_replications``, so a run is a prefix of a fixed-size one. The
+    run stops at ``max_replications`` or once ``max_seconds`` have passed,
+    with ``converged`` False.
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    workers = workers or os.cpu_count() or 1
+    own_pool = None
+    if pool is None and workers > 1:
+        pool = own_pool = ProcessPoolExecutor(max_workers=workers)
+    started = time.perf_counter()
+    results, batches = [], 0
+    size = min(max(2, min_replications), max_replications)
+    try:
+        while True:
+            seeds = [replication_seed(seed, i) for i in range(len(results), len(results) + size)]
+            results += run_batch(engine, params, seeds, workers=workers, pool=pool)
+            batches += 1
+            summary = summarize(results, confidence)
+            names = metrics or _scalar_metrics(results[0])
+            unknown = [m for m in names if not isinstance(summary.get(m), dict)]
+            if unknown:
+                raise ValueError(f'unknown or non-scalar metrics {unknown}; '
+                                 f'expected some of {_scalar_metrics(results[0])}')
+            precision = {m: relative_half_width(summary[m]) for m in names}
+            worst = max(precision.values(), default=0.0)
+            n = len(results)
+            if worst <= target:
+                stopped = 'precision'
+            elif n >= max_replications:
+                stopped = 'max_replications'
+            elif max_seconds is not None and time.perf_counter() - started >= max_seconds:
+                stopped = 'max_seconds'
+            else:
+                needed = n * (worst / target) ** 2 if math.isfinite(worst) else 2 * n
+                size = min(max_replications - n, n, max(workers, math.ceil(needed) - n))
+                continue
+            break
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+    return {
+        'replications': len(results),
+        'seed': seed,
+        'confidence': confidence,
+        'metrics': summary,
+        'sequential': {
+            'target_relative_half_width': target,
+            'relative_half_width': precision,
+            'converged': stopped == 'precision',
+            'stopped': stopped,
+            'batches': batches,
+            'seconds': time.perf_counter() - started,
+        },
+    }
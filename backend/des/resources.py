@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Resources - free-server pool and multi-class waiting queue shared by the DES engines
+Tracks which servers (doctors, ORs, beds) are idle and available and hands
+one out in O(log n) according to a selection policy; waiting patients are
+served by priority class, FIFO within a class.
+"""
+import heapq
+from collections import deque
+
+POLICIES = ('lowest', 'least_utilized', 'random')
+
+
+class ServerPool:
+    """Pool of ``n`` servers indexed 0..n-1.
+
+    A server is eligible when it is neither busy nor unavailable (e.g. on a
+    break). Engines call ``acquire()`` to take an eligible server and
+    ``release(idx)`` when its service ends; ``set_available(idx, flag)``
+    toggles breaks without touching an ongoing service. ``num_free`` and
+    ``num_busy`` are kept up to date in O(1).
+
+    Policies:
+    - 'lowest': lowest eligible index (min-heap of indices)
+    - 'least_utilized': least accumulated ``busy_time``, ties on index
+    - 'random': uniformly random eligible server, drawn from ``rng``
+    """
+
+    def __init__(self, n, policy='lowest', rng=None):
+        if policy not in POLICIES:
+            raise ValueError(f'unknown server policy {policy!r}, expected one of {POLICIES}')
+        if policy == 'random' and rng is None:
+            raise ValueError('random server policy needs an rng')
+        self.n = n
+        self.policy = policy
+        self.rng = rng
+        self.busy = [False] * n
+        self.available = [True] * n
+        self.busy_time = [0.0] * n
+        self.num_busy = 0
+        self.num_free = n
+        # lowest / least_utilized: heap with lazy deletion, queued marks a live entry
+        self.heap = []
+        self.queued = [False] * n
+        # random: eligible indices with O(1) swap-remove
+        self.free = []
+        self.pos = [-1] * n
+        for i in range(n):
+            self._add(i)
+
+    def _eligible(self, i):
+        return not self.busy[i] and self.available[i]
+
+    def _add(self, i):
+        if self.policy == 'random':
+            if self.pos[i] < 0:
+                self.pos[i] = len(self.free)
+                self.free.append(i)
+        elif not self.queued[i]:
+            self.queued[i] = True
+            if self.policy == 'lowest':
+                heapq.heappush(self.heap, i)
+            else:
+                heapq.heappush(self.heap, (self.busy_time[i], i))
+
+    def _remove(self, i):
+        # only the random policy removes eagerly; heap entries are skipped on pop
+        p = self.pos[i]
+        if p >= 0:
+            last = self.free.pop()
+            if last != i:
+                self.free[p] = last
+                self.pos[last] = p
+            self.pos[i] = -1
+
+    def acquire(self):
+        """Mark an eligible server busy and return its index, or None."""
+        if not self.num_free:
+            return None
+        if self.policy == 'random':
+            i = self.free[int(self.rng.random() * len(self.free))]
+            self._remove(i)
+        else:
+            heap = self.heap
+            lowest = self.policy == 'lowest'
+            busy = self.busy
+            available = self.available
+            while True:
+                entry = heapq.heappop(heap)
+                i = entry if lowest else entry[1]
+                self.queued[i] = False
+                if not busy[i] and available[i]:
+                    break
+        self.busy[i] = True
+        self.num_busy += 1
+        self.num_free -= 1
+        return i
+
+    def release(self, i):
+        """Mark server ``i`` idle; it becomes eligible again if available."""
+        self.busy[i] = False
+        self.num_busy -= 1
+        if self.available[i]:
+            self.num_free += 1
+            self._add(i)
+
+    def handoff(self, i):
+        """Server ``i`` ended a service with patients waiting: the server for the next one, or None.
+
+        That is ``i`` itself, kept busy, unless it was made unavailable
+        (e.g. removed by ``resize``) meanwhile; then it is released and
+        another eligible server, if any, is acquired instead.
+        """
+        if self.available[i]:
+            return i
+        self.release(i)
+        return self.acquire()
+
+    def set_available(self, i, flag):
+        """Start (False) or end (True) a break or other unavailability of server ``i``."""
+        if self.available[i] == flag:
+            return
+        self.available[i] = flag
+        if self.busy[i]:
+            return
+        if flag:
+            self.num_free += 1
+            self._add(i)
+        else:
+            self.num_free -= 1
+            if self.policy == 'random':
+                self._remove(i)
+
+    def resize(self, n):
+        """Grow or shrink the pool to ``n`` servers part way through a run.
+
+        Servers beyond ``n`` finish their current service and are then not
+        handed out again; growing first brings such servers back.
+        """
+        size = len(self.busy)
+        if n > size:
+            extra = n - size
+            self.busy += [False] * extra
+            self.available += [False] * extra
+            self.busy_time += [0.0] * extra
+            self.queued += [False] * extra
+            self.pos += [-1] * extra
+        for i in range(self.n, n):
+            self.set_available(i, True)
+        for i in range(n, self.n):
+            self.set_available(i, False)
+        self.n = n
+
+
+class ClassQueue:
+    """Waiting line with ``classes`` priority classes, FIFO within a class.
+
+    Class 0 is served first. ``push``, ``pop`` and ``discard`` (a patient
+    leaving the line, e.g. reneging) are O(1) amortized for a fixed number
+    of classes: a discarded entry stays in its deque and is skipped when it
+    reaches the front. Items must be hashable and unique while waiting.
+    ``len()`` counts the patients actually waiting.
+    """
+
+    def __init__(self, classes=1):
+        self.lines = [deque() for _ in range(classes)]
+        # item -> class of every patient waiting; discarded ones are dropped here only
+        self.waiting = {}
+        self.discarded = set()
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __bool__(self):
+        return bool(self.waiting)
+
+    def __contains__(self, item):
+        return item in self.waiting
+
+    def push(self, item, cls=0, since=0.0):
+        """Queue ``item`` in class ``cls``; ``since`` is returned with it by pop()."""
+        self.waiting[item] = cls
+        self.lines[cls].append((item, since))
+
+    def pop(self):
+        """(item, since) of the first patient of the highest-priority class that has one."""
+        discarded = self.discarded
+        for line in self.lines:
+            while line:
+                item, since = line.popleft()
+                if discarded and item in discarded:
+                    discarded.discard(item)
+                    continue
+                del self.waiting[item]
+                return item, since
+        raise IndexError('pop from an empty ClassQueue')
+
+    def discard(self, item):
+        """Remove ``item`` if it is still waiting; returns its class, or None."""
+        cls = self.waiting.pop(item, None)
+        if cls is not None:
+            self.discarded.add(item)
+        return cls
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+ResultCache - content-addressed cache of engine results
+A small in-memory LRU sits in front of an optional SQLite file. Keys hash the
+engine name, the engine's source version, the normalized params and the
+seed, so editing an engine makes its old entries unreachable.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+from collections import OrderedDict
+
+from engines import get_engine, engine_version, normalize_params
+from replication import run_replications
+
+
+def cache_key(engine, params, seed, replications=1, confidence=0.95):
+    """sha256 over everything that determines the result of a seeded run."""
+    get_engine(engine)
+    payload = {
+        'engine': engine,
+        'version': engine_version(engine),
+        'params': normalize_params(engine, params),
+        'seed': seed,
+        'replications': replications,
+    }
+    if replications > 1:
+        payload['confidence'] = confidence
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResultCache:
+    """Two-tier result cache: memory LRU, then SQLite on disk.
+
+    ``path`` None keeps the cache in memory only. The disk tier is trimmed
+    to ``max_disk_bytes`` by dropping the least recently used entries.
+    Unseeded runs are never cached since they are not reproducible.
+    """
+
+    def __init__(self, path=None, memory_items=256, max_disk_bytes=64 * 1024 * 1024):
+        self.memory = OrderedDict()
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path)
+            self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                            'size INTEGER NOT NULL, last_used REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+            self.db.commit()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Cached result for ``key``, or None."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return self.memory[key]
+        if self.db is not None:
+            row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.db.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+                self.db.commit()
+                value = json.loads(row[0])
+                self._remember(key, value)
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.db is None:
+            return
+        data = json.dumps(value, separators=(',', ':'))
+        self.db.execute('INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)',
+                        (key, data, len(data), time.time()))
+        self._evict()
+        self.db.commit()
+
+    def _evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        for key, size in self.db.execute('SELECT key, size FROM results ORDER BY last_used').fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+
+    def run(self, engine, params, seed=None, replications=1, confidence=0.95, workers=None, pool=None):
+        """Same result as running ``engine`` directly, served from the cache when possible."""
+        fn = get_engine(engine)
+        if seed is None:
+            if replications > 1:
+                return run_replications(fn, params, replications, workers=workers, confidence=confidence, pool=pool)
+            return fn(params)
+        key = cache_key(engine, params, seed, replications, confidence)
+        result = self.get(key)
+        if result is None:
+            if replications > 1:
+                result = run_replications(fn, params, replications, seed=seed, workers=workers,
+                                          confidence=confidence, pool=pool)
+            else:
+                result = fn(params, seed=seed)
+            self.put(key, result)
+        return result
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        out = {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'memory_items': len(self.memory),
+        }
+        if self.db is not None:
+            count, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+            out['disk_items'] = count
+            out['disk_bytes'] = size
+        return out
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
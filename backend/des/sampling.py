@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Sampling - block-buffered random draws for the DES engines
+With NumPy installed, draws are made in large vectorized blocks and handed
+out one at a time; without it, the engine's random.Random is used directly.
+Each stochastic input can draw from its own substream (common random numbers
+across scenarios), and draws can use antithetic uniforms.
+"""
+import math
+import random
+import hashlib
+
+from arrivals import PoissonArrivals, ProfileArrivals, RateProfile
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+BLOCK = 4096
+BACKENDS = ('auto', 'numpy', 'random')
+# 'shared': every input draws from one stream; 'per_input': one substream per input
+STREAMS = ('shared', 'per_input')
+# 'native': fastest transforms; 'inverse': inverse-CDF transforms of uniforms u;
+# 'antithetic': the same transforms of 1 - u
+VARIATES = ('native', 'inverse', 'antithetic')
+
+
+def substream_seed(seed, name):
+    """Seed of input ``name``'s substream: a hash of (seed, name)."""
+    digest = hashlib.sha256(f'{seed}/{name}'.encode()).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+class BlockDraws:
+    """Hands out values from blocks of ``block`` draws made by ``fill(n)``."""
+
+    def __init__(self, fill, block=BLOCK):
+        self.fill = fill
+        self.block = block
+        self.buf = []
+        self.i = 0
+
+    def __call__(self):
+        i = self.i
+        if i >= len(self.buf):
+            self.buf = self.fill(self.block).tolist()
+            i = 0
+        self.i = i + 1
+        return self.buf[i]
+
+
+def _numpy_exponential(gen, scale, n, variates):
+    if variates == 'native':
+        return gen.exponential(scale, n)
+    u = gen.random(n)
+    if variates == 'antithetic':
+        # -log(1 - u') with u' = 1 - u; random() can return 0.0
+        return -scale * np.log(np.maximum(u, 2.0 ** -53))
+    return -scale * np.log1p(-u)
+
+
+def lognormal_params(mean, cv):
+    """(mu, sigma) of the lognormal distribution with mean ``mean`` and coefficient of variation ``cv``."""
+    sigma2 = math.log1p(cv * cv)
+    return math.log(mean) - sigma2 / 2, math.sqrt(sigma2)
+
+
+class _NumpyExponential:
+    def __init__(self, gen, rate, variates='native'):
+        self.gen = gen
+        self.scale = 1.0 / rate
+        self.variates = variates
+
+    def __call__(self, n):
+        return _numpy_exponential(self.gen, self.scale, n, self.variates)
+
+
+class _NumpyBernoulli:
+    def __init__(self, gen, p, variates='native'):
+        self.gen = gen
+        self.p = p
+        self.antithetic = variates == 'antithetic'
+
+    def __call__(self, n):
+        u = self.gen.random(n)
+        return (1.0 - u if self.antithetic else u) < self.p
+
+
+class _NumpyLognormal:
+    def __init__(self, gen, mean, cv, variates='native'):
+        self.gen = gen
+        self.mu, self.sigma = lognormal_params(mean, cv)
+        # a standard normal's antithetic counterpart is its negation
+        self.sigma = -self.sigma if variates == 'antithetic' else self.sigma
+
+    def __call__(self, n):
+        return np.exp(self.mu + self.sigma * self.gen.standard_normal(n))
+
+
+class _RandomExponential:
+    def __init__(self, rng, rate, variates='native'):
+        self.rng = rng
+        self.rate = rate
+        self.antithetic = variates == 'antithetic'
+
+    def __call__(self):
+        if self.antithetic:
+            # expovariate is already the inverse transform -log(1 - u) / rate
+            return -math.log(self.rng.random() or 2.0 ** -53) / self.rate
+        return self.rng.expovariate(self.rate)
+
+
+class _RandomBernoulli:
+    def __init__(self, rng, p, variates='native'):
+        self.rng = rng
+        self.p = p
+        self.antithetic = variates == 'antithetic'
+
+    def __call__(self):
+        u = self.rng.random()
+        return (1.0 - u if self.antithetic else u) < self.p
+
+
+class _RandomLognormal:
+    def __init__(self, rng, mean, cv, variates='native'):
+        self.rng = rng
+        self.mu, self.sigma = lognormal_params(mean, cv)
+        self.sigma = -self.sigma if variates == 'antithetic' else self.sigma
+
+    def __call__(self):
+        return math.exp(self.mu + self.sigma * self.rng.normalvariate(0.0, 1.0))
+
+
+class BlockPoissonArrivals:
+    """NumPy counterpart of arrivals.PoissonArrivals.
+
+    Arrival times are produced a block at a time as the running time plus the
+    cumulative sum of exponential (optionally whole-minute) gaps.
+    """
+
+    def __init__(self, gen, rate_per_min, end, start=0.0, whole_minutes=False, limit=None, block=BLOCK,
+                 variates='native'):
+        self.gen = gen
+        self.variates = variates
+        self.rate_per_min = rate_per_min
+        self.end = end
+        self.t = start
+        self.whole_minutes = whole_minutes
+        self.remaining = limit
+        self.block = block
+        self.buf = []
+        self.i = 0
+
+    def refill(self):
+        gaps = _numpy_exponential(self.gen, 1.0 / self.rate_per_min, self.block, self.variates)
+        if self.whole_minutes:
+            gaps = np.maximum(1.0, np.rint(gaps))
+        times = self.t + np.cumsum(gaps)
+        self.t = float(times[-1])
+        self.buf = times.tolist()
+        self.i = 0
+
+    def next_time(self):
+        """Next arrival time, or None once the stream is exhausted."""
+        if self.rate_per_min <= 0 or self.remaining == 0:
+            return None
+        if self.i >= len(self.buf):
+            self.refill()
+        t = self.buf[self.i]
+        self.i += 1
+        if t >= self.end:
+            self.rate_per_min = 0
+            return None
+        if self.remaining is not None:
+            self.remaining -= 1
+        return t
+
+
+def invert_intensity(profile, x, cum=None, rates=None):
+    """Times at which ``profile``'s cumulative intensity reaches each value of the array ``x``."""
+    cum = np.asarray(profile.cum) if cum is None else cum
+    rates = np.asarray(profile.rates) if rates is None else rates
+    k, rest = np.divmod(x, profile.cycle)
+    j = np.minimum(np.searchsorted(cum, rest, side='right') - 1, profile.last)
+    return (k * len(rates) + j) * profile.slot + (rest - cum[j]) / rates[j]
+
+
+class BlockProfileArrivals:
+    """NumPy counterpart of arrivals.ProfileArrivals.
+
+    A block of unit-rate Poisson points is mapped through the profile's
+    inverse cumulative intensity with one vectorized searchsorted.
+    """
+
+    def __init__(self, gen, profile, end, start=0.0, limit=None, block=BLOCK, variates='native'):
+        self.gen = gen
+        self.variates = variates
+        self.profile = profile
+        self.end = end
+        self.x = profile.intensity(start)
+        self.remaining = limit
+        self.block = block
+        self.done = profile.cycle <= 0
+        if not self.done:
+            self.cum = np.asarray(profile.cum)
+            self.rates = np.asarray(profile.rates)
+        self.buf = []
+        self.i = 0
+
+    def refill(self):
+        x = self.x + np.cumsum(_numpy_exponential(self.gen, 1.0, self.block, self.variates))
+        self.x = float(x[-1])
+        self.buf = invert_intensity(self.profile, x, self.cum, self.rates).tolist()
+        self.i = 0
+
+    def next_time(self):
+        """Next arrival time, or None once the stream is exhausted."""
+        if self.done or self.remaining == 0:
+            return None
+        if self.i >= len(self.buf):
+            self.refill()
+        t = self.buf[self.i]
+        self.i += 1
+        if t >= self.end:
+            self.done = True
+            return None
+        if self.remaining is not None:
+            self.remaining -= 1
+        return t
+
+
+class Sampler:
+    """Factory for the random draws of one engine instance.
+
+    ``backend`` is 'auto' (NumPy if installed), 'numpy' or 'random'. The
+    NumPy generator is seeded from ``seed``, so runs stay reproducible per
+    backend; the 'random' backend reproduces the engine's ``rng`` draws.
+
+    Every factory takes the ``stream`` name of the input it samples
+    (arrivals, los, emergent, ...). With ``streams='per_input'`` each name
+    gets its own generator seeded from (seed, name), so two scenarios run
+    with the same seed consume the same numbers for the same input even
+    when a change shifts how many draws another input makes. ``variates``
+    selects native transforms, inverse transforms of u, or of 1 - u; an
+    antithetic pair is one 'inverse' and one 'antithetic' run.
+    """
+
+    def __init__(self, rng, seed=None, backend='auto', block=BLOCK, streams='shared', variates='native'):
+        if backend not in BACKENDS:
+            raise ValueError(f'unknown sampler backend {backend!r}, expected one of {BACKENDS}')
+        if backend == 'numpy' and np is None:
+            raise ImportError('sampler backend "numpy" requires numpy')
+        if streams not in STREAMS:
+            raise ValueError(f'unknown rng_streams {streams!r}, expected one of {STREAMS}')
+        if variates not in VARIATES:
+            raise ValueError(f'unknown variates {variates!r}, expected one of {VARIATES}')
+        self.rng = rng
+        self.block = block
+        self.gen = np.random.default_rng(seed) if np is not None and backend != 'random' else None
+        self.backend = 'numpy' if self.gen is not None else 'random'
+        self.streams = streams
+        self.variates = variates
+        if streams == 'per_input' and seed is None:
+            seed = rng.getrandbits(64)
+        self.seed = seed
+        self.substreams = {}
+
+    def stream(self, name):
+        """(random.Random, NumPy generator or None) that input ``name`` draws from."""
+        if self.streams == 'shared':
+            return self.rng, self.gen
+        if name not in self.substreams:
+            seed = substream_seed(self.seed, name)
+            gen = np.random.default_rng(seed) if self.gen is not None else None
+            self.substreams[name] = (random.Random(seed), gen)
+        return self.substreams[name]
+
+    def exponential(self, rate, stream=None):
+        """Callable returning one exponential draw with the given rate per call."""
+        rng, gen = self.stream(stream)
+        if gen is None:
+            return _RandomExponential(rng, rate, self.variates)
+        return BlockDraws(_NumpyExponential(gen, rate, self.variates), self.block)
+
+    def lognormal(self, mean, cv, stream=None):
+        """Callable returning one lognormal draw with the given mean and coefficient of variation."""
+        rng, gen = self.stream(stream)
+        if gen is None:
+            return _RandomLognormal(rng, mean, cv, self.variates)
+        return BlockDraws(_NumpyLognormal(gen, mean, cv, self.variates), self.block)
+
+    def bernoulli(self, p, stream=None):
+        """Callable returning True with probability ``p`` per call."""
+        rng, gen = self.stream(stream)
+        if gen is None:
+            return _RandomBernoulli(rng, p, self.variates)
+        return BlockDraws(_NumpyBernoulli(gen, p, self.variates), self.block)
+
+    def poisson_arrivals(self, rate_per_min, end, start=0.0, whole_minutes=False, limit=None, stream='arrivals',
+                         profile=None):
+        """Arrival source with the arrivals.PoissonArrivals interface.
+
+        ``profile`` is a list of hourly rate multipliers (see
+        arrivals.RateProfile) for a non-homogeneous process.
+        """
+        rng, gen = self.stream(stream)
+        if profile is not None:
+            if whole_minutes:
+                raise ValueError('whole-minute gaps are not supported with an arrival profile')
+            profile = RateProfile(rate_per_min, profile)
+            if gen is None:
+                return ProfileArrivals(rng, profile, end, start=start, limit=limit,
+                                       antithetic=self.variates == 'antithetic')
+            return BlockProfileArrivals(gen, profile, end, start=start, limit=limit, block=self.block,
+                                        variates=self.variates)
+        if gen is None:
+            return PoissonArrivals(rng, rate_per_min, end, start=start, whole_minutes=whole_minutes,
+                                   limit=limit, antithetic=self.variates == 'antithetic')
+        return BlockPoissonArrivals(gen, rate_per_min, end, start=start, whole_minutes=whole_minutes,
+                                    limit=limit, block=self.block, variates=self.variates)
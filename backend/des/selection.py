@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Selection - pick the best of many configurations with OCBA allocation
+Equal replications per configuration spend most of the budget on clearly
+bad ones. After a few replications each, every further batch goes where it
+most raises the probability of correct selection (Chen et al.'s optimal
+computing budget allocation): to the current best and to its close
+contenders, in proportion to their variance over their squared gap.
+
+    python selection.py clinic examples/clinic_input.json --grid num_doctors=3:12 \
+        --metric avg_wait_minutes --cost num_doctors=2 --seed 1
+"""
+import os
+import re
+import json
+import math
+import time
+import random
+import itertools
+from argparse import ArgumentParser
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+
+from engines import get_engine, ENGINES
+from replication import replication_seed, run_jobs, mean_std_ci
+from capacity import target_value
+
+GOALS = ('min', 'max')
+# "[factor *] metric [/ denominator]", e.g. "1000 * blocked / admitted"
+METRIC = re.compile(r'^\s*(?:([-+0-9.eE]+)\s*\*\s*)?(\w+)\s*(?:/\s*(\w+))?\s*$')
+# a standard deviation below this share of the mean's scale counts as 0
+TINY = 1e-12
+
+
+def parse_metric(text):
+    """(factor, metric, denominator or None) of a metric such as ``1000 * blocked / admitted``."""
+    m = METRIC.match(text)
+    if not m:
+        raise ValueError(f'cannot parse metric {text!r}; expected e.g. "avg_wait_minutes" '
+                         f'or "1000 * blocked / admitted"')
+    factor, metric, per = m.groups()
+    return (float(factor) if factor else 1.0), metric, per
+
+
+def parse_grid(specs):
+    """Candidate overrides: the product of ``key=a:b[:step]`` (inclusive) or ``key=v1,v2,...`` specs."""
+    axes = []
+    for spec in specs:
+        key, sep, values = spec.partition('=')
+        if not sep or not key:
+            raise ValueError(f'cannot parse grid {spec!r}; expected key=a:b[:step] or key=v1,v2')
+        if ':' in values:
+            bounds = [int(v) for v in values.split(':')]
+            if len(bounds) not in (2, 3) or (len(bounds) == 3 and bounds[2] < 1):
+                raise ValueError(f'cannot parse range {values!r}; expected a:b or a:b:step')
+            axes.append([(key.strip(), v) for v in range(bounds[0], bounds[1] + 1, bounds[2] if len(bounds) == 3 else 1)])
+        else:
+            axes.append([(key.strip(), json.loads(v)) for v in values.split(',')])
+    return [dict(combo) for combo in itertools.product(*axes)] if axes else []
+
+
+def candidate_name(config):
+    return config.get('name') or ','.join(f'{k}={v}' for k, v in config.items())
+
+
+def ocba_allocation(means, stds, counts, budget, indifference=0.0):
+    """Extra replications per candidate (summing to ``budget``) by the OCBA rule, for minimization.
+
+    With b the best sample mean and d_i = mean_i - mean_b, the asymptotically
+    optimal shares are N_i ~ (s_i / d_i)^2 for i != b and
+    N_b = s_b * sqrt(sum N_i^2 / s_i^2). Gaps are floored at ``indifference``
+    (and a tiny value) so near-ties do not absorb the whole budget. The
+    shares are scaled to the new total and each candidate gets its shortfall;
+    when the shortfalls exceed ``budget`` they are cut in proportion.
+    """
+    k = len(means)
+    b = min(range(k), key=means.__getitem__)
+    scale = max(1.0, max(abs(m) for m in means))
+    floor = max(indifference, TINY * scale)
+    weights = [0.0] * k
+    for i in range(k):
+        if i != b:
+            weights[i] = (stds[i] / max(means[i] - means[b], floor)) ** 2
+    if stds[b] > TINY * scale:
+        weights[b] = stds[b] * math.sqrt(sum(weights[i] ** 2 / stds[i] ** 2
+                                              for i in range(k) if i != b and stds[i] > TINY * scale))
+    total = sum(weights)
+    if total <= 0:
+        # every variance is zero: nothing to learn, spread evenly
+        weights, total = [1.0] * k, float(k)
+    target = sum(counts) + budget
+    shortfall = [max(0.0, w / total * target - n) for w, n in zip(weights, counts)]
+    need = sum(shortfall)
+    if need <= 0:
+        shortfall, need = weights, total
+    exact = [budget * s / need for s in shortfall]
+    extra = [int(x) for x in exact]
+    # largest remainders get the replications lost to rounding down
+    for i in sorted(range(k), key=lambda i: extra[i] - exact[i])[:budget - sum(extra)]:
+        extra[i] += 1
+    return extra
+
+
+def pcs_bonferroni(means, stds, counts, indifference=0.0, covariances=None):
+    """Approximate probability that the best sample mean is truly best (within ``indifference``).
+
+    1 - sum over i != b of P(candidate i beats b by more than the
+    indifference), with normal sample means: a lower bound on the PCS.
+    ``covariances[i]`` is the covariance of the sample means of i and the
+    best, nonzero under common random numbers; it is subtracted (twice)
+    from the variance of their difference. Also returns each candidate's
+    probability of beating the best.
+    """
+    k = len(means)
+    b = min(range(k), key=means.__getitem__)
+    beats = [0.0] * k
+    for i in range(k):
+        if i == b:
+            continue
+        shared = covariances[i] if covariances else 0.0
+        se = math.sqrt(max(0.0, stds[b] ** 2 / counts[b] + stds[i] ** 2 / counts[i] - 2 * shared))
+        gap = means[i] - means[b]
+        if se > 0:
+            beats[i] = NormalDist().cdf(-(gap + indifference) / se)
+        else:
+            beats[i] = 0.0 if gap + indifference > 0 else 0.5
+    return max(0.0, 1.0 - sum(beats)), beats
+
+
+def mean_covariances(values, means):
+    """Covariance of each candidate's sample mean with the best one's under common random numbers.
+
+    Replication r of every candidate shares a seed, so two means over n_b
+    and n_i replications are correlated through their first
+    m = min(n_b, n_i) pairs: Cov = m * c / (n_b * n_i), with c the
+    covariance of those pairs around the full-sample means.
+    """
+    b = min(range(len(means)), key=means.__getitem__)
+    best, mb = values[b], means[b]
+    out = [0.0] * len(values)
+    for i, (v, mi) in enumerate(zip(values, means)):
+        m = min(len(v), len(best))
+        if i == b or m < 2:
+            continue
+        c = sum((x - mi) * (y - mb) for x, y in zip(v, best)) / (m - 1)
+        out[i] = m * c / (len(v) * len(best))
+    return out
+
+
+def select_best(engine, params, candidates, metric, goal='min', costs=None, seed=None, confidence=0.95,
+                initial_replications=10, batch=None, budget=None, target_pcs=0.95, indifference=0.0,
+                max_seconds=None, crn=True, workers=None, pool=None):
+    """Best of ``candidates`` (override dicts on ``params``) for ``engine`` by OCBA sequential allocation.
+
+    The objective of a replication is ``metric`` (see ``parse_metric``)
+    with ``costs[key] * value`` of every costed input key as a penalty:
+    added when ``goal`` is 'min', subtracted when it is 'max', so a costly
+    candidate never gains from its cost. Every candidate first gets
+    ``initial_replications``; then batches of ``batch`` (default: two per
+    worker, at least 10) are allocated by OCBA and run together in parallel.
+    The run stops once the estimated PCS reaches ``target_pcs``, at
+    ``budget`` replications in total (default 50 per candidate) or after
+    ``max_seconds``. With ``crn`` replication i of every candidate uses
+    the same seed and per-input random streams.
+    """
+    if goal not in GOALS:
+        raise ValueError(f'unknown goal {goal!r}, expected one of {GOALS}')
+    if len(candidates) < 2:
+        raise ValueError('selection needs at least two candidates')
+    factor, name, per = parse_metric(metric)
+    costs = costs or {}
+    sign = 1.0 if goal == 'min' else -1.0
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    workers = workers or os.cpu_count() or 1
+    k = len(candidates)
+    initial_replications = max(2, initial_replications)
+    batch = batch or max(10, 2 * workers)
+    budget = max(budget or 50 * k, initial_replications * k)
+    configs = [{key: v for key, v in c.items() if key != 'name'} for c in candidates]
+    base = {**params, 'rng_streams': 'per_input'} if crn else params
+    runs = [{**base, **c} for c in configs]
+    unknown = sorted({key for key in costs for run in runs if key not in run})
+    if unknown:
+        raise ValueError(f'costed keys {unknown} are missing from the input or candidates')
+
+    def objective(i, result):
+        value = factor * target_value(result, name, per)
+        return value + sign * sum(w * float(runs[i][key]) for key, w in costs.items())
+
+    own_pool = None
+    if pool is None and workers > 1:
+        pool = own_pool = ProcessPoolExecutor(max_workers=workers)
+    started = time.perf_counter()
+    values = [[] for _ in range(k)]
+    extra, rounds = [initial_replications] * k, 0
+    try:
+        while True:
+            jobs, owners = [], []
+            for i, n in enumerate(extra):
+                start = len(values[i])
+                for r in range(start, start + n):
+                    # without CRN each candidate draws its own seeds
+                    jobs.append((runs[i], replication_seed(seed, r) if crn else replication_seed(f'{seed}/{i}', r)))
+                    owners.append(i)
+            for i, result in zip(owners, run_jobs(engine, jobs, workers=workers, pool=pool)):
+                values[i].append(sign * objective(i, result))
+            rounds += 1
+            counts = [len(v) for v in values]
+            means = [sum(v) / len(v) for v in values]
+            stds = [math.sqrt(sum((x - mean) ** 2 for x in v) / (len(v) - 1)) for v, mean in zip(values, means)]
+            pcs, beats = pcs_bonferroni(means, stds, counts, indifference,
+                                        mean_covariances(values, means) if crn else None)
+            spent = sum(counts)
+            if pcs >= target_pcs:
+                stopped = 'pcs'
+            elif spent >= budget:
+                stopped = 'budget'
+            elif max_seconds is not None and time.perf_counter() - started >= max_seconds:
+                stopped = 'max_seconds'
+            else:
+                extra = ocba_allocation(means, stds, counts, min(batch, budget - spent), indifference)
+                continue
+            break
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+    ranking = []
+    for i in sorted(range(k), key=means.__getitem__):
+        ci = mean_std_ci([sign * x for x in values[i]], confidence)
+        ranking.append({
+            'name': candidate_name(candidates[i]),
+            'config': configs[i],
+            'replications': counts[i],
+            'mean': ci['mean'],
+            'std': ci['std'],
+            'ci_low': ci['ci_low'],
+            'ci_high': ci['ci_high'],
+            'p_beats_best': round(beats[i], 6),
+        })
+    return {
+        'best': ranking[0],
+        'pcs': round(pcs, 6),
+        'metric': metric,
+        'costs': costs,
+        'goal': goal,
+        'candidates': k,
+        'replications': spent,
+        'equal_share': math.ceil(spent / k),
+        'rounds': rounds,
+        'stopped': stopped,
+        'seed': seed,
+        'crn': crn,
+        'confidence': confidence,
+        'seconds': round(time.perf_counter() - started, 3),
+        'ranking': ranking,
+    }
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('engine', choices=sorted(ENGINES))
+    p.add_argument('input', help='path to input JSON (the base configuration)')
+    p.add_argument('--candidates', help='path to a JSON list (or {"candidates": [...]}) of input overrides', default=None)
+    p.add_argument('--grid', action='append', default=[],
+                   help='key=a:b[:step] or key=v1,v2,...; repeat for a product grid')
+    p.add_argument('--metric', required=True, help='e.g. "avg_wait_minutes" or "1000 * blocked / admitted"')
+    p.add_argument('--cost', action='append', default=[], help='key=weight added per unit of an input key')
+    p.add_argument('--goal', choices=GOALS, default='min')
+    p.add_argument('--seed', type=int, help='seed', default=None)
+    p.add_argument('--confidence', type=float, default=0.95)
+    p.add_argument('--initial-replications', type=int, help='replications of every candidate first', default=10)
+    p.add_argument('--batch', type=int, help='replications allocated per round', default=None)
+    p.add_argument('--budget', type=int, help='replications in total at most (default 50 per candidate)',
+                   default=None)
+    p.add_argument('--pcs', type=float, help='stop at this probability of correct selection', default=0.95)
+    p.add_argument('--indifference', type=float, help='differences smaller than this count as ties', default=0.0)
+    p.add_argument('--max-seconds', type=float, default=None)
+    p.add_argument('--no-crn', action='store_true', help='independent seeds per candidate')
+    p.add_argument('--workers', type=int, help='worker processes (default: all cores)', default=None)
+    args = p.parse_args()
+    with open(args.input, 'r') as f:
+        params = json.load(f)
+    try:
+        candidates = []
+        if args.candidates:
+            with open(args.candidates, 'r') as f:
+                candidates = json.load(f)
+            if isinstance(candidates, dict):
+                candidates = candidates['candidates']
+        candidates += parse_grid(args.grid)
+        costs = {}
+        for spec in args.cost:
+            key, sep, weight = spec.partition('=')
+            if not sep:
+                raise ValueError(f'cannot parse cost {spec!r}; expected key=weight')
+            costs[key.strip()] = float(weight)
+        out = select_best(get_engine(args.engine), params, candidates, args.metric, goal=args.goal, costs=costs,
+                          seed=args.seed, confidence=args.confidence,
+                          initial_replications=args.initial_replications, batch=args.batch, budget=args.budget,
+                          target_pcs=args.pcs, indifference=args.indifference, max_seconds=args.max_seconds,
+                          crn=not args.no_crn, workers=args.workers)
+    except ValueError as e:
+        p.error(str(e))
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
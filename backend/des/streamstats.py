@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+StreamStats - constant-memory summary statistics for DES outputs
+Welford mean/variance, min/max and a log-bucketed quantile sketch, updated
+in O(1) per observation without storing the observations.
+"""
+import math
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class QuantileSketch:
+    """Relative-error quantile sketch over non-negative values (DDSketch style).
+
+    Values above ``min_value`` fall into logarithmic buckets of ratio
+    ``gamma = (1 + alpha) / (1 - alpha)``, so every estimated quantile is within
+    a relative error ``alpha`` of a true sample value. Values at or below
+    ``min_value`` (e.g. zero waits) share one bucket. The bucket count grows
+    only with the log of the value range, never with the number of values.
+    """
+
+    def __init__(self, alpha=0.01, min_value=1e-3):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.inv_log_gamma = 1.0 / math.log(self.gamma)
+        self.min_value = min_value
+        self.zero_count = 0
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        if x <= self.min_value:
+            self.zero_count += 1
+        else:
+            k = math.ceil(math.log(x) * self.inv_log_gamma)
+            self.buckets[k] = self.buckets.get(k, 0) + 1
+
+    def merge(self, other):
+        """Add the counts of ``other`` (same ``alpha`` and ``min_value``)."""
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for k, c in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + c
+
+    def quantile(self, q):
+        """Estimate of the ``q`` quantile (0..1), or 0.0 when empty."""
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                return 2.0 * self.gamma ** k / (self.gamma + 1)
+        return 2.0 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class StreamingStats:
+    """Welford mean/variance, min/max and quantiles of a stream of values."""
+
+    def __init__(self, alpha=0.01):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch(alpha)
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        self.sketch.add(x)
+
+    def merge(self, other):
+        """Fold in the values summarized by ``other`` (Chan et al.'s pairwise update)."""
+        if not other.n:
+            return
+        n = self.n + other.n
+        d = other.mean - self.mean
+        self.mean += d * other.n / n
+        self.m2 += other.m2 + d * d * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def quantile(self, q):
+        """Sketch estimate of the ``q`` quantile, clamped to the observed range."""
+        if self.n == 0:
+            return 0.0
+        return min(self.max, max(self.min, self.sketch.quantile(q)))
+
+    def report(self, name, digits=1):
+        """Flat summary keys ``avg_<name>``, ``std_<name>``, ``p50_<name>`` ... ``max_<name>``."""
+        out = {
+            f'avg_{name}': round(float(self.mean), digits) if self.n else 0.0,
+            f'std_{name}': round(self.std, digits),
+        }
+        for p in PERCENTILES:
+            out[f'p{p}_{name}'] = round(float(self.quantile(p / 100.0)), digits)
+        out[f'max_{name}'] = round(float(self.max), digits) if self.n else 0.0
+        return out
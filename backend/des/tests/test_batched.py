@@ -0,0 +1,20 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import batched
+from engines import get_engine
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+
+@pytest.mark.parametrize('engine', ['bed', 'clinic'])
+def test_batched_agrees_with_des(engine):
+    with open(os.path.join(EXAMPLES, f'{engine}_input.json')) as f:
+        params = json.load(f)
+    out = batched.validate(get_engine(engine), params, replications=40, seed=1)
+    failed = {k: v for k, v in out['metrics'].items() if v['z'] > out['z_limit']}
+    assert out['agree'], failed
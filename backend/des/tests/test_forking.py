@@ -0,0 +1,34 @@
+import json
+import os
+
+from bed_des import DISCHARGE
+from forking import warm_up
+from kernel import Simulation
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+
+def test_shrinking_beds_with_a_queue_respects_new_capacity():
+    with open(os.path.join(EXAMPLES, 'bed_input.json')) as f:
+        params = json.load(f)
+    # 120 beds are overloaded: a long queue is waiting at the fork
+    sim = Simulation.restore(warm_up('bed', {**params, 'num_beds': 120}, 20 * 24 * 60, seed=1))
+    assert len(sim.queue) > 0 and sim.beds.num_busy == 120
+    sim.apply_params({'num_beds': 80})
+    sim.reset_stats()
+    # stays begun before the fork may keep removed beds busy until they end
+    drained = max(t for t, _, etype, _ in sim.events if etype == DISCHARGE)
+
+    starts = []
+    start_stay = sim.start_stay
+
+    def recorded(now, bed, patient, wait=0.0):
+        start_stay(now, bed, patient, wait)
+        starts.append((now, bed, sim.beds.num_busy))
+    sim.start_stay = recorded
+    out = sim.run()
+
+    assert starts
+    assert all(bed < 80 for _, bed, _ in starts)
+    assert max(busy for now, _, busy in starts if now >= drained) <= 80
+    assert out['avg_occupancy_percent'] <= 100.0
@@ -0,0 +1,17 @@
+import json
+import os
+
+from bed_des import bed_sim
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+
+def test_bed_profile_samples_class_queue():
+    with open(os.path.join(EXAMPLES, 'bed_input.json')) as f:
+        params = json.load(f)
+    # few beds, so patients wait in the ClassQueue
+    out = bed_sim({**params, 'num_beds': 150, 'max_wait_hours': 12}, seed=1, profile=True)
+    profile = out['profile']
+    assert set(profile['queues']) == {'queue'}
+    assert 0 < profile['queues']['queue']['max_length'] <= out['max_queue_length']
+    assert all('queue' in sample for sample in profile['queue_samples'])
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Timeseries - incremental time-weighted averages and bucketed level series
+A level (busy servers, queue length) is piecewise constant between events,
+so its time integral is extended only when it changes: O(1) per change plus
+one step per bucket boundary crossed, with no event log kept.
+"""
+import math
+from array import array
+
+SERIES = ('none', 'hour', 'day')
+HOUR_MINUTES = 60.0
+
+
+class TimeWeighted:
+    """Time integral of a piecewise-constant level, in total and per bucket.
+
+    Only [``start``, ``end``) is integrated. With ``bucket`` set, the
+    integral is also split into buckets of that many minutes from
+    ``start``, kept in a compact ``array('d')``.
+    """
+    __slots__ = ('level', 'peak', 'start', 'end', 'last', 'total', 'bucket', 'area')
+
+    def __init__(self, level=0, start=0.0, end=math.inf, bucket=None):
+        self.level = self.peak = level
+        self.start = self.last = start
+        self.end = end
+        self.total = 0.0
+        self.bucket = bucket
+        if bucket:
+            if not math.isfinite(end):
+                raise ValueError('a bucketed level needs a finite end')
+            self.area = array('d', bytes(8 * max(1, int(math.ceil((end - start) / bucket)))))
+        else:
+            self.area = None
+
+    def update(self, now, level):
+        """The level becomes ``level`` at time ``now``."""
+        self.advance(now)
+        self.level = level
+        if level > self.peak:
+            self.peak = level
+
+    def advance(self, now):
+        """Integrate the current level up to ``now``."""
+        t, end = self.last, min(now, self.end)
+        if end > t:
+            level = self.level
+            self.total += level * (end - t)
+            area = self.area
+            if area is not None and level:
+                start, bucket, n = self.start, self.bucket, len(area)
+                while t < end:
+                    b = min(int((t - start) // bucket), n - 1)
+                    stop = min(end, start + (b + 1) * bucket)
+                    if stop <= t:
+                        # t sits on a boundary that rounding put in the earlier bucket
+                        b += 1
+                        stop = min(end, start + (b + 1) * bucket)
+                    area[b] += level * (stop - t)
+                    t = stop
+        if now > self.last:
+            self.last = now
+
+    def mean(self):
+        """Exact time average over [start, min(last, end))."""
+        span = min(self.last, self.end) - self.start
+        return self.total / span if span > 0 else float(self.level)
+
+    def series(self):
+        """Per-bucket time averages; the last bucket is averaged over its part before ``end``."""
+        start, bucket, n = self.start, self.bucket, len(self.area)
+        out = [a / bucket for a in self.area]
+        tail = self.end - (start + (n - 1) * bucket)
+        if 0 < tail < bucket:
+            out[-1] = self.area[-1] / tail
+        return out
+
+
+class SeriesRecorder:
+    """Time-weighted averages of an engine's ``levels()``, in total and per bucket.
+
+    Each handler is wrapped on the instance to read the levels after it
+    runs; a level that changed is handed to its TimeWeighted accumulator,
+    which integrates the old value up to the event. Only [now, ``end``) is
+    recorded.
+    """
+
+    def __init__(self, sim, bucket, end):
+        self.bucket = bucket
+        self.end = end
+        levels = sim.levels()
+        self.names = list(levels)
+        self.levels = [TimeWeighted(level, start=sim.now, end=end, bucket=bucket) for level in levels.values()]
+        for name in sim.EVENT_HANDLERS:
+            setattr(sim, name, self._recording(sim, getattr(sim, name)))
+
+    def _recording(self, sim, handler):
+        levels, accumulators = sim.levels, self.levels
+
+        def recorded(now, data):
+            handler(now, data)
+            for acc, level in zip(accumulators, levels().values()):
+                if level != acc.level:
+                    acc.update(now, level)
+        return recorded
+
+    def finish(self):
+        """Carry every level to ``end``: nothing changes after the last event."""
+        for acc in self.levels:
+            acc.advance(self.end)
+
+    def series(self):
+        """Level name -> list of per-bucket time averages."""
+        self.finish()
+        return {name: acc.series() for name, acc in zip(self.names, self.levels)}
+
+    def averages(self):
+        """Level name -> exact time average over the recorded span."""
+        self.finish()
+        return {name: acc.mean() for name, acc in zip(self.names, self.levels)}
+
+    def report(self, digits=3):
+        self.finish()
+        return {
+            'bucket_minutes': self.bucket,
+            'time_average': {name: round(acc.mean(), 4) for name, acc in zip(self.names, self.levels)},
+            'max': {name: acc.peak for name, acc in zip(self.names, self.levels)},
+            'levels': {name: [round(v, digits) for v in acc.series()] for name, acc in zip(self.names, self.levels)},
+        }
+
+
+def series_runner(sim, run):
+    """``run`` wrapped to add the ``series`` output when the engine's ``series`` param asks for it.
+
+    'hour' buckets by 60 minutes, 'day' by the engine's minutes per day.
+    The exact time average of every level is also added as a top-level
+    ``avg_<level>`` metric, so replications summarize it.
+    """
+    what = sim.params.get('series', 'none')
+    if what not in SERIES:
+        raise ValueError(f'unknown series {what!r}, expected one of {SERIES}')
+    if what == 'none':
+        return run
+    bucket = HOUR_MINUTES if what == 'hour' else sim.total_minutes / sim.sim_duration_days
+
+    def recorded(s):
+        recorder = SeriesRecorder(s, bucket, s.total_minutes)
+        out = run(s)
+        report = recorder.report()
+        for name, mean in report['time_average'].items():
+            out[f'avg_{name}'] = mean
+        out['series'] = report
+        return out
+    return recorded
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Worker - long-lived DES worker speaking JSON lines over stdin/stdout
+Each input line is one request; each output line is one compact JSON response.
+"""
+import sys
+import json
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from engines import get_engine
+from replication import run_replications, run_sequential
+from result_cache import ResultCache
+
+
+def handle(request, workers=None, pool=None, cache=None):
+    """Run one request and return its result.
+
+    ``{"engine": "bed"|"clinic"|"or", "params": {...}, "seed": 42, "replications": 1}``
+    returns the engine summary, or the replication summary when
+    ``replications`` > 1. With ``"target_precision": 0.05`` (and optionally
+    ``"metrics"``, ``"max_replications"``) replications are added until the
+    relative CI half-widths reach the target; such runs are not cached.
+    ``{"op": "ping"}`` returns ``{"pong": true}`` and
+    ``{"op": "cache_stats"}`` the hit/miss counters of ``cache``.
+    """
+    op = request.get('op', 'run')
+    if op == 'ping':
+        return {'pong': True}
+    if op == 'cache_stats':
+        return cache.stats() if cache is not None else None
+    if op != 'run':
+        raise ValueError(f'unknown op {op!r}')
+    name = request.get('engine')
+    engine = get_engine(name)
+    params = request.get('params') or {}
+    seed = request.get('seed')
+    replications = int(request.get('replications', 1))
+    target = request.get('target_precision')
+    if target is not None:
+        return run_sequential(engine, params, float(target), metrics=request.get('metrics'), seed=seed,
+                              max_replications=int(request.get('max_replications', 1000)),
+                              workers=workers, pool=pool)
+    if cache is not None:
+        return cache.run(name, params, seed=seed, replications=replications, workers=workers, pool=pool)
+    if replications > 1:
+        return run_replications(engine, params, replications, seed=seed, workers=workers, pool=pool)
+    return engine(params, seed=seed)
+
+
+def serve(infile=sys.stdin, outfile=sys.stdout, workers=None, cache=None):
+    """Answer requests from ``infile`` until EOF or ``{"op": "shutdown"}``.
+
+    Responses are ``{"id": ..., "ok": true, "result": ...}`` or
+    ``{"id": ..., "ok": false, "error": "..."}`` and are written in request
+    order, so clients may pipeline any number of requests. Replications
+    share one process pool, started on first use and kept warm. Seeded
+    runs are answered from ``cache`` (a ResultCache) when one is given.
+    """
+    pool = None
+
+    def write(response):
+        outfile.write(json.dumps(response, separators=(',', ':')) + '\n')
+        outfile.flush()
+
+    try:
+        for line in iter(infile.readline, ''):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('request must be a JSON object')
+            except ValueError as e:
+                write({'id': None, 'ok': False, 'error': f'bad request: {e}'})
+                continue
+            rid = request.get('id')
+            if request.get('op') == 'shutdown':
+                write({'id': rid, 'ok': True, 'result': None})
+                break
+            try:
+                replicated = int(request.get('replications', 1)) > 1 or request.get('target_precision') is not None
+                if pool is None and replicated and workers != 1:
+                    pool = ProcessPoolExecutor(max_workers=workers)
+                result = handle(request, workers=workers, pool=pool, cache=cache)
+            except Exception as e:
+                write({'id': rid, 'ok': False, 'error': f'{type(e).__name__}: {e}'})
+            else:
+                write({'id': rid, 'ok': True, 'result': result})
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('--workers', type=int, help='worker processes for replications (default: all cores)', default=None)
+    p.add_argument('--cache', help='SQLite file for cached results (default: memory only)', default=None)
+    p.add_argument('--no-cache', action='store_true', help='always run the engine')
+    args = p.parse_args()
+    cache = None if args.no_cache else ResultCache(args.cache)
+    try:
+        serve(workers=args.workers, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+const { log } = require("../utils/logger");
+
+// Client for the local Python DES job service (backend/des/jobservice.py)
+const DES_JOB_SERVICE_URL =
+  process.env.DES_JOB_SERVICE_URL || "http://127.0.0.1:8765";
+
+class DESJobClient {
+  constructor(baseUrl = DES_JOB_SERVICE_URL) {
+    this.baseUrl = baseUrl.replace(/\/$/, "");
+  }
+
+  async request(method, path, body) {
+    const res = await fetch(`${this.baseUrl}${path}`, {
+      method,
+      headers: body ? { "Content-Type": "application/json" } : undefined,
+      body: body ? JSON.stringify(body) : undefined,
+    });
+    const payload = await res.json();
+    if (!res.ok) {
+      const err = new Error(payload.error || `DES job service returned ${res.status}`);
+      err.status = res.status;
+      throw err;
+    }
+    return payload;
+  }
+
+  // engine: "bed" | "clinic" | "or"
+  async submitJob({ engine, params = {}, seed = null, replications = 1 }) {
+    const job = await this.request("POST", "/jobs", {
+      engine,
+      params,
+      seed,
+      replications,
+    });
+    log(`DES job ${job.id} queued (${engine}, ${replications} replication(s))`);
+    return job;
+  }
+
+  async getJob(jobId) {
+    return this.request("GET", `/jobs/${jobId}`);
+  }
+
+  async cancelJob(jobId) {
+    return this.request("DELETE", `/jobs/${jobId}`);
+  }
+
+  async stats() {
+    return this.request("GET", "/stats");
+  }
+
+  // Follow the job's NDJSON event stream until it finishes; resolves with the final job
+  async waitForJob(jobId, onEvent = () => {}) {
+    const res = await fetch(`${this.baseUrl}/jobs/${jobId}/events`);
+    if (!res.ok) {
+      throw new Error(`DES job service returned ${res.status}`);
+    }
+    const decoder = new TextDecoder();
+    let buffered = "";
+    for await (const chunk of res.body) {
+      buffered += decoder.decode(chunk, { stream: true });
+      let newline;
+      while ((newline = buffered.indexOf("\n")) >= 0) {
+        const line = buffered.slice(0, newline).trim();
+        buffered = buffered.slice(newline + 1);
+        if (line) onEvent(JSON.parse(line));
+      }
+    }
+    const job = await this.getJob(jobId);
+    if (job.status === "failed") {
+      throw new Error(`DES job ${jobId} failed: ${job.error}`);
+    }
+    return job;
+  }
+}
+
+module.exports = new DESJobClient();
@@ -1,6 +1,6 @@
 const Simulation = require("../models/Simulation");
 const AuditLog = require("../models/AuditLog");
-const { log, info, error } = require("../utils/logger");
+const { log, info, warn, error } = require("../utils/logger");
 const DynamoDBService = require("./DynamoDBService");
 
 // Clear engine cache to ensure latest code is used
@@ -12,6 +12,7 @@ delete require.cache[
 delete require.cache[require.resolve("./simulationEngines/orSchedulingEngine")];
 
 const Engines = require("./simulationEngines");
+const DESJobClient = require("./DESJobClient");
 const priorityMap = { high: 3, medium: 2, low: 1 };
 const typeResourceMap = {
   emergency: { beds: 1, doctors: 2, nurses: 2, treatMean: 75 },
@@ -22,6 +23,123 @@ const typeResourceMap = {
 
 const { v4: uuidv4 } = require("uuid");
 
+// Engines run as jobs on the Python DES job service (backend/des/jobservice.py)
+const DES_JOB_TIMEOUT_MS = Number(process.env.DES_JOB_TIMEOUT_MS) || 120000;
+const DES_REPLICATIONS = 10;
+// Treatment times of 10 or less are days, as in the JS engines
+const toMinutes = (value) => (value <= 10 ? value * 24 * 60 : value);
+const arrivalsPerHour = (parameters) =>
+  (Number(
+    parameters.emergencyPatientsPerHour || parameters.emergencyArrivalsPerHour
+  ) || 0) +
+  (Number(parameters.clinicPatientsPerHour || parameters.clinicArrivalsPerHour) ||
+    0);
+
+// engine key -> Python engine, request parameters -> its input, its output -> summary
+const desEngines = {
+  engineA: {
+    engine: "clinic",
+    params: (parameters) => ({
+      num_doctors: Math.max(1, Math.floor(Number(parameters.doctors) || 1)),
+      clinic_minutes_per_day: (Number(parameters.durationHours) || 8) * 60,
+      sim_duration_days: 1,
+      avg_arrivals_per_hour: arrivalsPerHour(parameters),
+      avg_consult_minutes: Number(parameters.avgServiceMinutes) || 30,
+      // the queueing engine has no registration desk or appointments
+      registration_minutes: 0,
+      pct_scheduled: 0,
+      no_show_pct: 0,
+    }),
+    summary: (metric, params) => ({
+      avgWaitMinutes: metric("avg_wait_minutes"),
+      patientsServed: metric("patients_seen_per_day"),
+      overallUtilizationPct: metric("doctor_util_percent"),
+      servers: params.num_doctors,
+      simulatedHours: (params.clinic_minutes_per_day * params.sim_duration_days) / 60,
+    }),
+  },
+  engineB: {
+    engine: "bed",
+    params: (parameters) => {
+      const emergency =
+        Number(
+          parameters.emergencyPatientsPerHour ||
+            parameters.emergencyArrivalsPerHour
+        ) || 0;
+      const total = arrivalsPerHour(parameters);
+      const emergencyMinutes = toMinutes(
+        Number(
+          parameters.avgTreatmentMinutesEmergency ||
+            parameters.avgEmergencyServiceMinutes
+        ) || 15
+      );
+      const clinicMinutes = toMinutes(
+        Number(
+          parameters.avgTreatmentMinutesClinic ||
+            parameters.avgClinicServiceMinutes
+        ) || 25
+      );
+      const pctEmergent = total > 0 ? emergency / total : 0;
+      return {
+        num_beds: Number(parameters.totalBeds || parameters.beds) || 15,
+        arrival_rate_per_hour: total,
+        avg_los_days:
+          (pctEmergent * emergencyMinutes + (1 - pctEmergent) * clinicMinutes) /
+          (24 * 60),
+        pct_emergent: pctEmergent,
+        // BedDES runs whole 24-hour days (an integer input, and its day
+        // series and warm-up count days), so the window is rounded up;
+        // stays of a few hours would not be discharged within a shorter one
+        sim_duration_days: Math.max(
+          1,
+          Math.ceil((Number(parameters.durationHours) || 8) / 24)
+        ),
+      };
+    },
+    summary: (metric, params) => ({
+      avgWaitMinutes: metric("avg_wait_minutes"),
+      patientsServed: metric("admitted"),
+      overallUtilizationPct: metric("avg_occupancy_percent"),
+      beds: params.num_beds,
+      simulatedHours: params.sim_duration_days * 24,
+    }),
+  },
+  engineC: {
+    engine: "or",
+    params: (parameters) => ({
+      num_ors: Math.max(1, Math.floor(Number(parameters.operatingRooms) || 1)),
+      or_minutes_per_day: (Number(parameters.durationHours) || 8) * 60,
+      sim_duration_days: 1,
+      avg_arrivals_per_hour:
+        Number(parameters.surgeriesPerHour) ||
+        (Number(parameters.scheduledSurgeriesPerDay) || 0) / 24,
+      avg_case_minutes: Number(parameters.avgSurgeryMinutes) || 90,
+    }),
+    summary: (metric, params) => ({
+      avgWaitMinutes: metric("avg_wait_minutes"),
+      patientsServed: metric("cases_scheduled"),
+      overallUtilizationPct: metric("or_utilization_percent"),
+      operatingRooms: params.num_ors,
+      simulatedHours: (params.or_minutes_per_day * params.sim_duration_days) / 60,
+    }),
+  },
+};
+
+// Mean of a job result's metric; per-day lists are summed
+const jobMetric = (result) => (key) => {
+  const value = result.metrics ? result.metrics[key] : result[key];
+  const mean = (v) => (v && typeof v === "object" ? v.mean : v);
+  if (Array.isArray(value)) {
+    return value.reduce((sum, v) => sum + (Number(mean(v)) || 0), 0);
+  }
+  return mean(value);
+};
+
+// fetch rejects with a TypeError when nothing listens on the service URL
+const isUnreachable = (err) =>
+  (err instanceof TypeError && err.message === "fetch failed") ||
+  err.cause?.code === "ECONNREFUSED";
+
 const getRandomExponential = (rate) => -Math.log(1 - Math.random()) / rate;
 
 class SimulationService {
@@ -41,6 +159,68 @@ class SimulationService {
     return result.summary;
   }
 
+  // Run one engine as a DES job and map the job result to the engines' { summary, details } shape
+  async runDESJob(key, parameters) {
+    const spec = desEngines[key];
+    const params = spec.params(parameters);
+    const replications =
+      Math.floor(Number(parameters.replications)) || DES_REPLICATIONS;
+    const job = await DESJobClient.submitJob({
+      engine: spec.engine,
+      params,
+      seed: parameters.seed ?? null,
+      replications,
+    });
+    let timer;
+    const timeout = new Promise((_, reject) => {
+      timer = setTimeout(
+        () => reject(new Error(`DES job ${job.id} timed out`)),
+        DES_JOB_TIMEOUT_MS
+      );
+    });
+    let done;
+    try {
+      done = await Promise.race([DESJobClient.waitForJob(job.id), timeout]);
+    } catch (err) {
+      await DESJobClient.cancelJob(job.id).catch(() => {});
+      throw err;
+    } finally {
+      clearTimeout(timer);
+    }
+    if (done.status !== "done") {
+      throw new Error(`DES job ${job.id} ended ${done.status}`);
+    }
+    return {
+      summary: { engine: key, ...spec.summary(jobMetric(done.result), params) },
+      details: {
+        desEngine: spec.engine,
+        desJobId: job.id,
+        replications,
+        params,
+        result: done.result,
+      },
+    };
+  }
+
+  // Run an engine through the DES job service; fall back to the in-process JS engine when it is not running
+  async runEngine(key, parameters) {
+    if (desEngines[key]) {
+      try {
+        return await this.runDESJob(key, parameters);
+      } catch (err) {
+        if (!isUnreachable(err)) throw err;
+        warn(
+          `DES job service unreachable (${err.message}); running ${key} in-process`
+        );
+      }
+    }
+    const engineImpl = Engines.getEngine(key);
+    if (!engineImpl || !engineImpl.simulate) {
+      throw new Error(`Engine ${key} not found or invalid`);
+    }
+    return engineImpl.simulate(parameters);
+  }
+
   async processRequest(requestId, operatorId, engineKey = null) {
     console.log(
       `\n[SIMULATION] ========== Starting simulation process ==========`
@@ -117,16 +297,12 @@ class SimulationService {
         `[SIMULATION]   [${i + 1}/${engines.length}] Running ${key}...`
       );
       try {
-        const engineImpl = Engines.getEngine(key);
-        if (!engineImpl || !engineImpl.simulate) {
-          throw new Error(`Engine ${key} not found or invalid`);
-        }
         console.log(
           `[SIMULATION]   [${key}] Parameters:`,
           JSON.stringify(parameters, null, 2)
         );
 
-        const outcome = engineImpl.simulate(parameters);
+        const outcome = await this.runEngine(key, parameters);
         console.log(`[SIMULATION]   [${key}] ✓ Simulation complete`);
         console.log(`[SIMULATION]   [${key}] Results:`, {
           avgWaitMinutes: outcome.summary?.avgWaitMinutes,
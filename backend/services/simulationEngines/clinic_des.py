@@ -3,39 +3,45 @@
 ClinicDES - simple discrete-event simulation of a clinic using minutes as base unit.
 Reads parameters from JSON file and prints JSON summary.
 """
+import os
 import sys
 import json
-import heapq
 import argparse
 import random
 import math
 from collections import deque, defaultdict
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'des'))
+from kernel import Simulation
+from arrivals import DailyGridArrivals
+from sampling import Sampler
+from resources import ServerPool
+from streamstats import StreamingStats
+from replication import run_replications
+from profiler import profile_run
+from eventtrace import trace_run
+
 # Event types
-ARRIVAL = 'ARRIVAL'
-REG_COMPLETE = 'REG_COMPLETE'
-SERVICE_START = 'SERVICE_START'
-SERVICE_END = 'SERVICE_END'
-BREAK_START = 'BREAK_START'
-BREAK_END = 'BREAK_END'
+ARRIVAL = 0
+REG_COMPLETE = 1
+SERVICE_START = 2
+SERVICE_END = 3
+BREAK_START = 4
+BREAK_END = 5
 
 def read_input(path):
     with open(path) as f:
         return json.load(f)
 
-class Event:
-    def __init__(self, time, etype, payload=None):
-        self.time = time
-        self.etype = etype
-        self.payload = payload or {}
-    def __lt__(self, other):
-        return self.time < other.time
+class ClinicDES(Simulation):
+    EVENT_NAMES = ('ARRIVAL', 'REG_COMPLETE', 'SERVICE_START', 'SERVICE_END', 'BREAK_START', 'BREAK_END')
+    EVENT_HANDLERS = ('on_arrival', 'on_reg_complete', 'on_service_start', 'on_service_end', 'on_break_start', 'on_break_end')
 
-class ClinicDES:
     def __init__(self, params, seed=None):
+        super().__init__()
         self.p = params
-        if seed is not None:
-            random.seed(seed)
+        # per-instance stream so replications can run side by side
+        self.rng = random.Random(seed)
         # simulation clock in minutes
         self.day_minutes = int(self.p.get('clinic_minutes_per_day', 480))
         self.sim_duration_days = int(self.p.get('sim_duration_days', 7))
@@ -46,15 +52,10 @@ class ClinicDES:
         # queues
         self.reg_queue = deque()
         self.doc_queue = deque()
-        # event queue
-        self.events = []
         # stats
-        self.wait_times = []
+        self.waits = StreamingStats()
         self.max_queue = 0
         self.patients_seen_daily = defaultdict(int)
-        self.doctor_busy_until = [0]*self.num_doctors
-        self.doctor_available = [True]*self.num_doctors
-        self.total_doctor_busy = [0]*self.num_doctors
         # for registration
         self.registration_minutes = int(self.p.get('registration_minutes', 5))
         # arrivals
@@ -64,137 +65,143 @@ class ClinicDES:
         # scheduled vs walk-in
         self.pct_scheduled = float(self.p.get('pct_scheduled', 0.3))
         self.no_show_pct = float(self.p.get('no_show_pct', 0.05))
+        # random draws: NumPy blocks when available, else self.rng
+        self.sampler = Sampler(self.rng, seed, backend=self.p.get('sampler', 'auto'),
+                               streams=self.p.get('rng_streams', 'shared'), variates=self.p.get('variates', 'native'))
+        self.draw_no_show = self.sampler.bernoulli(self.no_show_pct, stream='no_show')
+        # doctors: free-server pool tracking busy and on-break state
+        self.doctors = ServerPool(self.num_doctors, self.p.get('server_policy', 'lowest'), self.sampler.stream('servers')[0])
 
-    def schedule_event(self, event):
-        heapq.heappush(self.events, event)
-
-    def generate_arrivals(self):
-        # scheduled appointments per day
+    def init_arrivals(self):
+        # scheduled appointments uniformly across the clinic day
         expected_per_day = int(round(self.avg_arrivals_per_hour * (self.day_minutes/60.0)))
         scheduled_per_day = int(round(expected_per_day * self.pct_scheduled))
-        # schedule scheduled appointments uniformly across the clinic day
-        for d in range(self.sim_duration_days):
-            day_offset = d * self.day_minutes
-            for i in range(scheduled_per_day):
-                t = day_offset + int((i+0.5) * (self.day_minutes / max(1, scheduled_per_day)))
-                # apply no-show later when processing arrival
-                self.schedule_event(Event(t, ARRIVAL, {'scheduled': True}))
+        self.scheduled_arrivals = DailyGridArrivals(self.day_minutes, scheduled_per_day, self.sim_duration_days)
         # unscheduled arrivals: Poisson process for remainder
         total_expected = self.avg_arrivals_per_hour * (self.day_minutes/60.0) * self.sim_duration_days
         unscheduled_expected = max(0, int(round(total_expected)) - scheduled_per_day*self.sim_duration_days)
-        # generate via exponential interarrival
-        t = 0
-        while t < self.duration_minutes and unscheduled_expected>0:
-            # rate per minute
-            lam = max(1e-6, self.avg_arrivals_per_hour/60.0*(1-self.pct_scheduled))
-            inter = random.expovariate(lam)
-            t += max(1, int(round(inter)))
-            if t < self.duration_minutes:
-                self.schedule_event(Event(t, ARRIVAL, {'scheduled': False}))
-                unscheduled_expected -= 1
-
-    def schedule_doctor_breaks(self):
-        # schedule one break per doctor per day at mid-day
-        for d in range(self.sim_duration_days):
-            day_offset = d * self.day_minutes
-            break_start = day_offset + self.day_minutes//2
-            for doc in range(self.num_doctors):
-                self.schedule_event(Event(break_start, BREAK_START, {'doc': doc}))
-                self.schedule_event(Event(break_start + self.doctor_break_minutes, BREAK_END, {'doc': doc}))
-
-    def find_free_doctor(self, now):
-        for i in range(self.num_doctors):
-            if self.doctor_available[i] and self.doctor_busy_until[i] <= now:
-                return i
-        return None
-
-    def run(self):
-        self.generate_arrivals()
-        self.schedule_doctor_breaks()
-        # main loop
-        while self.events:
-            evt = heapq.heappop(self.events)
-            now = evt.time
-            et = evt.etype
-            payload = evt.payload
-            if et == ARRIVAL:
-                # handle scheduled no-shows
-                if payload.get('scheduled') and random.random() < self.no_show_pct:
-                    continue
-                # registration stage
-                reg_complete_time = now + self.registration_minutes
-                self.schedule_event(Event(reg_complete_time, REG_COMPLETE, {'arrival_time': now}))
-            elif et == REG_COMPLETE:
-                arrival_time = payload['arrival_time']
-                # join doctor queue timestamp arrival_time
-                self.doc_queue.append({'arrival_time': arrival_time, 'reg_complete': now})
-                self.max_queue = max(self.max_queue, len(self.doc_queue))
-                # try start service if doctor free
-                doc = self.find_free_doctor(now)
-                if doc is not None and self.doc_queue:
-                    patient = self.doc_queue.popleft()
-                    # start service
-                    self.schedule_event(Event(now, SERVICE_START, {'doc': doc, 'patient': patient}))
-            elif et == SERVICE_START:
-                doc = payload['doc']
-                patient = payload['patient']
-                # assign doctor
-                self.doctor_available[doc] = False
-                service_time = int(round(self.avg_consult_minutes))
-                end_time = now + service_time
-                self.doctor_busy_until[doc] = end_time
-                self.total_doctor_busy[doc] += service_time
-                # record wait
-                wait = now - patient['reg_complete']
-                self.wait_times.append(wait)
-                # schedule end
-                self.schedule_event(Event(end_time, SERVICE_END, {'doc': doc, 'arrival_day': patient['arrival_time']//self.day_minutes}))
-            elif et == SERVICE_END:
-                doc = payload['doc']
-                day = payload.get('arrival_day', 0)
-                self.patients_seen_daily[day] += 1
-                # mark doctor free
-                self.doctor_available[doc] = True
-                # if queue waiting, start next
-                if self.doc_queue:
-                    patient = self.doc_queue.popleft()
-                    self.schedule_event(Event(now, SERVICE_START, {'doc': doc, 'patient': patient}))
-            elif et == BREAK_START:
-                doc = payload['doc']
-                # mark doctor unavailable
-                self.doctor_available[doc] = False
-                # if doctor was in middle of service, we do NOT interrupt (breaks scheduled at idle in realistic, but keep simple)
-            elif et == BREAK_END:
-                doc = payload['doc']
-                self.doctor_available[doc] = True
-                # try to start service if queue
-                if self.doc_queue:
-                    patient = self.doc_queue.popleft()
-                    self.schedule_event(Event(now, SERVICE_START, {'doc': doc, 'patient': patient}))
+        lam = max(1e-6, self.avg_arrivals_per_hour/60.0*(1-self.pct_scheduled))
+        self.walkin_arrivals = self.sampler.poisson_arrivals(lam, self.duration_minutes, start=0,
+                                                             whole_minutes=True, limit=unscheduled_expected)
+
+    def schedule_next_arrival(self, scheduled):
+        # one pending arrival per stream; no-shows are applied when the arrival fires
+        source = self.scheduled_arrivals if scheduled else self.walkin_arrivals
+        t = source.next_time()
+        if t is not None:
+            self.schedule(t, ARRIVAL, scheduled)
+
+    def schedule_doctor_break(self, day, doc):
+        # one break per doctor per day at mid-day; the next day's break is scheduled when this one ends
+        if day < self.sim_duration_days:
+            break_start = day * self.day_minutes + self.day_minutes//2
+            self.schedule(break_start, BREAK_START, doc)
+
+    def start_waiting(self, now):
+        # hand waiting patients to free doctors
+        while self.doc_queue and self.doctors.num_free:
+            doc = self.doctors.acquire()
+            patient = self.doc_queue.popleft()
+            self.schedule(now, SERVICE_START, (doc, patient))
+
+    def on_arrival(self, now, scheduled):
+        self.schedule_next_arrival(scheduled)
+        # handle scheduled no-shows
+        if scheduled and self.draw_no_show():
+            return
+        # registration stage
+        self.schedule(now + self.registration_minutes, REG_COMPLETE, now)
+
+    def on_reg_complete(self, now, arrival_time):
+        # join doctor queue as (arrival_time, reg_complete)
+        self.doc_queue.append((arrival_time, now))
+        self.max_queue = max(self.max_queue, len(self.doc_queue))
+        # try start service if doctor free
+        self.start_waiting(now)
+
+    def on_service_start(self, now, data):
+        doc, (arrival_time, reg_complete) = data
+        # doctor was acquired from the pool when the patient was assigned
+        service_time = int(round(self.avg_consult_minutes))
+        end_time = now + service_time
+        self.doctors.busy_time[doc] += service_time
+        # record wait
+        self.waits.add(now - reg_complete)
+        # schedule end
+        self.schedule(end_time, SERVICE_END, (doc, arrival_time//self.day_minutes))
+
+    def on_service_end(self, now, data):
+        doc, day = data
+        self.patients_seen_daily[day] += 1
+        # mark doctor free (stays unavailable if a break started during service)
+        self.doctors.release(doc)
+        # if queue waiting, start next
+        self.start_waiting(now)
+
+    def on_break_start(self, now, doc):
+        # mark doctor unavailable
+        self.doctors.set_available(doc, False)
+        self.schedule(now + self.doctor_break_minutes, BREAK_END, doc)
+        # if doctor was in middle of service, we do NOT interrupt (breaks scheduled at idle in realistic, but keep simple)
+
+    def on_break_end(self, now, doc):
+        self.doctors.set_available(doc, True)
+        self.schedule_doctor_break(int(now // self.day_minutes) + 1, doc)
+        # try to start service if queue
+        self.start_waiting(now)
+
+    def start(self):
+        self.init_arrivals()
+        self.schedule_next_arrival(True)
+        self.schedule_next_arrival(False)
+        for doc in range(self.num_doctors):
+            self.schedule_doctor_break(0, doc)
+
+    def trace_fields(self, etype, data):
+        # patients carry no id here; record the doctor where there is one
+        if etype == SERVICE_START or etype == SERVICE_END:
+            return data[0], -1, 0
+        if etype == BREAK_START or etype == BREAK_END:
+            return data, -1, 0
+        return -1, -1, 0
+
+    def summary(self):
         # compute stats
-        avg_wait = sum(self.wait_times)/len(self.wait_times) if self.wait_times else 0.0
         # doctor utilization percent per doctor over simulated minutes
         util_percents = []
         for i in range(self.num_doctors):
-            util = self.total_doctor_busy[i] / (self.duration_minutes) if self.duration_minutes>0 else 0
+            util = self.doctors.busy_time[i] / (self.duration_minutes) if self.duration_minutes>0 else 0
             util_percents.append(util*100)
         doctor_util_percent = sum(util_percents)/len(util_percents) if util_percents else 0
         patients_seen_per_day = [self.patients_seen_daily[d] for d in range(self.sim_duration_days)]
         return {
-            'avg_wait_minutes': round(avg_wait,1),
+            **self.waits.report('wait_minutes'),
             'doctor_util_percent': round(doctor_util_percent,1),
             'patients_seen_per_day': patients_seen_per_day,
             'max_queue_length': int(self.max_queue)
         }
 
+def clinic_sim(params, seed=None, profile=False, trace=None):
+    sim = ClinicDES(params, seed=seed)
+    run = profile_run if profile else ClinicDES.run
+    return trace_run(sim, trace, run, {'seed': seed}) if trace else run(sim)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='input JSON file')
     parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--replications', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--trace', default=None)
     args = parser.parse_args()
+    if (args.profile or args.trace) and args.replications > 1:
+        parser.error('--profile and --trace run a single replication')
     params = read_input(args.input)
-    sim = ClinicDES(params, seed=args.seed)
-    out = sim.run()
+    if args.replications > 1:
+        out = run_replications(clinic_sim, params, args.replications, seed=args.seed, workers=args.workers)
+    else:
+        out = clinic_sim(params, seed=args.seed, profile=args.profile, trace=args.trace)
     print(json.dumps(out, indent=2))
 
 if __name__ == '__main__':